@@ -0,0 +1,48 @@
+"""
+Synthetic data shared by the benchmarks
+"""
+import numpy as np
+import pandas as pd
+
+
+def make_norm_data(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Normalised DAPI/EdU/H3P intensities as produced by normalise
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'integrated_int_DAPI_norm': rng.lognormal(np.log(2.5), 0.5, n),
+        'intensity_mean_EdU_nucleus_norm': rng.lognormal(np.log(2), 0.8, n),
+        'intensity_mean_H3P_nucleus_norm': rng.lognormal(np.log(2), 1, n),
+    })
+
+
+def make_intensity_data(n: int, n_cell_lines: int = 4, seed: int = 0) -> pd.DataFrame:
+    """
+    Raw DAPI and EdU intensities with a 2N and 4N peak per cell line
+    """
+    rng = np.random.default_rng(seed)
+    cell_line = rng.integers(0, n_cell_lines, n)
+    ploidy = np.where(rng.random(n) < 0.6, 1, 2)
+    g1_peak = 1e6 * (1 + cell_line / 4)
+    return pd.DataFrame({
+        'cell_line': pd.Series([f"line_{i}" for i in range(n_cell_lines)]).to_numpy()[cell_line],
+        'integrated_int_DAPI': rng.normal(g1_peak * ploidy, 0.08 * g1_peak * ploidy),
+        'intensity_mean_EdU_nucleus': rng.lognormal(np.log(500), 0.9, n),
+    })
+
+
+def make_prop_data(n_conditions: int, n_wells: int = 4, n_cell_lines: int = 2, seed: int = 0) -> pd.DataFrame:
+    """
+    Cell cycle proportions per well as produced by cellcycle_prop, control condition 'SCR'
+    """
+    rng = np.random.default_rng(seed)
+    phases = ['G1', 'S', 'G2/M', 'Polyploid', 'Sub-G1']
+    conditions = ['SCR'] + [f"cond_{i}" for i in range(1, n_conditions)]
+    index = pd.MultiIndex.from_product([[f"line_{i}" for i in range(n_cell_lines)], conditions,
+                                        [f"C{i}" for i in range(n_wells)], phases],
+                                       names=['cell_line', 'condition', 'well', 'cell_cycle'])
+    df = index.to_frame(index=False)
+    df.insert(0, 'plate_id', 1001)
+    df['percent'] = rng.uniform(0, 50, len(df))
+    return df
@@ -0,0 +1,113 @@
+"""
+Benchmarks for agg_multinucleates and delete_duplicates with string and categorical keys.
+Run with asv (asv run) or directly: python -m benchmarks.bench_aggregation
+"""
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis.normalisation import agg_multinucleates, delete_duplicates
+
+
+def make_multinucleate_data(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    image = np.sort(rng.integers(0, max(n // 500, 1), n))
+    data = {
+        'experiment': 'exp1',
+        'well': np.array([f"{row}{col}" for row in 'CDEF' for col in range(2, 12)])[image % 40],
+        'cell_line': np.array(['HELA', 'RPE-1', 'U2OS'])[image % 3],
+        'condition': np.array(['CTR', 'DRUG1', 'DRUG2', 'DRUG3'])[(image // 3) % 4],
+        'plate_id': 1,
+        'image_id': image,
+        'Cyto_ID': rng.integers(0, 450, n),
+        'integrated_int_DAPI': rng.normal(1e6, 1e5, n),
+        'area_nucleus': rng.normal(150, 20, n),
+    }
+    for channel in ('DAPI', 'EdU', 'H3P'):
+        for stat in ('mean', 'max', 'min'):
+            data[f'intensity_{stat}_{channel}_nucleus'] = rng.normal(1e4, 1e3, n)
+    return pd.DataFrame(data)
+
+
+def legacy_agg_multinucleates(df: pd.DataFrame) -> pd.DataFrame:
+    num_cols = list(df.select_dtypes(include=['float64', 'int64']).columns)
+    str_cols = list(df.select_dtypes(include=['object', 'string']).columns)
+    agg_functions = {}
+    for col in num_cols:
+        if col in ['integrated_int_DAPI', 'area_nucleus']:
+            agg_functions[col] = 'sum'
+        elif 'max' in col and 'nucleus' in col:
+            agg_functions[col] = 'max'
+        elif 'min' in col and 'nucleus' in col:
+            agg_functions[col] = 'min'
+        else:
+            agg_functions[col] = 'mean'
+    return df.groupby(str_cols + ['image_id', 'Cyto_ID'], as_index=False).agg(agg_functions)
+
+
+def legacy_delete_duplicates(df: pd.DataFrame) -> pd.DataFrame:
+    temp_data = pd.DataFrame()
+    for image in df["image_id"].unique():
+        image_data = df.loc[df.image_id == image].drop_duplicates()
+        temp_data = pd.concat([temp_data, image_data])
+    return temp_data
+
+
+class Aggregation:
+    params = ([200_000, 2_000_000], ['str', 'category'])
+    param_names = ['n_cells', 'key_dtype']
+
+    def setup(self, n_cells, key_dtype):
+        self.data = make_multinucleate_data(n_cells)
+        if key_dtype == 'category':
+            self.data = self.data.astype({col: 'category' for col in ['well', 'cell_line', 'condition']})
+
+    def time_agg_multinucleates(self, n_cells, key_dtype):
+        agg_multinucleates(self.data)
+
+    def peakmem_agg_multinucleates(self, n_cells, key_dtype):
+        agg_multinucleates(self.data)
+
+
+class Deduplication:
+    params = [200_000, 2_000_000]
+    param_names = ['n_cells']
+
+    def setup(self, n_cells):
+        self.data = agg_multinucleates(make_multinucleate_data(n_cells))
+
+    def time_delete_duplicates(self, n_cells):
+        delete_duplicates(self.data)
+
+    def time_delete_duplicates_keys_only(self, n_cells):
+        delete_duplicates(self.data, keys_only=True)
+
+    def time_legacy_delete_duplicates(self, n_cells):
+        legacy_delete_duplicates(self.data)
+
+
+def _measure(name, func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    print(f"{name:32} {elapsed:.3f}s peak {peak:.0f} MiB")
+    return result
+
+
+if __name__ == '__main__':
+    data = make_multinucleate_data(2_000_000)
+    _measure('legacy_agg_multinucleates', legacy_agg_multinucleates, data)
+    df_agg = _measure('agg_multinucleates (str keys)', agg_multinucleates, data)
+    categorical = data.astype({col: 'category' for col in ['well', 'cell_line', 'condition']})
+    _measure('agg_multinucleates (categorical)', agg_multinucleates, categorical)
+    _measure('delete_duplicates', delete_duplicates, df_agg)
+    _measure('delete_duplicates (keys only)', delete_duplicates, df_agg, keys_only=True)
+    # the per-image loop is quadratic, compare on a smaller plate
+    df_agg = agg_multinucleates(make_multinucleate_data(200_000))
+    _measure('legacy_delete_duplicates (200k)', legacy_delete_duplicates, df_agg)
+    _measure('delete_duplicates (200k)', delete_duplicates, df_agg)
@@ -0,0 +1,57 @@
+"""
+Benchmarks for the box overlays of the hue violin plots: one seaborn boxplot per (condition, hue level) on a
+filtered dataframe, as plot_int_violin and palb_analysis.intensityplot did, vs box_stats and a single Axes.bxp.
+Run with asv (asv run --bench bench_boxes) or directly: python -m benchmarks.bench_boxes
+"""
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+from ifanalysis._helper_functions import hue_boxes
+
+conditions = [f"cond_{i}" for i in range(8)]
+levels = ['siCTR', 'siA', 'siB']
+
+
+class HueBoxes:
+    params = [100_000, 1_000_000]
+    param_names = ['n_cells']
+    timeout = 300
+
+    def setup(self, n_cells):
+        rng = np.random.default_rng(0)
+        self.data = pd.DataFrame({'condition': rng.choice(conditions, n_cells), 'siRNA': rng.choice(levels, n_cells),
+                                  'value': rng.lognormal(0, 0.5, n_cells)})
+
+    def teardown(self, n_cells):
+        plt.close('all')
+
+    def time_boxplot_loop(self, n_cells):
+        fig, ax = plt.subplots()
+        step = 0.8 / len(levels)
+        for i, condition in enumerate(conditions):
+            for j, level in enumerate(levels):
+                subset = self.data[(self.data.condition == condition) & (self.data.siRNA == level)]
+                sns.boxplot(y=subset['value'], showfliers=False, color='white', saturation=0.5, width=0.1,
+                            boxprops={'zorder': 2}, positions=[i - 0.4 + step / 2 + j * step], ax=ax)
+
+    def time_bxp(self, n_cells):
+        fig, ax = plt.subplots()
+        hue_boxes(ax, self.data, 'condition', 'value', 'siRNA', conditions, levels)
+
+
+if __name__ == '__main__':
+    for n_cells in HueBoxes.params:
+        bench = HueBoxes()
+        bench.setup(n_cells)
+        for name in ('time_boxplot_loop', 'time_bxp'):
+            start = time.perf_counter()
+            getattr(bench, name)(n_cells)
+            print(f"{name:17} cells={n_cells:>9} boxes={len(conditions) * len(levels)} "
+                  f"{time.perf_counter() - start:.4f}s")
+        bench.teardown(n_cells)
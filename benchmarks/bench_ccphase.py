@@ -0,0 +1,34 @@
+"""
+Benchmarks for cell cycle phase assignment: vectorised classify_ccphase vs the row-wise
+thresholding functions applied with DataFrame.apply.
+Run with asv (asv run) or directly: python -m benchmarks.bench_ccphase
+"""
+import time
+
+from benchmarks._data import make_norm_data
+from ifanalysis.normalisation import classify_ccphase, thresholding, thresholdingH3
+
+
+class TimeAssignCCPhase:
+    params = ([10_000, 100_000], [False, True])
+    param_names = ['n_cells', 'H3']
+
+    def setup(self, n_cells, H3):
+        self.data = make_norm_data(n_cells)
+
+    def time_vectorised(self, n_cells, H3):
+        classify_ccphase(self.data, H3=H3)
+
+    def time_apply(self, n_cells, H3):
+        self.data.apply(thresholdingH3 if H3 else thresholding, axis=1)
+
+
+if __name__ == '__main__':
+    for n_cells in TimeAssignCCPhase.params[0]:
+        for H3 in TimeAssignCCPhase.params[1]:
+            bench = TimeAssignCCPhase()
+            bench.setup(n_cells, H3)
+            for name in ('time_vectorised', 'time_apply'):
+                start = time.perf_counter()
+                getattr(bench, name)(n_cells, H3)
+                print(f"{name:16} n={n_cells:>7} H3={H3!s:5} {time.perf_counter() - start:.4f}s")
@@ -0,0 +1,53 @@
+"""
+Benchmarks for fetching (cell line, condition) groups: boolean masks over the dataframe, as in the plotting loops,
+vs ranges of the memory-mapped ColumnStore.
+Run with asv (asv run --bench bench_columnstore) or directly: python -m benchmarks.bench_columnstore
+"""
+import tempfile
+import time
+
+import numpy as np
+
+from ifanalysis.columnstore import write_store
+from ifanalysis.synthetic import make_screen
+
+columns = ['integrated_int_DAPI', 'intensity_mean_EdU_nucleus', 'intensity_mean_p21_nucleus']
+
+
+class GroupAccess:
+    params = [1_000_000, 10_000_000]
+    param_names = ['n_cells']
+    timeout = 300
+
+    def setup(self, n_cells):
+        self.data = make_screen(n_cells, n_cell_lines=4, n_conditions=8, n_replicates=4, multinucleate=0,
+                                categorical=True, dtype=np.float32)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = write_store(self.data, self.tmp.name, columns=columns)
+        self.groups = self.data[['cell_line', 'condition']].drop_duplicates().itertuples(index=False, name=None)
+        self.groups = list(self.groups)
+
+    def teardown(self, n_cells):
+        self.tmp.cleanup()
+
+    def time_masks(self, n_cells):
+        for cell_line, condition in self.groups:
+            self.data.loc[(self.data.cell_line == cell_line) & (self.data.condition == condition), columns]
+
+    def time_store(self, n_cells):
+        for cell_line, condition in self.groups:
+            self.store.frame(columns, cell_line=cell_line, condition=condition)
+
+    def time_write_store(self, n_cells):
+        write_store(self.data, self.tmp.name, columns=columns)
+
+
+if __name__ == '__main__':
+    for n_cells in GroupAccess.params:
+        bench = GroupAccess()
+        bench.setup(n_cells)
+        for name in ('time_masks', 'time_store', 'time_write_store'):
+            start = time.perf_counter()
+            getattr(bench, name)(n_cells)
+            print(f"{name:17} cells={n_cells:>9} groups={len(bench.groups)} {time.perf_counter() - start:.4f}s")
+        bench.teardown(n_cells)
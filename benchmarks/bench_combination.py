@@ -0,0 +1,72 @@
+"""
+Benchmarks for fitting the dose-response curves of combination screens: one scipy curve_fit per series
+vs the batched fit_hill, and the whole combination_analysis (curves along both axes, Bliss and Loewe).
+Run with asv (asv run --bench bench_combination) or directly: python -m benchmarks.bench_combination
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis.combination import combination_analysis, dose_matrices, fit_hill, hill
+
+doses_a = np.r_[0, np.logspace(-1, 1, 7)]
+doses_b = np.r_[0, np.logspace(-2, 0, 7)]
+
+
+def combination_screen(n_cell_lines: int, n_wells: int = 3, seed: int = 0) -> pd.DataFrame:
+    """
+    Well counts of 8 x 8 combination matrices, one per cell line, with random single agent curves
+    """
+    rng = np.random.default_rng(seed)
+    ic50_a = 10 ** rng.uniform(-0.5, 0.5, (n_cell_lines, 1, 1))
+    ic50_b = 10 ** rng.uniform(-1.5, -0.5, (n_cell_lines, 1, 1))
+    viability = hill(doses_a[None, :, None], 1, 0.1, ic50_a, 1.5) * hill(doses_b[None, None, :], 1, 0.2, ic50_b, 1.0)
+    counts = rng.poisson(1000 * np.repeat(viability[..., None], n_wells, axis=-1))
+    line, a, b, well = np.indices(counts.shape).reshape(4, -1)
+    return pd.DataFrame({'cell_line': np.char.add('line_', line.astype(str)), 'gwli': doses_a[a],
+                         'palb': doses_b[b], 'well': well, 'plate_id': 1, 'abs cell count': counts.ravel()})
+
+
+def curve_fit_loop(doses: np.ndarray, response: np.ndarray):
+    from scipy.optimize import curve_fit
+
+    params = []
+    for y in response:
+        try:
+            params.append(curve_fit(hill, doses, y, p0=[y[0], y[-1], np.median(doses[1:]), 1.0], maxfev=2000)[0])
+        except RuntimeError:
+            params.append(np.full(4, np.nan))
+    return params
+
+
+class Combination:
+    params = [100, 500]
+    param_names = ['n_cell_lines']
+    timeout = 300
+
+    def setup(self, n_cell_lines):
+        self.wells = combination_screen(n_cell_lines)
+        matrices = dose_matrices(self.wells)
+        # drug a at every drug b concentration
+        self.series = matrices.response.transpose(0, 2, 1).reshape(-1, len(doses_a))
+
+    def time_curve_fit(self, n_cell_lines):
+        curve_fit_loop(doses_a, self.series)
+
+    def time_fit_hill(self, n_cell_lines):
+        fit_hill(doses_a, self.series)
+
+    def time_combination_analysis(self, n_cell_lines):
+        combination_analysis(self.wells)
+
+
+if __name__ == '__main__':
+    for n_cell_lines in Combination.params:
+        bench = Combination()
+        bench.setup(n_cell_lines)
+        for name in ('time_curve_fit', 'time_fit_hill', 'time_combination_analysis'):
+            start = time.perf_counter()
+            getattr(bench, name)(n_cell_lines)
+            print(f"{name:25} matrices={n_cell_lines:>4} series={len(bench.series)} "
+                  f"{time.perf_counter() - start:.4f}s")
@@ -0,0 +1,63 @@
+"""
+Benchmarks for normalising well counts to the control condition: the former loop over cell lines
+(a mask, a mean and a concat per cell line) vs the grouped normalise_count, on whole-screen well tables.
+Run with asv (asv run --bench bench_counts) or directly: python -m benchmarks.bench_counts
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis.counts import normalise_count
+
+
+def well_table(n_wells: int, n_cell_lines: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Counts of a screen of 384 well plates with two control conditions among many others
+    """
+    rng = np.random.default_rng(seed)
+    conditions = ['NT', 'SCR'] + [f"si{i}" for i in range(max(n_wells // 3, 1))]
+    return pd.DataFrame({
+        'cell_line': rng.choice([f"line_{i}" for i in range(n_cell_lines)], n_wells),
+        'condition': rng.choice(conditions, n_wells),
+        'well': np.tile(np.arange(384), n_wells // 384 + 1)[:n_wells],
+        'plate_id': np.repeat(np.arange(n_wells // 384 + 1), 384)[:n_wells],
+        'abs cell count': rng.integers(100, 2000, n_wells),
+    })
+
+
+def loop_normalise(df: pd.DataFrame, ctr_cond: str) -> pd.DataFrame:
+    # the implementation normalise_count replaced
+    norm_count = pd.DataFrame()
+    for cell_line in df["cell_line"].unique():
+        norm_value = df.loc[(df["cell_line"] == cell_line) & (df["condition"] == ctr_cond), "abs cell count"].mean()
+        norm_count = pd.concat([norm_count, df.loc[df["cell_line"] == cell_line, "abs cell count"] / norm_value])
+    return norm_count
+
+
+class NormaliseCount:
+    params = ([60_000], [1, 50, 500])
+    param_names = ['n_wells', 'n_cell_lines']
+
+    def setup(self, n_wells, n_cell_lines):
+        self.wells = well_table(n_wells, n_cell_lines)
+
+    def time_loop(self, n_wells, n_cell_lines):
+        loop_normalise(self.wells, 'NT')
+
+    def time_grouped(self, n_wells, n_cell_lines):
+        normalise_count(self.wells, 'NT')
+
+    def time_per_plate(self, n_wells, n_cell_lines):
+        normalise_count(self.wells, ['NT', 'SCR'], by=['plate_id', 'cell_line'], pooled=False)
+
+
+if __name__ == '__main__':
+    for n_wells in NormaliseCount.params[0]:
+        for n_cell_lines in NormaliseCount.params[1]:
+            bench = NormaliseCount()
+            bench.setup(n_wells, n_cell_lines)
+            for name in ('time_loop', 'time_grouped', 'time_per_plate'):
+                start = time.perf_counter()
+                getattr(bench, name)(n_wells, n_cell_lines)
+                print(f"{name:15} wells={n_wells} cell lines={n_cell_lines:>3} {time.perf_counter() - start:.4f}s")
@@ -0,0 +1,22 @@
+"""
+Import time of the package modules, each measured in a fresh interpreter.
+Run with asv (asv run) or directly: python -m benchmarks.bench_import
+"""
+import subprocess
+import sys
+import time
+
+
+class TimeImport:
+    params = ['normalisation', 'statistics', 'counts', 'combplot']
+    param_names = ['module']
+
+    def timeraw_import(self, module):
+        return f"import ifanalysis.{module}"
+
+
+if __name__ == '__main__':
+    for module in TimeImport.params:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', TimeImport().timeraw_import(module)], check=True)
+        print(f"{module:14} {time.perf_counter() - start:.4f}s")
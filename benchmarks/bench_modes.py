@@ -0,0 +1,37 @@
+"""
+Benchmarks for the mode estimators used by normalise.
+Run with asv (asv run) or directly: python -m benchmarks.bench_modes
+"""
+import time
+
+import numpy as np
+
+from ifanalysis.modes import MODE_ESTIMATORS
+
+
+def make_dapi(n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    n_g1 = int(n * 0.6)
+    return np.concatenate([rng.normal(1e6, 5e4, n_g1), rng.normal(2e6, 1e5, n - n_g1)])
+
+
+class TimeModeEstimators:
+    params = ([100_000, 5_000_000], list(MODE_ESTIMATORS), [None, 200_000])
+    param_names = ['n_cells', 'method', 'max_samples']
+
+    def setup(self, n_cells, method, max_samples):
+        self.values = make_dapi(n_cells)
+
+    def time_mode(self, n_cells, method, max_samples):
+        MODE_ESTIMATORS[method](self.values, max_samples=max_samples)
+
+
+if __name__ == '__main__':
+    for n_cells in TimeModeEstimators.params[0]:
+        values = make_dapi(n_cells)
+        for method, estimator in MODE_ESTIMATORS.items():
+            for max_samples in TimeModeEstimators.params[2]:
+                start = time.perf_counter()
+                mode = estimator(values, max_samples=max_samples)
+                elapsed = time.perf_counter() - start
+                print(f"{method:14} n={n_cells:>8} cap={max_samples!s:>7} {elapsed * 1000:8.1f} ms mode={mode:.4g}")
@@ -0,0 +1,64 @@
+"""
+Benchmarks for normalise on a synthetic multi-cell-line dataset: single groupby pass
+vs the previous per-cell-line copy and concat loop (kept here as legacy_normalise).
+Run with asv (asv run) or directly: python -m benchmarks.bench_normalise
+"""
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks._data import make_intensity_data
+from ifanalysis.normalisation import normalise
+
+values = ['integrated_int_DAPI', 'intensity_mean_EdU_nucleus']
+
+
+def legacy_normalise(df: pd.DataFrame, values: list) -> pd.DataFrame:
+    norm_df = pd.DataFrame()
+    for cell_line in df["cell_line"].unique():
+        tmp_data = df.copy().loc[(df["cell_line"] == cell_line)]
+        for value in values:
+            y, x = np.histogram(tmp_data[value], bins=10000)
+            max_value = x[np.where(y == np.max(y))]
+            tmp_data[f"{value}_norm"] = tmp_data[value] / max_value[0]
+        norm_df = pd.concat([norm_df, tmp_data])
+    return norm_df
+
+
+class Normalise:
+    params = ([100_000, 1_000_000], [2, 8])
+    param_names = ['n_cells', 'n_cell_lines']
+
+    def setup(self, n_cells, n_cell_lines):
+        self.data = make_intensity_data(n_cells, n_cell_lines)
+
+    def time_normalise(self, n_cells, n_cell_lines):
+        normalise(self.data, values)
+
+    def time_normalise_inplace(self, n_cells, n_cell_lines):
+        normalise(self.data, values, inplace=True)
+
+    def time_legacy(self, n_cells, n_cell_lines):
+        legacy_normalise(self.data, values)
+
+    def peakmem_normalise(self, n_cells, n_cell_lines):
+        normalise(self.data, values)
+
+    def peakmem_legacy(self, n_cells, n_cell_lines):
+        legacy_normalise(self.data, values)
+
+
+if __name__ == '__main__':
+    for n_cells in Normalise.params[0]:
+        for n_cell_lines in Normalise.params[1]:
+            data = make_intensity_data(n_cells, n_cell_lines)
+            for name, func in (('normalise', normalise), ('legacy', legacy_normalise)):
+                tracemalloc.start()
+                start = time.perf_counter()
+                func(data, values)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                print(f"{name:10} n={n_cells:>8} lines={n_cell_lines} {elapsed:.3f}s peak {peak:.0f} MiB")
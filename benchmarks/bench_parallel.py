@@ -0,0 +1,41 @@
+"""
+Benchmarks for parallel_cellcycle_analysis against the serial cellcycle_analysis for increasing worker counts.
+Run with asv (asv run) or directly: python -m benchmarks.bench_parallel
+"""
+import os
+import time
+
+from benchmarks.bench_aggregation import make_multinucleate_data
+from ifanalysis.normalisation import cellcycle_analysis
+from ifanalysis.parallel import parallel_cellcycle_analysis
+
+worker_counts = sorted({1, 2, 4, 8, 16, 32} & set(range(1, (os.cpu_count() or 1) + 1)))
+
+
+class ParallelCellCycle:
+    params = ([1_000_000], worker_counts, ['histogram', 'kde'])
+    param_names = ['n_cells', 'n_workers', 'mode']
+    timeout = 300
+
+    def setup(self, n_cells, n_workers, mode):
+        self.data = make_multinucleate_data(n_cells)
+
+    def time_parallel(self, n_cells, n_workers, mode):
+        parallel_cellcycle_analysis(self.data, mode=mode, n_workers=n_workers,
+                                    partition_by=['plate_id', 'well', 'cell_line'])
+
+    def time_serial(self, n_cells, n_workers, mode):
+        cellcycle_analysis(self.data, mode=mode)
+
+
+if __name__ == '__main__':
+    data = make_multinucleate_data(1_000_000)
+    for mode in ('histogram', 'kde'):
+        start = time.perf_counter()
+        cellcycle_analysis(data, mode=mode)
+        print(f"{'serial':10} {mode:10} {time.perf_counter() - start:.3f}s")
+        for n_workers in worker_counts:
+            start = time.perf_counter()
+            parallel_cellcycle_analysis(data, mode=mode, n_workers=n_workers,
+                                        partition_by=['plate_id', 'well', 'cell_line'])
+            print(f"{n_workers:>2} workers {mode:10} {time.perf_counter() - start:.3f}s")
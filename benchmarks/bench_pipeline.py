@@ -0,0 +1,135 @@
+"""
+Benchmarks for every stage of the cell cycle pipeline and the main plots on synthetic omero-screen data
+(ifanalysis.synthetic.make_screen), from 10k to 10M cells. The time_ benchmarks measure run time and the
+track_ benchmarks the peak memory allocated by a stage (tracemalloc, MiB), which unlike asv's peakmem
+does not include the input data.
+Run with asv (asv run --bench bench_pipeline) or directly for any screen size, e.g. 50M cells:
+python -m benchmarks.bench_pipeline 50000000
+"""
+import sys
+import time
+import tracemalloc
+from functools import lru_cache
+
+import numpy as np
+
+from ifanalysis.counts import count_per_cond
+from ifanalysis.normalisation import (agg_multinucleates, assign_ccphase, cellcycle_analysis, cellcycle_prop,
+                                      cellcycle_values, delete_duplicates, normalise)
+from ifanalysis.statistics import t_test_cc_percond
+from ifanalysis.synthetic import make_screen
+
+conditions = ['CTR', 'cond_1', 'cond_2', 'cond_3']
+
+
+@lru_cache(maxsize=1)
+def stage_inputs(n_cells: int) -> dict:
+    """
+    Input of every pipeline stage for a screen of n_cells cells on one plate per million cells
+    """
+    raw = make_screen(n_cells, n_plates=max(n_cells // 1_000_000, 1), categorical=n_cells > 1_000_000,
+                      dtype=np.float32 if n_cells > 1_000_000 else np.float64)
+    agg = agg_multinucleates(raw)
+    dedup = delete_duplicates(agg)
+    norm = normalise(dedup, cellcycle_values())
+    norm['integrated_int_DAPI_norm'] = norm['integrated_int_DAPI_norm'] * 2
+    cells = assign_ccphase(norm, H3=False)
+    return dict(raw=raw, agg=agg, dedup=dedup, norm=norm, cells=cells, prop=cellcycle_prop(cells))
+
+
+# (stage, function of the stage inputs), in pipeline order
+STAGES = [
+    ('agg_multinucleates', lambda inputs: agg_multinucleates(inputs['raw'])),
+    ('delete_duplicates', lambda inputs: delete_duplicates(inputs['agg'])),
+    ('normalise', lambda inputs: normalise(inputs['dedup'], cellcycle_values())),
+    ('assign_ccphase', lambda inputs: assign_ccphase(inputs['norm'], H3=False)),
+    ('cellcycle_analysis', lambda inputs: cellcycle_analysis(inputs['raw'])),
+    ('cellcycle_prop', lambda inputs: cellcycle_prop(inputs['cells'])),
+    ('count_per_cond', lambda inputs: count_per_cond(inputs['cells'], 'CTR')),
+    ('t_test_cc_percond', lambda inputs: t_test_cc_percond(inputs['prop'], 'CTR')),
+]
+
+
+def _plots():
+    from ifanalysis.cellcycle import cellcycle_barplot
+    from ifanalysis.combplot import combplot
+    from ifanalysis.counts import count_plots
+    from ifanalysis.intensity import int_combplot
+
+    return [
+        ('combplot', lambda inputs: combplot(inputs['cells'], conditions, 'line_0', 'bench', save=False)),
+        ('combplot_density', lambda inputs: combplot(inputs['cells'], conditions, 'line_0', 'bench', save=False,
+                                                     kind='density')),
+        ('int_combplot', lambda inputs: int_combplot(inputs['cells'], conditions, 'line_0',
+                                                     'intensity_mean_p21_nucleus', save=False)),
+        ('count_plots', lambda inputs: count_plots(count_per_cond(inputs['cells'], 'CTR'), conditions, 'bench',
+                                                   save=False)),
+        ('cellcycle_barplot', lambda inputs: cellcycle_barplot(inputs['prop'], conditions, 'bench', save=False)),
+    ]
+
+
+def peak_allocation(func, *args) -> float:
+    """
+    Peak memory in MiB allocated while func runs, beyond what was allocated before
+    """
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return peak
+
+
+class Pipeline:
+    params = [10_000, 1_000_000, 10_000_000]
+    param_names = ['n_cells']
+    timeout = 600
+
+    def setup(self, n_cells):
+        self.inputs = stage_inputs(n_cells)
+        self.stages = dict(STAGES)
+
+
+class Plots:
+    params = [10_000, 1_000_000]
+    param_names = ['n_cells']
+    timeout = 300
+
+    def setup(self, n_cells):
+        import matplotlib
+        matplotlib.use('Agg')
+        self.inputs = stage_inputs(n_cells)
+        self.stages = dict(_plots())
+
+
+def _add_benchmarks(cls, names):
+    # one time_ and one track_ benchmark per stage, e.g. Pipeline.time_normalise, Pipeline.track_peak_normalise
+    for name in names:
+        def time_stage(self, n_cells, name=name):
+            self.stages[name](self.inputs)
+
+        def track_peak(self, n_cells, name=name):
+            return peak_allocation(self.stages[name], self.inputs)
+
+        track_peak.unit = 'MiB'
+        setattr(cls, f'time_{name}', time_stage)
+        setattr(cls, f'track_peak_{name}', track_peak)
+
+
+_add_benchmarks(Pipeline, [name for name, _ in STAGES])
+_add_benchmarks(Plots, ['combplot', 'combplot_density', 'int_combplot', 'count_plots', 'cellcycle_barplot'])
+
+
+if __name__ == '__main__':
+    import matplotlib
+    matplotlib.use('Agg')
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000_000]
+    for n_cells in sizes:
+        start = time.perf_counter()
+        inputs = stage_inputs(n_cells)
+        print(f"{n_cells} cells, {len(inputs['raw'])} nuclei generated in {time.perf_counter() - start:.1f}s")
+        stages = STAGES + (_plots() if n_cells <= 10_000_000 else [])
+        for name, func in stages:
+            start = time.perf_counter()
+            peak = peak_allocation(func, inputs)
+            print(f"{name:20} {time.perf_counter() - start:8.3f}s peak {peak:7.0f} MiB")
+        stage_inputs.cache_clear()
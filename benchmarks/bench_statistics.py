@@ -0,0 +1,58 @@
+"""
+Benchmarks for the t-tests against the control: batched compare_to_control vs the per condition and
+phase loop of t_test_perphase, and the resampling tests of compare_intensity.
+Run with asv (asv run) or directly: python -m benchmarks.bench_statistics
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks._data import make_prop_data
+from ifanalysis.statistics import compare_intensity, compare_to_control, t_test_perphase
+
+
+class TimeCompareToControl:
+    params = [10, 100]
+    param_names = ['n_conditions']
+
+    def setup(self, n_conditions):
+        self.data = make_prop_data(n_conditions)
+
+    def time_batched(self, n_conditions):
+        compare_to_control(self.data, 'SCR')
+
+    def time_loop(self, n_conditions):
+        for cond in self.data.condition.unique():
+            t_test_perphase(self.data, cond, 'SCR')
+
+
+class TimeCompareIntensity:
+    params = ([100_000, 1_000_000], ['bootstrap', 'permutation'])
+    param_names = ['n_cells', 'method']
+    timeout = 300
+
+    def setup(self, n_cells, method):
+        rng = np.random.default_rng(0)
+        self.data = pd.DataFrame({'condition': rng.choice(['SCR', 'cond_1'], n_cells),
+                                  'p21': rng.lognormal(6, 0.5, n_cells)})
+
+    def time_compare_intensity(self, n_cells, method):
+        compare_intensity(self.data, 'p21', 'SCR', method=method, n_resamples=100)
+
+
+if __name__ == '__main__':
+    for n_conditions in TimeCompareToControl.params:
+        bench = TimeCompareToControl()
+        bench.setup(n_conditions)
+        for name in ('time_batched', 'time_loop'):
+            start = time.perf_counter()
+            getattr(bench, name)(n_conditions)
+            print(f"{name:13} conditions={n_conditions:>4} {time.perf_counter() - start:.4f}s")
+    for n_cells in TimeCompareIntensity.params[0]:
+        for method in TimeCompareIntensity.params[1]:
+            bench = TimeCompareIntensity()
+            bench.setup(n_cells, method)
+            start = time.perf_counter()
+            bench.time_compare_intensity(n_cells, method)
+            print(f"{method:12} cells={n_cells:>8} {time.perf_counter() - start:.4f}s")
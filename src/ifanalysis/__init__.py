@@ -1 +1,8 @@
-from .normalisation import *
\ No newline at end of file
+from importlib.metadata import PackageNotFoundError, version
+
+try:
+    __version__ = version("hhlab-ifanalysis")
+except PackageNotFoundError:  # running from a source tree that is not installed
+    __version__ = "unknown"
+
+from .normalisation import *
@@ -1,9 +1,114 @@
-import matplotlib.pyplot as plt
+"""
+Shared helpers of the plotting modules. Matplotlib and seaborn are imported on first use through lazy_module,
+and the package style is applied by plot_style when the first plotting function runs, so importing a plotting
+module (or any numeric module) does not load matplotlib.
+"""
+import importlib
+import logging
+from contextlib import ContextDecorator
 from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis import profiling
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+
+logger = logging.getLogger(__name__)
+
+STYLE_PATH = Path(__file__).parent / 'styles/Style_01.mplstyle'
+
+# Set by the render workers: figures are then created without pyplot, see new_figure
+_headless = False
+_style_applied = False
+
+
+class lazy_module:
+    """
+    Module imported on first attribute access, e.g. plt = lazy_module('matplotlib.pyplot')
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}'>"
+
+
+class plot_style(ContextDecorator):
+    """
+    Applies the package matplotlib style (styles/Style_01.mplstyle) the first time a plotting function runs.
+    The style is set globally as the plotting modules did on import, so figures shown later in a notebook
+    keep it. Use as decorator of plotting functions or as context manager.
+    """
+
+    def __enter__(self):
+        global _style_applied
+        if not _style_applied:
+            import matplotlib.pyplot as plt
+            plt.style.use(str(STYLE_PATH))
+            _style_applied = True
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def style_colors() -> List[str]:
+    """
+    Colour cycle of the package style
+    """
+    with plot_style():
+        import matplotlib.pyplot as plt
+        return plt.rcParams["axes.prop_cycle"].by_key()["color"]
+
+
+def colors_getattr(module: str):
+    """
+    Module __getattr__ of the plotting modules: the attribute colors, which they used to set when imported,
+    is the colour cycle of the package style, e.g. __getattr__ = colors_getattr(__name__)
+    :param module: name of the module
+    """
+    def __getattr__(name):
+        if name == "colors":
+            return style_colors()
+        raise AttributeError(f"module {module!r} has no attribute {name!r}")
+    return __getattr__
+
+
+def set_headless(headless: bool = True) -> None:
+    """
+    Create figures outside of pyplot (no figure manager, no GUI backend) from now on in this process
+    :param headless: default True
+    """
+    global _headless
+    _headless = headless
+
+
+def new_figure(**kwargs) -> "Figure":
+    """
+    Figure for the plotting functions: a pyplot figure in interactive use,
+    a plain matplotlib Figure rendered with Agg when headless (see render.render_figures)
+    :param kwargs: passed on to the Figure, e.g. figsize
+    :return: matplotlib Figure
+    """
+    if _headless:
+        from matplotlib.figure import Figure
+        return Figure(**kwargs)
+    import matplotlib.pyplot as plt
+    return plt.figure(**kwargs)
+
 
 def save_fig(fig,
     path: Path, fig_id: str, tight_layout : bool = True, fig_extension: str = "pdf",
-        resolution: int = 300) -> None:
+        resolution: int = 300) -> Path:
     """
     coherent saving of matplotlib figures as pdfs (default)
     :rtype: object
@@ -12,11 +117,99 @@ def save_fig(fig,
     :param tight_layout: option, default True
     :param fig_extension: option, default pdf
     :param resolution: option, default 300dpi
-    :return: None, saves Figure in poth
+    :return: path of the saved figure
     """
 
     dest = path / f"{fig_id}.{fig_extension}"
-    print("Saving figure", fig_id)
-    if tight_layout:
-        fig.set_tight_layout(True)
-    plt.savefig(dest, format=fig_extension, dpi=resolution)
+    logger.info("Saving figure %s", fig_id, extra={"figure": str(dest)})
+    with profiling.stage("save_fig", detail=fig_id):
+        if tight_layout:
+            fig.set_tight_layout(True)
+        fig.savefig(dest, format=fig_extension, dpi=resolution)
+    return dest
+
+
+def category_order(values: pd.Series) -> list:
+    """
+    Order of the levels of a column on a seaborn categorical axis or hue:
+    the categories of a categorical, sorted numbers, otherwise the order of appearance
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return list(values.cat.categories)
+    levels = pd.unique(values.dropna())
+    return sorted(levels) if pd.api.types.is_numeric_dtype(values) else list(levels)
+
+
+def box_stats(df: pd.DataFrame, value: str, by: Sequence[str], whis: float = 1.5) -> pd.DataFrame:
+    """
+    Box plot statistics of every group from a single sort of the values, matching matplotlib's boxplot_stats
+    (linear quartiles, whiskers at the most extreme values within whis * IQR of the box)
+    :param df: dataframe
+    :param value: column to summarise
+    :param by: group columns
+    :param whis: whisker reach in IQRs, default 1.5
+    :return: one row per group with the by columns and med, q1, q3, whislo, whishi, n
+    """
+    by = list(by)
+    codes = df.groupby(by, observed=True, sort=False).ngroup().to_numpy()
+    values = df[value].to_numpy(dtype=float)
+    keep = (codes >= 0) & np.isfinite(values)
+    rows = np.flatnonzero(keep)
+    # sorted by value, then stably by group (faster than lexsort)
+    order = np.argsort(values[rows])
+    order = order[np.argsort(codes[rows][order], kind='stable')]
+    rows, sorted_values, sorted_codes = rows[order], values[rows][order], codes[rows][order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if len(rows) else np.array([], int)
+    n = np.diff(np.r_[starts, len(rows)])
+    last = starts + n - 1
+
+    def quantile(q):
+        position = starts + q * (n - 1)
+        below = np.floor(position).astype(int)
+        above = np.minimum(below + 1, last)
+        return sorted_values[below] + (sorted_values[above] - sorted_values[below]) * (position - below)
+
+    q1, med, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    iqr = q3 - q1
+    low, high = np.repeat(q1 - whis * iqr, n), np.repeat(q3 + whis * iqr, n)
+    if len(rows):
+        whislo = np.minimum.reduceat(np.where(sorted_values >= low, sorted_values, np.inf), starts)
+        whishi = np.maximum.reduceat(np.where(sorted_values <= high, sorted_values, -np.inf), starts)
+    else:
+        whislo = whishi = np.array([])
+    stats = df[by].iloc[rows[starts]].reset_index(drop=True)
+    stats["med"], stats["q1"], stats["q3"] = med, q1, q3
+    stats["whislo"], stats["whishi"] = np.minimum(whislo, q1), np.maximum(whishi, q3)
+    stats["n"] = n
+    return stats
+
+
+def hue_boxes(ax: "Axes", df: pd.DataFrame, x: str, y: str, hue: str, order: Sequence,
+              hue_order: Optional[Sequence] = None, width: float = 0.1, dodge_width: float = 0.8, **kwargs):
+    """
+    White boxes (without fliers) over dodged seaborn violins of x, y and hue, drawn with a single Axes.bxp call
+    :param order: x levels in axis order, the box of order[i] is centred around i
+    :param hue_order: option, hue levels in violin order, default category_order
+    :param width: box width, default 0.1
+    :param dodge_width: width of all hue levels of one x level, 0.8 as in seaborn
+    :param kwargs: passed on to Axes.bxp, ...props dictionaries update the default style
+    :return: the artists of Axes.bxp
+    """
+    hue_order = category_order(df[hue]) if hue_order is None else list(hue_order)
+    stats = box_stats(df, y, [x, hue])
+    x_pos = pd.Index(list(order)).get_indexer(stats[x].to_numpy(dtype=object))
+    hue_pos = pd.Index(hue_order).get_indexer(stats[hue].to_numpy(dtype=object))
+    shown = (x_pos >= 0) & (hue_pos >= 0)
+    stats, x_pos, hue_pos = stats[shown], x_pos[shown], hue_pos[shown]
+    step = dodge_width / len(hue_order)
+    positions = x_pos - dodge_width / 2 + step / 2 + hue_pos * step
+    # artists in axis order
+    left_to_right = np.argsort(positions, kind='stable')
+    stats, positions = stats.iloc[left_to_right], positions[left_to_right]
+    lines = dict(color='0.6', linewidth=1, zorder=2)
+    style = dict(showfliers=False, patch_artist=True, manage_ticks=False, widths=width, capwidths=width / 2,
+                 boxprops=dict(facecolor='white', edgecolor='0.6', linewidth=1, zorder=2),
+                 whiskerprops=lines, capprops=lines, medianprops={**lines, "zorder": 2.1})
+    for key, value in kwargs.items():
+        style[key] = {**style[key], **value} if key.endswith("props") and key in style else value
+    return ax.bxp(stats[["med", "q1", "q3", "whislo", "whishi"]].to_dict("records"), positions=positions, **style)
@@ -0,0 +1,155 @@
+"""
+Content-addressed on-disk cache of cellcycle_analysis results.
+The key is a hash of the input dataframe (column names, dtypes, index and values) together with the analysis
+parameters (H3, cyto, gates, mode estimator and its arguments) and the library version, so a changed plate or
+setting never returns a stale result. Results are stored as Parquet files in the cache directory, and the least
+recently used files are deleted once the directory grows beyond its size limit.
+Requires pyarrow (pip install hhlab-ifanalysis[parquet]).
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+import pandas as pd
+
+from ifanalysis import __version__
+from ifanalysis.gating import GatingModel
+from ifanalysis.io import _require_pyarrow
+
+# Default cache directory, overridden by the IFANALYSIS_CACHE_DIR environment variable
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "ifanalysis"
+# Default size limit of the cache directory in bytes
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def content_hash(df: pd.DataFrame) -> str:
+    """
+    Hash of a dataframe's column names, dtypes, index and values
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df.index).to_numpy().tobytes())
+    for col in df.columns:
+        digest.update(pd.util.hash_pandas_object(df[col], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def analysis_key(df: pd.DataFrame, H3: bool = False, cyto: bool = True, gates: Optional[GatingModel] = None,
+                 mode: Union[str, Callable] = "histogram", mode_kwargs: Optional[dict] = None) -> str:
+    """
+    Cache key of cellcycle_analysis(df, ...): content hash of df plus the analysis parameters and library version
+    """
+    mode_name = mode if isinstance(mode, str) else f"{mode.__module__}.{mode.__qualname__}"
+    params = repr((__version__, bool(H3), bool(cyto), gates, mode_name, sorted((mode_kwargs or {}).items())))
+    return hashlib.blake2b(f"{content_hash(df)}|{params}".encode(), digest_size=16).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Directory of cached results with size based LRU eviction
+    :param directory: option, cache directory, default: $IFANALYSIS_CACHE_DIR or ~/.cache/ifanalysis
+    :param max_bytes: option, size limit of the directory, default DEFAULT_MAX_BYTES
+    """
+
+    def __init__(self, directory: Optional[Union[str, Path]] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        _require_pyarrow()
+        self.directory = Path(directory or os.environ.get("IFANALYSIS_CACHE_DIR", DEFAULT_CACHE_DIR))
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.parquet"
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """
+        Cached result, None on a miss. A hit marks the entry as recently used,
+        an unreadable entry is deleted and counts as a miss.
+        """
+        path = self.path(key)
+        try:
+            df = pd.read_parquet(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # truncated or corrupt file, pyarrow's ArrowInvalid is a ValueError
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> Path:
+        """
+        Stores a result and evicts the least recently used entries beyond max_bytes
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        # write to a temporary file first, a crashed write never leaves a truncated entry
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+        return path
+
+    def size(self) -> int:
+        return sum(path.stat().st_size for path in self.directory.glob("*.parquet"))
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        """
+        Deletes the least recently used entries until the cache fits into max_bytes
+        :param keep: option, entry that is never evicted (the one just written)
+        """
+        entries = []
+        for path in self.directory.glob("*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*.parquet"):
+            path.unlink(missing_ok=True)
+
+
+def cached_cellcycle_analysis(df: pd.DataFrame, H3: bool = False, cyto: bool = True,
+                              gates: Optional[GatingModel] = None, mode: Union[str, Callable] = "histogram",
+                              mode_kwargs: Optional[dict] = None,
+                              cache: Union[AnalysisCache, str, Path, None] = None,
+                              per_plate: bool = False, n_workers: int = 1) -> pd.DataFrame:
+    """
+    cellcycle_analysis with results cached on disk
+    :param df: single cell data from omeroscreen
+    :param cache: option, AnalysisCache or cache directory, default: AnalysisCache()
+    :param per_plate: analyse and cache each plate_id separately, so only changed plates are recomputed.
+    The modes for the normalisation are then estimated per plate and cell line instead of per cell line.
+    :param n_workers: worker processes for the analysis of a cache miss, see parallel.parallel_cellcycle_analysis,
+    default 1. The result and the cache key do not depend on it.
+    :return: dataframe with cell cycle and cell cycle detailed columns, as cellcycle_analysis
+    """
+    from ifanalysis.normalisation import cellcycle_analysis
+
+    cache = cache if isinstance(cache, AnalysisCache) else AnalysisCache(cache)
+    if per_plate:
+        plates = [plate for _, plate in df.groupby('plate_id', observed=True, sort=False)]
+        return pd.concat([cached_cellcycle_analysis(plate, H3, cyto, gates, mode, mode_kwargs, cache,
+                                                    n_workers=n_workers)
+                          for plate in plates])
+    key = analysis_key(df, H3, cyto, gates, mode, mode_kwargs)
+    result = cache.get(key)
+    if result is None:
+        if n_workers > 1:
+            from ifanalysis.parallel import parallel_cellcycle_analysis
+            result = parallel_cellcycle_analysis(df, H3=H3, cyto=cyto, gates=gates, mode=mode,
+                                                 mode_kwargs=mode_kwargs, n_workers=n_workers)
+        else:
+            result = cellcycle_analysis(df, H3=H3, cyto=cyto, gates=gates, mode=mode, mode_kwargs=mode_kwargs)
+        cache.put(key, result)
+    return result
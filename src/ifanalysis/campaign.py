@@ -0,0 +1,156 @@
+"""
+Incremental analysis of a screening campaign that grows plate by plate.
+A Campaign directory holds, per plate, the normalised and phase-labelled cells from cellcycle_analysis and the
+per-well aggregates: cell counts per cell cycle phase and mean/median intensities. A new plate is analysed on
+its own and only its files are written. The campaign-level tables (proportions for prop_pivot and the statistics
+functions, counts for count_plots) are assembled from the stored aggregates without reading any cells.
+Since every plate is analysed alone, the modes for the normalisation are estimated per plate and cell line.
+Requires pyarrow (pip install hhlab-ifanalysis[parquet]).
+"""
+import json
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+from ifanalysis.cache import analysis_key
+from ifanalysis.gating import GatingModel
+from ifanalysis.io import _require_pyarrow
+from ifanalysis.normalisation import cellcycle_analysis, prop_from_counts
+
+WELL_KEYS = ["plate_id", "well", "cell_line", "condition"]
+# Columns of the stored tables that do not depend on the analysis parameters
+_TABLE_COLUMNS = {"cells": WELL_KEYS, "phases": WELL_KEYS + ["cell_cycle", "cells"], "intensities": WELL_KEYS}
+
+
+def well_aggregates(df: pd.DataFrame, intensity_cols: Sequence[str] = (),
+                    cell_cycle: str = 'cell_cycle') -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Per well aggregates of one analysed plate
+    :param df: dataframe from cellcycle_analysis
+    :param intensity_cols: columns summarised by their mean and median per well
+    :param cell_cycle: phase column, default 'cell_cycle'
+    :return: phase counts (column 'cells', NaN phase included) and intensity summary dataframes
+    """
+    phase_counts = (df.groupby(WELL_KEYS + [cell_cycle], observed=True, dropna=False)["experiment"].count()
+                    .rename("cells").reset_index())
+    phase_counts = phase_counts.loc[phase_counts[WELL_KEYS].notna().all(axis=1)]
+    grouped = df.groupby(WELL_KEYS, observed=True)[list(intensity_cols)]
+    intensities = grouped.mean().add_suffix('_mean').join(grouped.median().add_suffix('_median')).reset_index()
+    return phase_counts.reset_index(drop=True), intensities
+
+
+class Campaign:
+    """
+    Campaign store in a directory, plates are added with add_plates
+    :param directory: campaign directory, created if needed
+    :param H3: True if H3P staining is present
+    :param cyto: True if cytoplasmic data is present
+    :param gates: option, GatingModel to use instead of the H3/non-H3 preset
+    :param mode: mode estimator used by normalise, default 'histogram'
+    :param mode_kwargs: option, keyword arguments for the mode estimator
+    :param intensity_cols: option, additional columns for the per well intensity summaries,
+    the normalised columns (*_norm) are always summarised
+    """
+
+    def __init__(self, directory: Union[str, Path], H3: bool = False, cyto: bool = True,
+                 gates: Optional[GatingModel] = None, mode: Union[str, Callable] = "histogram",
+                 mode_kwargs: Optional[dict] = None, intensity_cols: Sequence[str] = ()):
+        _require_pyarrow()
+        self.directory = Path(directory)
+        self.params = dict(H3=H3, cyto=cyto, gates=gates, mode=mode, mode_kwargs=mode_kwargs)
+        self.intensity_cols = list(intensity_cols)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.directory / "manifest.json"
+
+    def _path(self, plate_id, table: str) -> Path:
+        return self.directory / f"plate_{plate_id}.{table}.parquet"
+
+    @property
+    def manifest(self) -> Dict[str, str]:
+        """
+        Analysis key of every stored plate, read from disk so several Campaign objects can share the directory
+        """
+        return json.loads(self.manifest_path.read_text()) if self.manifest_path.exists() else {}
+
+    @property
+    def plates(self) -> List[str]:
+        return list(self.manifest)
+
+    def add_plates(self, df: pd.DataFrame) -> List[str]:
+        """
+        Analyses the plates of df that are new or have changed, and stores their cells and aggregates
+        :param df: single cell data from omeroscreen, one or more plates
+        :return: plate ids that were (re)analysed
+        """
+        manifest = self.manifest
+        added = []
+        for plate_id, plate in df.groupby('plate_id', observed=True):
+            key = analysis_key(plate, **self.params)
+            if manifest.get(str(plate_id)) == key:
+                continue
+            cells = cellcycle_analysis(plate, **self.params)
+            intensity_cols = [col for col in cells.columns if col.endswith('_norm')] + \
+                             [col for col in self.intensity_cols if col in cells.columns]
+            phase_counts, intensities = well_aggregates(cells, list(dict.fromkeys(intensity_cols)))
+            cells.to_parquet(self._path(plate_id, "cells"))
+            phase_counts.to_parquet(self._path(plate_id, "phases"))
+            intensities.to_parquet(self._path(plate_id, "intensities"))
+            manifest[str(plate_id)] = key
+            added.append(str(plate_id))
+        self._write_manifest(manifest)
+        return added
+
+    def remove_plate(self, plate_id) -> None:
+        for table in ("cells", "phases", "intensities"):
+            self._path(plate_id, table).unlink(missing_ok=True)
+        manifest = self.manifest
+        manifest.pop(str(plate_id), None)
+        self._write_manifest(manifest)
+
+    def _write_manifest(self, manifest: Dict[str, str]):
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=1))
+        tmp_path.replace(self.manifest_path)
+
+    def _read(self, table: str, plate_ids: Optional[Iterable] = None, **kwargs) -> pd.DataFrame:
+        plate_ids = self.plates if plate_ids is None else [str(plate_id) for plate_id in plate_ids]
+        frames = [pd.read_parquet(self._path(plate_id, table), **kwargs) for plate_id in plate_ids]
+        if not frames:
+            # an empty campaign gives empty tables with the columns that are known without any plate
+            return pd.DataFrame(columns=kwargs.get("columns") or _TABLE_COLUMNS[table])
+        return pd.concat(frames, ignore_index=table != "cells")
+
+    def cells(self, plate_ids: Optional[Iterable] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Normalised single cell data of the campaign, as cellcycle_analysis per plate
+        :param plate_ids: option, plates to read, default: all
+        :param columns: option, columns to read
+        """
+        return self._read("cells", plate_ids, columns=columns)
+
+    def phase_counts(self) -> pd.Series:
+        """
+        Number of cells per plate, well, cell line, condition and cell cycle phase
+        """
+        table = self._read("phases")
+        return table.groupby(WELL_KEYS + ["cell_cycle"], observed=True, dropna=False)["cells"].sum()
+
+    def well_counts(self) -> pd.Series:
+        """
+        Number of cells per plate, well, cell line and condition, see counts.count_per_cond
+        """
+        return self.phase_counts().groupby(level=WELL_KEYS, observed=True).sum().rename("experiment")
+
+    def proportions(self) -> pd.DataFrame:
+        """
+        Cell cycle proportions per well as returned by cellcycle_prop, the input of pivot_props and
+        statistics.compare_to_control
+        """
+        return prop_from_counts(self.phase_counts())
+
+    def intensities(self) -> pd.DataFrame:
+        """
+        Mean and median intensities per well (columns <col>_mean and <col>_median)
+        """
+        return self._read("intensities")
@@ -1,18 +1,14 @@
-import matplotlib.pyplot as plt
-from matplotlib import ticker
-from matplotlib.gridspec import GridSpec
-import matplotlib as mpl
-import seaborn as sns
 from pathlib import Path
-from ifanalysis.normalisation import *
-from ifanalysis._helper_functions import save_fig
 from typing import List, Tuple
-# Matplotlib Style and Colors
-module_dir = Path(__file__).parent
-style_path = module_dir / 'styles/Style_01.mplstyle'
-plt.style.use(str(style_path))
-prop_cycle = plt.rcParams["axes.prop_cycle"]
-colors = prop_cycle.by_key()["color"]
+
+import pandas as pd
+
+from ifanalysis._helper_functions import colors_getattr, new_figure, plot_style, save_fig
+from ifanalysis.profiling import profiled
+from ifanalysis.summary import PlateSummary
+
+
+__getattr__ = colors_getattr(__name__)
 
 
 path = Path.cwd()
@@ -42,23 +38,28 @@ def prop_pivot(df_prop: pd.DataFrame, conditions, H3=False) -> Tuple[pd.DataFram
     df_std = df_std[cc_phases]
     return df_mean, df_std
 
+@profiled()
+@plot_style()
 def cellcycle_barplot(df: pd.DataFrame, conditions: List[str], title_str, H3 = False, save: bool = True, path: Path = Path.cwd()) -> None:
     """
     Function to plot cell cycle barplot for a given condition and cell line
-    :param df: dataframe from cellcycle_analysis function
+    :param df: dataframe from cellcycle_prop function, or a PlateSummary
     :param conditions: list of conditions to be plotted
     :param title: default 'CellCycle Summary Barplot'
     :param save: boolean, default True, if True saves the figure in the path provided
     :param path: option, default: Path.cwd(), path to save the figure
     :return: None, saves figure in path
     """
+    if isinstance(df, PlateSummary):
+        df = df.proportions()
     cell_lines = df.cell_line.unique()
-    fig, ax = plt.subplots(ncols=len(cell_lines), figsize=(5*len(cell_lines), 5))
+    fig = new_figure(figsize=(5*len(cell_lines), 5))
+    ax = fig.subplots(ncols=len(cell_lines))
     if len(cell_lines) == 1:
         ax=[ax]
     for number, cell_line in enumerate(cell_lines):
         df1 = df.loc[df.cell_line == cell_line]
-        df_mean, df_std = prop_pivot(df1, conditions)
+        df_mean, df_std = prop_pivot(df1, conditions, H3)
         df_mean.plot(kind="bar", stacked=True, yerr=df_std, width=0.75, ax=ax[number])
         ax[number].set_ylim(0, 110)
         ax[number].set_xticklabels(conditions, rotation=30, ha='right')
@@ -74,7 +75,7 @@ def cellcycle_barplot(df: pd.DataFrame, conditions: List[str], title_str, H3 = F
             ax[number].set_ylabel(None)
     fig.suptitle(title_str, size=16, weight='bold', x=0.05, horizontalalignment='left')
     if save:
-        save_fig(path, f"barplot_{title_str}", tight_layout=False)
+        save_fig(fig, path, f"barplot_{title_str}", tight_layout=False)
 
 
 
@@ -0,0 +1,143 @@
+"""
+Command line entry point for headless report generation, installed as the ifanalysis console script:
+
+    ifanalysis plate1.csv plate2.csv -c NT "SCR 40nM" CCNA2 --ctr NT -o figures --intensity intensity_mean_H2AX_nucleus
+
+Pipeline stages: read the exports, cell cycle analysis, count and proportion tables (CSV), figures (combplots,
+intensity plots, count plots and the cell cycle barplot via render.report_jobs). Progress and a timing summary
+per stage go to stderr, --profile writes the time, rows and peak memory of every step within the stages
+as JSON (see profiling.Recorder). Matplotlib and seaborn are only imported in the figure stage.
+"""
+import argparse
+import logging
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from ifanalysis import profiling
+
+
+class StageTimer:
+    """
+    Reports the start and duration of each pipeline stage and keeps the timings for the summary
+    """
+
+    def __init__(self, quiet: bool = False, stream=None):
+        self.quiet = quiet
+        self.stream = stream or sys.stderr
+        self.timings: List[tuple] = []
+
+    def log(self, message: str):
+        if not self.quiet:
+            print(message, file=self.stream, flush=True)
+
+    @contextmanager
+    def stage(self, name: str):
+        self.log(f"[{len(self.timings) + 1}] {name} ...")
+        start = time.perf_counter()
+        with profiling.stage(name):
+            yield
+        elapsed = time.perf_counter() - start
+        self.timings.append((name, elapsed))
+        self.log(f"[{len(self.timings)}] {name} done in {elapsed:.2f}s")
+
+    def summary(self) -> str:
+        width = max([len(name) for name, _ in self.timings] + [5])
+        lines = [f"{name:<{width}}  {elapsed:8.2f}s" for name, elapsed in self.timings]
+        lines.append(f"{'total':<{width}}  {sum(elapsed for _, elapsed in self.timings):8.2f}s")
+        return "\n".join(lines)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ifanalysis",
+                                     description="Cell cycle analysis and report figures of omero-screen exports")
+    parser.add_argument("inputs", nargs="+", type=Path, help="omero-screen exports (.csv or .parquet)")
+    parser.add_argument("-c", "--conditions", nargs="+", required=True, help="conditions to plot, in order")
+    parser.add_argument("--ctr", default="CTR", help="control condition for the normalised counts (default CTR)")
+    parser.add_argument("-l", "--cell-lines", nargs="+", help="cell lines to plot (default: all)")
+    parser.add_argument("-o", "--output", type=Path, default=Path.cwd(), help="output directory (default: cwd)")
+    parser.add_argument("-t", "--title", default="Cell Cycle Analysis", help="title of the combplots and barplot")
+    parser.add_argument("--H3", action="store_true", help="H3P staining is present")
+    parser.add_argument("--no-cyto", dest="cyto", action="store_false", help="no cytoplasmic data")
+    parser.add_argument("-i", "--intensity", nargs="+", default=[], metavar="COLUMN",
+                        help="intensity columns for int_combplot")
+    parser.add_argument("-n", "--cell-number", type=int, help="cells sampled per condition in the scatter plots")
+    parser.add_argument("--kind", choices=("scatter", "density", "count"), default="scatter",
+                        help="scatter plot kind (default scatter)")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="worker processes for the analysis and the figures (default 1)")
+    parser.add_argument("--cache", type=Path,
+                        help="cache directory for the cell cycle analysis and the Parquet copies of CSV inputs "
+                             "(needs pyarrow, default: Parquet copies in OUTPUT/parquet)")
+    parser.add_argument("--no-plots", dest="plots", action="store_false", help="write the tables only")
+    parser.add_argument("--profile", type=Path, metavar="JSON",
+                        help="write time, rows and peak memory of every pipeline step to a JSON file")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="log saved figures, -vv also every profiled step")
+    return parser
+
+
+def run(args: argparse.Namespace) -> StageTimer:
+    """
+    Runs the pipeline for parsed arguments
+    :return: StageTimer with the timings of all stages
+    """
+    import pandas as pd
+
+    from ifanalysis.cache import cached_cellcycle_analysis
+    from ifanalysis.counts import count_per_cond
+    from ifanalysis.io import read_screen
+    from ifanalysis.normalisation import cellcycle_analysis
+    from ifanalysis.summary import PlateSummary
+
+    timer = StageTimer(args.quiet)
+    args.output.mkdir(parents=True, exist_ok=True)
+    # the Parquet copies of CSV inputs go to the cache or output directory, never next to the inputs
+    parquet_dir = (args.cache or args.output) / "parquet"
+    with timer.stage("read"):
+        frames = [read_screen(path, analysis="cellcycle_H3" if args.H3 else "cellcycle",
+                              columns=args.intensity, cache_dir=parquet_dir) for path in args.inputs]
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        timer.log(f"    {len(df)} cells from {len(frames)} file(s)")
+    with timer.stage("cell cycle analysis"):
+        if args.cache is not None:
+            df = cached_cellcycle_analysis(df, H3=args.H3, cyto=args.cyto, cache=args.cache, n_workers=args.workers)
+        elif args.workers > 1:
+            from ifanalysis.parallel import parallel_cellcycle_analysis
+            df = parallel_cellcycle_analysis(df, H3=args.H3, cyto=args.cyto, n_workers=args.workers)
+        else:
+            df = cellcycle_analysis(df, H3=args.H3, cyto=args.cyto)
+    with timer.stage("tables"):
+        summary = PlateSummary.from_frame(df)
+        count_per_cond(summary, args.ctr).to_csv(args.output / "counts.csv", index=False)
+        summary.proportions().to_csv(args.output / "cellcycle_proportions.csv", index=False)
+    if args.plots:
+        with timer.stage("figures"):
+            from ifanalysis.render import render_figures, report_jobs
+            jobs = report_jobs(df, args.conditions, args.title, path=args.output, cell_lines=args.cell_lines,
+                               intensity_cols=args.intensity, H3=args.H3, cell_number=args.cell_number,
+                               ctr_cond=args.ctr, kind=args.kind)
+            for name in render_figures(jobs, n_workers=args.workers):
+                timer.log(f"    {name}")
+    return timer
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG if args.verbose > 1 else logging.INFO,
+                            format="%(name)s: %(message)s")
+    recorder = profiling.Recorder() if args.profile else nullcontext()
+    with recorder:
+        timer = run(args)
+    if args.profile:
+        recorder.to_json(args.profile)
+    timer.log(timer.summary())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Memory-mapped column store of normalised single cell data.
+write_store sorts the cells by cell line, condition, plate and well and writes every column as a .npy file
+(categoricals and strings as integer codes) together with an offset index: the row range of each
+(cell_line, condition, plate_id, well) group. The cells of a cell line, the unit of the report figures,
+are one row range in (cell line, condition) order. A ColumnStore maps the files read-only, so fetching a group
+is an index lookup followed by slicing, which gives zero-copy views instead of an O(N) boolean mask over the
+whole table. The pages are shared through the OS page cache: several processes can read one plate without
+holding a copy each, and a StoreSlice passes a selection to a worker process instead of the data (see
+render.report_jobs).
+Every write goes to a new generation directory and store.json is switched to it last, so an open ColumnStore
+keeps reading the generation it mapped while the store is rewritten, and a failed write leaves the old store.
+"""
+import json
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis.normalisation import group_codes
+
+# Sort order and index of the store, selections on a prefix of these keys are one row range
+STORE_KEYS = ["cell_line", "condition", "plate_id", "well"]
+
+
+def write_store(df: pd.DataFrame, directory: Union[str, Path], columns: Optional[Sequence[str]] = None,
+                keys: Sequence[str] = STORE_KEYS) -> "ColumnStore":
+    """
+    Writes single cell data to a column store, replacing any store in the directory. The columns are written to
+    a new generation directory, store.json is replaced by the new index with os.replace and the old generations
+    are deleted after that. Open stores keep their maps of the old files, new readers see the new store.
+    Only one process should write to a directory at a time.
+    :param df: dataframe from cellcycle_analysis
+    :param directory: store directory, created if needed
+    :param columns: option, columns to store besides the keys, default: all
+    :param keys: sort and index keys, default STORE_KEYS. Rows with a missing key are not stored.
+    :return: the ColumnStore
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    generation = Path(tempfile.mkdtemp(prefix="gen_", dir=directory))
+    try:
+        meta = _write_generation(df, generation, columns, keys)
+        tmp_path = directory / f"store.json.{os.getpid()}.tmp"
+        tmp_path.write_text(json.dumps(meta))
+        os.replace(tmp_path, directory / "store.json")
+    except BaseException:
+        shutil.rmtree(generation, ignore_errors=True)
+        raise
+    # previous generations, and the columns of stores written before generations were used
+    for path in directory.glob("gen_*"):
+        if path != generation:
+            shutil.rmtree(path, ignore_errors=True)
+    for path in directory.glob("col_*.npy"):
+        path.unlink(missing_ok=True)
+    return ColumnStore(directory)
+
+
+def _write_generation(df: pd.DataFrame, generation: Path, columns: Optional[Sequence[str]],
+                      keys: Sequence[str]) -> dict:
+    """
+    Writes the sorted columns of a store to a generation directory
+    :return: the index of the store, file names relative to the store directory
+    """
+    keys = list(keys)
+    columns = list(df.columns) if columns is None else keys + [col for col in columns if col not in keys]
+    codes = group_codes(df, keys)
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if len(order) else np.array([], int)
+    stops = np.append(starts[1:], len(order))
+    meta = {"n_rows": len(order), "keys": keys, "columns": {}}
+    for i, col in enumerate(columns):
+        values = df[col]
+        if not pd.api.types.is_numeric_dtype(values) or isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('category')
+            meta["columns"][col] = {"file": f"{generation.name}/col_{i}.npy",
+                                    "categories": values.cat.categories.tolist(), "ordered": bool(values.cat.ordered)}
+            array = values.cat.codes.to_numpy()
+        else:
+            meta["columns"][col] = {"file": f"{generation.name}/col_{i}.npy"}
+            array = values.to_numpy()
+        np.save(generation / f"col_{i}.npy", array[order])
+    first_rows = order[starts]
+    meta["index"] = {key: df[key].to_numpy()[first_rows].tolist() for key in keys}
+    meta["index"].update(start=starts.tolist(), stop=stops.tolist())
+    return meta
+
+
+class ColumnStore:
+    """
+    Read-only view of a store written by write_store. All columns are mapped when the store is opened,
+    so it reads one generation even if the store is rewritten meanwhile.
+    :param directory: store directory
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+        # a rewrite can delete the generation between reading the index and mapping its files, then read again
+        for attempt in range(3):
+            meta = json.loads((self.directory / "store.json").read_text())
+            try:
+                self._arrays: Dict[str, np.ndarray] = {
+                    col: np.load(self.directory / spec["file"], mmap_mode='r')
+                    for col, spec in meta["columns"].items()}
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+        self.n_rows: int = meta["n_rows"]
+        self.keys: List[str] = meta["keys"]
+        self._columns: Dict[str, dict] = meta["columns"]
+        self.index = pd.DataFrame(meta["index"])
+        self._offsets = dict(zip(zip(*(self.index[key] for key in self.keys)),
+                                 zip(self.index.start, self.index.stop)))
+        self._dtypes: Dict[str, pd.CategoricalDtype] = {
+            col: pd.CategoricalDtype(spec["categories"], ordered=spec["ordered"])
+            for col, spec in self._columns.items() if "categories" in spec}
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def __getstate__(self):
+        # workers reopen the files, the maps are not pickled
+        return {"directory": self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"])
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def array(self, col: str) -> np.ndarray:
+        """
+        Memory-mapped values of a column in store order, codes for categorical columns
+        """
+        return self._arrays[col]
+
+    def column(self, col: str, rows: slice = slice(None)) -> Union[np.ndarray, pd.Categorical]:
+        """
+        Values of a column for a row range, a view of the mapped file (a Categorical on a view of the codes)
+        """
+        # a plain ndarray view, pandas would otherwise carry the memmap subclass into its results
+        values = self.array(col)[rows].view(np.ndarray)
+        if col in self._dtypes:
+            return pd.Categorical.from_codes(values, dtype=self._dtypes[col], validate=False)
+        return values
+
+    def slices(self, **selection) -> List[slice]:
+        """
+        Row ranges of the cells matching a selection, e.g. slices(cell_line='HELA', condition=['CTR', 'DRUG']),
+        adjacent ranges merged. With a value for every key this is a dictionary lookup.
+        """
+        unknown = set(selection) - set(self.keys)
+        if unknown:
+            raise KeyError(f"not a store key: {sorted(unknown)}, keys are {self.keys}")
+        if not selection:
+            return [slice(0, self.n_rows)]
+        if len(selection) == len(self.keys) and not any(isinstance(v, (list, tuple, set)) for v in selection.values()):
+            offsets = self._offsets.get(tuple(selection[key] for key in self.keys))
+            return [] if offsets is None else [slice(*offsets)]
+        mask = np.ones(len(self.index), dtype=bool)
+        for key, value in selection.items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            mask &= self.index[key].isin(values).to_numpy()
+        starts = self.index.start.to_numpy()[mask]
+        stops = self.index.stop.to_numpy()[mask]
+        ranges = []
+        for start, stop in zip(starts, stops):
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = stop
+            else:
+                ranges.append([start, stop])
+        return [slice(int(start), int(stop)) for start, stop in ranges]
+
+    def frame(self, columns: Optional[Sequence[str]] = None, **selection) -> pd.DataFrame:
+        """
+        Cells matching a selection (see slices) as a dataframe, zero-copy views of the files
+        if the selection is a single row range, e.g. one plate, cell line or (cell line, condition) of a plate
+        :param columns: option, columns to read, default: all
+        """
+        columns = self.columns if columns is None else list(columns)
+        ranges = self.slices(**selection) or [slice(0, 0)]
+        data = {}
+        for col in columns:
+            if len(ranges) == 1:
+                data[col] = self.column(col, ranges[0])
+            else:
+                values = np.concatenate([self.array(col)[rows] for rows in ranges])
+                data[col] = pd.Categorical.from_codes(values, dtype=self._dtypes[col], validate=False) \
+                    if col in self._dtypes else values
+        return pd.DataFrame(data, columns=columns, copy=False)
+
+    def groups(self, by: Sequence[str], columns: Optional[Sequence[str]] = None, **selection
+               ) -> Iterator[Tuple[tuple, pd.DataFrame]]:
+        """
+        Dataframes of the groups of one or more keys, like iterating over df.groupby(by) without the O(N) masks
+        :param by: key columns to group by, e.g. ['cell_line', 'condition']
+        :param columns: option, columns to read, default: all
+        :param selection: option, restrict to a selection, see slices
+        """
+        index = self.index
+        for key, value in selection.items():
+            index = index[index[key].isin(list(value) if isinstance(value, (list, tuple, set)) else [value])]
+        # groups in store order
+        for group in index[list(by)].drop_duplicates().itertuples(index=False, name=None):
+            yield group, self.frame(columns, **{**selection, **dict(zip(by, group))})
+
+    def select(self, columns: Optional[Sequence[str]] = None, **selection) -> "StoreSlice":
+        """
+        Lazy selection that is read by StoreSlice.load, cheap to pass to another process
+        """
+        return StoreSlice(self.directory, None if columns is None else list(columns), selection)
+
+
+@dataclass
+class StoreSlice:
+    """
+    Selection of a ColumnStore, loaded where it is used
+    """
+    directory: Path
+    columns: Optional[List[str]] = None
+    selection: dict = field(default_factory=dict)
+
+    def load(self) -> pd.DataFrame:
+        return ColumnStore(self.directory).frame(self.columns, **self.selection)
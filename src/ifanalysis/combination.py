@@ -0,0 +1,366 @@
+"""
+Dose-response and synergy analysis of two-drug combination screens, e.g. the GWLI x PALB matrices of palb_analysis.
+Well counts are normalised to the untreated wells (both concentrations 0) of their group and averaged into one
+(concentration a x concentration b) matrix per group (cell line). All matrices are stacked into one array, and
+4-parameter Hill curves are fitted to every row and column of every matrix at once by a batched
+Levenberg-Marquardt least squares: one (series x doses x parameters) Jacobian per iteration instead of one
+curve_fit per series. Bliss and Loewe synergy are computed for all combination wells from the same arrays.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis.counts import normalise_count
+from ifanalysis.normalisation import group_codes
+from ifanalysis.profiling import profiled
+
+HILL_PARAMS = ["top", "bottom", "ic50", "hill"]
+
+# Bounds of the Hill slope and of the IC50 relative to the tested concentrations (100 fold beyond them)
+_SLOPE_BOUNDS = (0.05, 20.0)
+_LOG_IC50_MARGIN = np.log(100)
+
+
+def hill(doses: np.ndarray, top, bottom, ic50, slope) -> np.ndarray:
+    """
+    4-parameter Hill (log-logistic) curve, bottom + (top - bottom) / (1 + (dose / ic50) ** slope)
+    """
+    doses = np.asarray(doses, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        u = np.where(doses > 0, (doses / ic50) ** slope, 0.0)
+    return bottom + (top - bottom) / (1 + u)
+
+
+def hill_inverse(response: np.ndarray, top, bottom, ic50, slope) -> np.ndarray:
+    """
+    Concentration at which a Hill curve reaches a response, 0 above top and inf beyond bottom
+    """
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        ratio = (np.asarray(response, dtype=float) - bottom) / (top - bottom)
+        doses = ic50 * (1 / ratio - 1) ** (1 / slope)
+    return np.where(ratio >= 1, 0.0, np.where(ratio <= 0, np.inf, doses))
+
+
+@dataclass
+class HillFit:
+    """
+    Parameters of a batch of Hill curves, one entry per series, NaN where a series could not be fitted
+    """
+    top: np.ndarray
+    bottom: np.ndarray
+    ic50: np.ndarray
+    hill: np.ndarray
+    rmse: np.ndarray
+    n_doses: np.ndarray
+    converged: np.ndarray
+
+    def predict(self, doses: np.ndarray) -> np.ndarray:
+        """
+        Responses of every curve at the doses, shape (series, doses)
+        """
+        return hill(np.asarray(doses)[None, :], self.top[:, None], self.bottom[:, None], self.ic50[:, None],
+                    self.hill[:, None])
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({name: getattr(self, name) for name in HILL_PARAMS + ["rmse", "n_doses"]})
+
+
+def _model(log_doses: np.ndarray, positive: np.ndarray, params: np.ndarray
+           ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hill curves and their Jacobian for parameters (series, [top, bottom, log ic50, slope])
+    :return: responses (series, doses), Jacobian (series, doses, 4)
+    """
+    top, bottom, log_ic50, slope = (params[:, i:i + 1] for i in range(4))
+    exponent = np.clip(slope * (log_doses - log_ic50), -50, 50)
+    u = np.where(positive, np.exp(exponent), 0.0)
+    s = 1 / (1 + u)
+    span_term = (top - bottom) * u * s * s
+    jacobian = np.stack([s, 1 - s, slope * span_term, -(log_doses - log_ic50) * span_term], axis=-1)
+    return bottom + (top - bottom) * s, jacobian
+
+
+def fit_hill(doses: np.ndarray, response: np.ndarray, weights: Optional[np.ndarray] = None,
+             top: Optional[float] = None, bottom: Optional[float] = None, max_iter: int = 200,
+             tol: float = 1e-10) -> HillFit:
+    """
+    Weighted least squares fit of Hill curves to many dose series at once
+    :param doses: concentrations, shape (doses,) shared by all series, or (series, doses). 0 is allowed.
+    :param response: responses, shape (series, doses), NaN for missing points
+    :param weights: option, weight of each point (e.g. number of wells), default 1
+    :param top: option, fixed top instead of fitting it, e.g. 1 for responses relative to the control
+    :param bottom: option, fixed bottom
+    :param max_iter: maximum Levenberg-Marquardt iterations
+    :param tol: relative change of the squared error at which a series has converged
+    :return: HillFit, NaN for series with fewer concentrations than free parameters
+    """
+    response = np.atleast_2d(np.asarray(response, dtype=float))
+    doses = np.broadcast_to(np.asarray(doses, dtype=float), response.shape)
+    weights = np.ones_like(response) if weights is None else np.broadcast_to(weights, response.shape).astype(float)
+    weights = np.where(np.isfinite(response) & np.isfinite(doses), weights, 0.0)
+    y = np.where(weights > 0, response, 0.0)
+    positive = doses > 0
+    with np.errstate(divide='ignore'):
+        log_doses = np.where(positive, np.log(np.where(positive, doses, 1.0)), 0.0)
+    free = np.array([top is None, bottom is None, True, True])
+    n_series = len(y)
+    n_doses = (weights > 0).sum(axis=1)
+    fittable = n_doses >= free.sum()
+    used_positive = positive & (weights > 0)
+    log_min = np.where(used_positive, log_doses, np.inf).min(axis=1, initial=np.inf)
+    log_max = np.where(used_positive, log_doses, -np.inf).max(axis=1, initial=-np.inf)
+    fittable &= np.isfinite(log_min)
+    log_min, log_max = np.where(fittable, log_min, 0.0), np.where(fittable, log_max, 0.0)
+
+    # initial values: the responses at the lowest and highest concentrations and the dose closest to half way
+    total = weights.sum(axis=1)
+    order = np.argsort(np.where(weights > 0, doses, np.inf), axis=1, kind='stable')
+    first = np.take_along_axis(y, order[:, :1], axis=1)[:, 0]
+    last_index = np.maximum(n_doses - 1, 0)[:, None]
+    last = np.take_along_axis(y, np.take_along_axis(order, last_index, axis=1), axis=1)[:, 0]
+    params = np.empty((n_series, 4))
+    params[:, 0] = first if top is None else top
+    params[:, 1] = last if bottom is None else bottom
+    half = (params[:, :1] + params[:, 1:2]) / 2
+    distance = np.where(used_positive, np.abs(y - half), np.inf)
+    params[:, 2] = np.take_along_axis(log_doses, distance.argmin(axis=1)[:, None], axis=1)[:, 0]
+    params[:, 3] = 1.0
+    lower = np.stack([np.full(n_series, -np.inf), np.full(n_series, -np.inf), log_min - _LOG_IC50_MARGIN,
+                      np.full(n_series, _SLOPE_BOUNDS[0])], axis=1)
+    upper = np.stack([np.full(n_series, np.inf), np.full(n_series, np.inf), log_max + _LOG_IC50_MARGIN,
+                      np.full(n_series, _SLOPE_BOUNDS[1])], axis=1)
+
+    def sse(p, rows=slice(None)):
+        fitted, jacobian = _model(log_doses[rows], positive[rows], p)
+        residuals = y[rows] - fitted
+        return (weights[rows] * residuals ** 2).sum(axis=1), residuals, jacobian
+
+    cost, residuals, jacobian = sse(params)
+    damping = np.full(n_series, 1e-3)
+    active = fittable.copy()
+    converged = np.zeros(n_series, dtype=bool)
+    fixed = np.diag(~free).astype(float)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        jac = jacobian[idx] * free
+        w = weights[idx]
+        normal = np.einsum('sni,sn,snj->sij', jac, w, jac)
+        gradient = np.einsum('sni,sn,sn->si', jac, w, residuals[idx])
+        diagonal = np.einsum('sii->si', normal)
+        damped = normal + (damping[idx, None] * diagonal + 1e-12 * (1 + diagonal))[:, :, None] * np.eye(4) + fixed
+        step = np.linalg.solve(damped, gradient[..., None])[..., 0]
+        trial = np.clip(params[idx] + step, lower[idx], upper[idx])
+        trial_cost, trial_residuals, trial_jacobian = sse(trial, idx)
+        better = trial_cost < cost[idx]
+        improvement = (cost[idx] - trial_cost) / np.maximum(cost[idx], 1e-300)
+        accepted = idx[better]
+        params[accepted] = trial[better]
+        cost[accepted] = trial_cost[better]
+        residuals[accepted] = trial_residuals[better]
+        jacobian[accepted] = trial_jacobian[better]
+        damping[idx] = np.where(better, damping[idx] / 3, damping[idx] * 4)
+        done = (better & (improvement < tol)) | (cost[idx] <= 1e-300 * total[idx]) | (damping[idx] > 1e12)
+        converged[idx[done]] = True
+        active[idx[done]] = False
+
+    nan = np.where(fittable, 1.0, np.nan)
+    return HillFit(top=params[:, 0] * nan, bottom=params[:, 1] * nan, ic50=np.exp(params[:, 2]) * nan,
+                   hill=params[:, 3] * nan, rmse=np.sqrt(cost / np.where(total > 0, total, np.nan)) * nan,
+                   n_doses=n_doses, converged=converged & fittable)
+
+
+@dataclass
+class DoseMatrix:
+    """
+    Mean responses of all groups on a common grid of concentrations, relative to the untreated wells
+    """
+    labels: pd.DataFrame
+    drug_a: str
+    drug_b: str
+    doses_a: np.ndarray
+    doses_b: np.ndarray
+    response: np.ndarray  # (groups, doses a, doses b), NaN where a combination was not measured
+    n_wells: np.ndarray  # (groups, doses a, doses b)
+
+
+def dose_matrices(df: pd.DataFrame, drug_a: str = 'gwli', drug_b: str = 'palb', value: str = 'abs cell count',
+                  groups: Sequence[str] = ('cell_line',)) -> DoseMatrix:
+    """
+    Averages the wells of a combination screen into one dose matrix per group
+    :param df: one row per well, e.g. from palb_analysis.count_per_cond
+    :param drug_a: column of the first concentration, default 'gwli'
+    :param drug_b: column of the second concentration, default 'palb'
+    :param value: response column, default 'abs cell count'. Values are normalised to the mean of the wells with
+    both concentrations 0 in the same group.
+    :param groups: columns of the groups, default ('cell_line',)
+    :return: DoseMatrix
+    """
+    groups = list(groups)
+    df = df.loc[df[[drug_a, drug_b, value] + groups].notna().all(axis=1)]
+    doses_a, doses_b = np.unique(df[drug_a].to_numpy(dtype=float)), np.unique(df[drug_b].to_numpy(dtype=float))
+    if not len(df) or doses_a[0] != 0 or doses_b[0] != 0:
+        raise ValueError(f"a combination screen needs untreated and single agent wells ({drug_a} and {drug_b} = 0)")
+    untreated = (df[drug_a] == 0) & (df[drug_b] == 0)
+    relative = normalise_count(df.assign(untreated=untreated), True, by=groups, control_col='untreated', value=value)
+    codes = group_codes(df, groups)
+    group_ids, first, group_index = np.unique(codes, return_index=True, return_inverse=True)
+    labels = df[groups].iloc[first].reset_index(drop=True)
+    cell = (group_index * len(doses_a) + np.searchsorted(doses_a, df[drug_a].to_numpy(dtype=float))) * len(doses_b)
+    cell += np.searchsorted(doses_b, df[drug_b].to_numpy(dtype=float))
+    shape = (len(labels), len(doses_a), len(doses_b))
+    measured = np.isfinite(relative.to_numpy())
+    n_wells = np.bincount(cell[measured], minlength=np.prod(shape)).reshape(shape)
+    totals = np.bincount(cell[measured], weights=relative.to_numpy()[measured], minlength=np.prod(shape))
+    response = np.full(shape, np.nan)
+    np.divide(totals.reshape(shape), n_wells, out=response, where=n_wells > 0)
+    return DoseMatrix(labels, drug_a, drug_b, doses_a, doses_b, response, n_wells)
+
+
+def bliss_expected(response: np.ndarray) -> np.ndarray:
+    """
+    Bliss independence: the product of the single agent responses (first row and column of each matrix)
+    :param response: responses relative to untreated, shape (groups, doses a, doses b)
+    """
+    return response[:, :, :1] * response[:, :1, :]
+
+
+def loewe_expected(doses_a: np.ndarray, doses_b: np.ndarray, fit_a: HillFit, fit_b: HillFit,
+                   n_iter: int = 60) -> np.ndarray:
+    """
+    Loewe additivity: the response y at which a / A(y) + b / B(y) = 1, with A and B the concentrations of the
+    single agents that give y, solved by bisection for all groups and combinations at once
+    :param fit_a: single agent curves of drug a, one per group
+    :param fit_b: single agent curves of drug b, one per group
+    :return: expected responses (groups, doses a, doses b), NaN where a single agent curve is missing or rising
+    """
+    a = np.asarray(doses_a, dtype=float)[None, :, None]
+    b = np.asarray(doses_b, dtype=float)[None, None, :]
+    curve_a = [p[:, None, None] for p in (fit_a.top, fit_a.bottom, fit_a.ic50, fit_a.hill)]
+    curve_b = [p[:, None, None] for p in (fit_b.top, fit_b.bottom, fit_b.ic50, fit_b.hill)]
+    shape = (len(fit_a.top), len(doses_a), len(doses_b))
+    # the sum of dose ratios rises from 0 (below both bottoms) to inf (above both tops)
+    low = np.broadcast_to(np.minimum(curve_a[1], curve_b[1]), shape).copy()
+    high = np.broadcast_to(np.maximum(curve_a[0], curve_b[0]), shape).copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(n_iter):
+            mid = (low + high) / 2
+            total = a / hill_inverse(mid, *curve_a) + b / hill_inverse(mid, *curve_b)
+            above = total > 1
+            high = np.where(above, mid, high)
+            low = np.where(above, low, mid)
+    expected = (low + high) / 2
+    valid = (fit_a.top > fit_a.bottom) & (fit_b.top > fit_b.bottom)
+    return np.where(valid[:, None, None], expected, np.nan)
+
+
+def _analyse(doses_a: np.ndarray, doses_b: np.ndarray, response: np.ndarray, n_wells: np.ndarray,
+             top: Optional[float], bottom: Optional[float]) -> Tuple[HillFit, HillFit, np.ndarray, np.ndarray]:
+    """
+    Curves along both axes and expected responses of a stack of dose matrices
+    :return: fits of drug a (groups x doses b series), of drug b (groups x doses a series), Bliss and Loewe expected
+    """
+    n_groups, n_a, n_b = response.shape
+    fit_a = fit_hill(doses_a, response.transpose(0, 2, 1).reshape(-1, n_a),
+                     n_wells.transpose(0, 2, 1).reshape(-1, n_a), top=top, bottom=bottom)
+    fit_b = fit_hill(doses_b, response.reshape(-1, n_b), n_wells.reshape(-1, n_b), top=top, bottom=bottom)
+    single_a = HillFit(*(np.asarray(v).reshape(n_groups, n_b)[:, 0] for v in vars(fit_a).values()))
+    single_b = HillFit(*(np.asarray(v).reshape(n_groups, n_a)[:, 0] for v in vars(fit_b).values()))
+    return fit_a, fit_b, bliss_expected(response), loewe_expected(doses_a, doses_b, single_a, single_b)
+
+
+def _concat_fits(fits: List[HillFit]) -> HillFit:
+    return HillFit(*(np.concatenate([vars(fit)[name] for fit in fits]) for name in vars(fits[0])))
+
+
+@dataclass
+class CombinationResult:
+    """
+    Curves and synergy of a combination screen
+    curves: one row per group, drug and concentration of the partner drug, the single agent curve at partner dose 0
+    synergy: one row per group and combination of non-zero concentrations. Excess values are expected - observed
+    responses, positive for synergy.
+    """
+    curves: pd.DataFrame
+    synergy: pd.DataFrame
+    groups: List[str]
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Single agent IC50s and mean Bliss and Loewe excess per group
+        """
+        single = self.curves[self.curves.partner_dose == 0]
+        ic50 = single.pivot_table(index=self.groups, columns='drug', values='ic50', observed=True, sort=False)
+        ic50.columns = [f"ic50 {drug}" for drug in ic50.columns]
+        excess = self.synergy.groupby(self.groups, observed=True, sort=False)[['bliss', 'loewe']].mean()
+        return ic50.join(excess).reset_index()
+
+
+@profiled()
+def combination_analysis(df: pd.DataFrame, drug_a: str = 'gwli', drug_b: str = 'palb',
+                         value: str = 'abs cell count', groups: Sequence[str] = ('cell_line',),
+                         top: Optional[float] = None, bottom: Optional[float] = None,
+                         n_workers: Optional[int] = 1) -> CombinationResult:
+    """
+    Fits dose-response curves along every row and column of the dose matrix of every group and scores
+    Bliss and Loewe synergy of all combinations
+    :param df: one row per well, e.g. from palb_analysis.count_per_cond
+    :param drug_a: column of the first concentration, default 'gwli'
+    :param drug_b: column of the second concentration, default 'palb'
+    :param value: response column, default 'abs cell count', normalised to the untreated wells of each group
+    :param groups: columns of the groups, default ('cell_line',)
+    :param top: option, fixed top of the curves, e.g. 1
+    :param bottom: option, fixed bottom of the curves, e.g. 0
+    :param n_workers: number of worker processes, default 1 (in this process). None uses os.cpu_count().
+    Each worker fits a contiguous block of groups, which only pays off for thousands of matrices.
+    :return: CombinationResult
+    """
+    matrices = dose_matrices(df, drug_a, drug_b, value=value, groups=groups)
+    n_groups = len(matrices.labels)
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, n_groups))
+    blocks = np.array_split(np.arange(n_groups), n_workers)
+    tasks = [(matrices.doses_a, matrices.doses_b, matrices.response[block], matrices.n_wells[block], top, bottom)
+             for block in blocks]
+    if n_workers == 1:
+        results = [_analyse(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_analyse, *zip(*tasks)))
+    fit_a, fit_b = _concat_fits([r[0] for r in results]), _concat_fits([r[1] for r in results])
+    bliss = np.concatenate([r[2] for r in results])
+    loewe = np.concatenate([r[3] for r in results])
+
+    doses_a, doses_b = matrices.doses_a, matrices.doses_b
+    labels = matrices.labels
+    curves = pd.concat([
+        _curve_table(labels, fit_a, drug_a, drug_b, doses_b),
+        _curve_table(labels, fit_b, drug_b, drug_a, doses_a),
+    ], ignore_index=True)
+    ia, ib = np.nonzero((doses_a[:, None] > 0) & (doses_b[None, :] > 0))
+    observed = matrices.response[:, ia, ib]
+    measured = np.isfinite(observed)
+    g, cell = np.nonzero(measured)
+    synergy = labels.iloc[g].reset_index(drop=True)
+    synergy[drug_a] = doses_a[ia[cell]]
+    synergy[drug_b] = doses_b[ib[cell]]
+    synergy['observed'] = observed[g, cell]
+    synergy['bliss_expected'] = bliss[:, ia, ib][g, cell]
+    synergy['bliss'] = synergy['bliss_expected'] - synergy['observed']
+    synergy['loewe_expected'] = loewe[:, ia, ib][g, cell]
+    synergy['loewe'] = synergy['loewe_expected'] - synergy['observed']
+    return CombinationResult(curves, synergy, list(groups))
+
+
+def _curve_table(labels: pd.DataFrame, fit: HillFit, drug: str, partner: str,
+                 partner_doses: np.ndarray) -> pd.DataFrame:
+    # series are ordered group-major, partner concentration-minor
+    table = labels.iloc[np.repeat(np.arange(len(labels)), len(partner_doses))].reset_index(drop=True)
+    table['drug'] = drug
+    table['partner'] = partner
+    table['partner_dose'] = np.tile(partner_doses, len(labels))
+    return pd.concat([table, fit.to_frame()], axis=1)
@@ -1,28 +1,38 @@
-import matplotlib.pyplot as plt
-from matplotlib import ticker
-from matplotlib.gridspec import GridSpec
-from matplotlib.legend_handler import HandlerTuple
-import matplotlib as mpl
-
-import seaborn as sns
 from pathlib import Path
-from ifanalysis.normalisation import *
-from ifanalysis._helper_functions import save_fig
 from typing import List, Tuple
 
-# Matplotlib Style and Colors
-module_dir = Path(__file__).parent
-style_path = module_dir / 'styles/Style_01.mplstyle'
-plt.style.use(str(style_path))
-prop_cycle = plt.rcParams["axes.prop_cycle"]
-colors = prop_cycle.by_key()["color"]
+import pandas as pd
+
+from ifanalysis.normalisation import pivot_props, prop_pivot
+from ifanalysis._helper_functions import colors_getattr, lazy_module, new_figure, plot_style, save_fig, style_colors
+from ifanalysis.density import data_range, draw_density
+from ifanalysis.kde import binned_kde2d, cached_kde2d
+from ifanalysis.profiling import profiled
+from ifanalysis.summary import PlateSummary, quantile
+
+sns = lazy_module('seaborn')
+ticker = lazy_module('matplotlib.ticker')
+gridspec = lazy_module('matplotlib.gridspec')
+
+
+__getattr__ = colors_getattr(__name__)
+
 
 path = Path.cwd()
 
 
 
-def plot_histogram(ax, i, data):
-    sns.histplot(data=data, x="integrated_int_DAPI_norm", ax=ax)
+def plot_histogram(ax, i, data, hist=None):
+    """
+    DNA content histogram of one condition
+    :param hist: option, precomputed (counts, edges) of the data, see PlateSummary.histograms
+    """
+    if hist is not None:
+        counts, edges = hist
+        # bins as a list, seaborn rejects weights together with an array of bins
+        sns.histplot(x=edges[:-1], weights=counts, bins=list(edges), ax=ax)
+    else:
+        sns.histplot(data=data, x="integrated_int_DAPI_norm", ax=ax)
     ax.set_xlabel(None)
     ax.set_xscale("log", base=2)
     ax.set_xlim([1, 16])
@@ -32,20 +42,44 @@ def plot_histogram(ax, i, data):
     else:
         ax.yaxis.set_visible(False)
 
-def plot_scatter(ax, i, data, conditions, H3:bool):    
+scatter_kinds = ("scatter", "density", "count")
+
+
+def draw_cells(ax, data, x, y, phases, kind="scatter", x_range=None, y_range=None, log=(True, True)):
+    """
+    Draws one dot per cell (kind='scatter') or the binned density of all cells as a single raster,
+    coloured by dominant cell cycle phase ('density') or by cell count ('count')
+    :param x_range: option, (min, max) of the density bins on the x axis, default: data range
+    :param y_range: option, (min, max) of the density bins on the y axis, default: data range
+    :param log: log spaced density bins on the (x, y) axes
+    """
+    if kind == "scatter":
+        sns.scatterplot(data=data, x=x, y=y, hue='cell_cycle', hue_order=phases, s=5, alpha=0.8, ax=ax)
+        return
+    if kind not in scatter_kinds:
+        raise ValueError(f"kind must be one of {scatter_kinds}")
+    x_range = data_range(data[x], log[0], *(x_range or (None, None)))
+    y_range = data_range(data[y], log[1], *(y_range or (None, None)))
+    if kind == "density":
+        groups = pd.Index(phases).get_indexer(data['cell_cycle'].to_numpy(dtype=object))
+        draw_density(ax, data[x], data[y], x_range, y_range, log=log, groups=groups, colors=style_colors()[:len(phases)])
+    else:
+        draw_density(ax, data[x], data[y], x_range, y_range, log=log, cmap='rocket_r')
+
+
+def plot_scatter(ax, i, data, conditions, H3:bool, kind="scatter", y_range=None, key=None):
+    """
+    DNA/EdU scatter plot of one condition, with density contours in scatter mode
+    :param kind: 'scatter' (one dot per cell, default), 'density' or 'count', see draw_cells
+    :param y_range: option, EdU range of the density bins
+    :param key: option, cache key of the density contours, e.g. (cell_line, condition)
+    """
     if H3:
         phases = ["Sub-G1", "G1", "S", "G2", "M", "Polyploid"]
     else:
         phases = ["Sub-G1", "G1", "S", "G2/M", "Polyploid"]
-    sns.scatterplot(
-        data=data, 
-        x="integrated_int_DAPI_norm", 
-        y='intensity_mean_EdU_nucleus_norm', 
-        hue='cell_cycle',
-        hue_order=phases, 
-        s=5,
-        alpha=0.8,
-        ax=ax)
+    draw_cells(ax, data, "integrated_int_DAPI_norm", 'intensity_mean_EdU_nucleus_norm', phases, kind=kind,
+               x_range=(1, 16), y_range=y_range)
     ax.set_xscale('log')
     ax.set_yscale('log', base=2)
     ax.grid(False)
@@ -59,21 +93,48 @@ def plot_scatter(ax, i, data, conditions, H3:bool):
     
     else:
         ax.yaxis.set_visible(False)
-    ax.legend().remove()
+    if ax.get_legend():
+        ax.get_legend().remove()
     ax.axvline(x=3, color='black', linestyle='--')
     ax.axhline(y=3, color='black', linestyle='--')
-    sns.kdeplot(
-        data=data, 
-        x="integrated_int_DAPI_norm", 
-        y='intensity_mean_EdU_nucleus_norm', 
-        fill=True,
-        alpha=0.3,
-        cmap='rocket_r', 
-        ax=ax
-)
-
-def cellcycle_barplot(ax, df, conditions, H3): 
-    df_mean, df_std = prop_pivot(df, conditions, H3)
+    if kind != "scatter":
+        return
+    plot_kde(ax, data, "integrated_int_DAPI_norm", 'intensity_mean_EdU_nucleus_norm', key=key, alpha=0.3,
+             cmap='rocket_r')
+
+
+def kde_key(data, cell_line, condition) -> tuple:
+    """
+    Key of the cached density estimate of one condition: experiment and plates of the data with cell line and condition
+    """
+    scope = tuple(tuple(pd.unique(data[col]).tolist()) if col in data else None for col in ('experiment', 'plate_id'))
+    return scope + (cell_line, condition)
+
+
+def plot_kde(ax, data, x, y, key=None, levels=10, thresh=0.05, **contour_kws):
+    """
+    Filled density contours as drawn by sns.kdeplot(fill=True) on log-log axes, computed with the binned KDE
+    of the kde module (see there for the accuracy against seaborn)
+    :param key: option, cache key of the estimate, e.g. (cell_line, condition)
+    :param levels: number of iso-proportion levels, default 10
+    :param thresh: lowest iso-proportion level, default 0.05
+    :param contour_kws: passed on to ax.contourf, e.g. cmap and alpha
+    :return: contour set, None if the density cannot be estimated
+    """
+    grid = binned_kde2d(data[x], data[y]) if key is None else cached_kde2d(key, data[x], data[y])
+    if grid is None:
+        return None
+    return ax.contourf(grid.x, grid.y, grid.density, levels=grid.levels(levels, thresh), **contour_kws)
+
+def cellcycle_barplot(ax, df, conditions, H3, proportions=False):
+    """
+    :param df: single cell dataframe, or with proportions=True a cellcycle_prop table, e.g. PlateSummary.proportions
+    :param proportions: True if df is a cellcycle_prop table, default False
+    """
+    if proportions:
+        df_mean, df_std = pivot_props(df, conditions, H3)
+    else:
+        df_mean, df_std = prop_pivot(df, conditions, H3)
     df_mean.plot(kind="bar", stacked=True, yerr=df_std, width=0.75, ax=ax)
     ax.set_ylim(0, 110)
     ax.set_xticklabels(conditions, rotation=30, ha='right')
@@ -95,20 +156,38 @@ def cellcycle_barplot(ax, df, conditions, H3):
     ax.set_ylabel('% of population')
     ax.grid(False)
 
-def combplot(df, conditions, cell_line, title_str, cell_number=None, H3=False, save=True, path=path):
-    
+def edu_limits(df) -> Tuple[float, float]:
+    """
+    EdU axis limits of combplot
+    :param df: dataframe or PlateSummary
+    """
+    return (quantile(df, 'intensity_mean_EdU_nucleus_norm', 0.01) * 0.8,
+            quantile(df, 'intensity_mean_EdU_nucleus_norm', 0.99) * 1.5)
+
+@profiled(detail='cell_line')
+@plot_style()
+def combplot(df, conditions, cell_line, title_str, cell_number=None, H3=False, save=True, path=path, ylim=None,
+             kind="scatter"):
+    """
+    Histogram, scatter and cell cycle barplot per condition for one cell line
+    :param df: dataframe from cellcycle_analysis, or its PlateSummary to share the grouping between plots.
+    For a dataframe only the cells of cell_line are summarised.
+    :param ylim: option, EdU axis limits (min, max), default: from the 1% and 99% EdU quantiles of df,
+    pass them when df holds only this cell line (see render.report_jobs)
+    :param kind: 'scatter' (default), or 'density'/'count' to draw all cells as a binned raster, see draw_cells
+    """
     col_number = len(conditions)
-    df1 = df[df.cell_line == cell_line]
+    # the default EdU limits are those of all cells, then only the cells of this cell line are summarised
+    y_min, y_max = ylim or edu_limits(df)
+    summary = PlateSummary.of_cell_line(df, cell_line, quantile_columns=())
     condition_list = conditions * 2
 
-    fig = plt.figure(figsize=(3 * len(conditions), 5))
-    gs = GridSpec(2, col_number+1, height_ratios=[1, 3])
+    fig = new_figure(figsize=(3 * len(conditions), 5))
+    gs = gridspec.GridSpec(2, col_number+1, height_ratios=[1, 3])
     ax_list = [(i, j) for i in range(2) for j in range(col_number)]
-    y_max = df['intensity_mean_EdU_nucleus_norm'].quantile(0.99) * 1.5
-    y_min = df['intensity_mean_EdU_nucleus_norm'].quantile(0.01) * 0.8
 
     for i, pos in enumerate(ax_list):
-        data = df1[df1.condition == condition_list[i]]
+        data = summary.condition_data(cell_line, condition_list[i])
         if cell_number and len(data) >= cell_number:
             data_red = data.sample(n=cell_number, random_state=42)
         else:
@@ -116,10 +195,12 @@ def combplot(df, conditions, cell_line, title_str, cell_number=None, H3=False, s
         ax = fig.add_subplot(gs[pos[0], pos[1]])
 
         if i < len(conditions):
-            plot_histogram(ax, i, data_red)
+            hist = summary.histograms.get((cell_line, condition_list[i])) if data_red is data else None
+            plot_histogram(ax, i, data_red, hist)
             ax.set_title(f"{condition_list[i]} \n{len(data_red)} cells", size=12, weight='bold')
         else:
-            plot_scatter(ax, i, data_red, conditions, H3)
+            plot_scatter(ax, i, data_red, conditions, H3, kind=kind, y_range=(y_min, y_max),
+                         key=kde_key(data_red, cell_line, condition_list[i]))
             ax.set_ylim([y_min, y_max])
 
         ax.grid(visible=False)
@@ -127,15 +208,15 @@ def combplot(df, conditions, cell_line, title_str, cell_number=None, H3=False, s
     ax_last = fig.add_subplot(gs[:, -1])
     ax_last.grid(visible=False)
     # Add the barplot to the subplot
-    cellcycle_barplot(ax_last, df1, conditions, H3)
+    cellcycle_barplot(ax_last, summary.proportions([cell_line]), conditions, H3, proportions=True)
     # ax_last.set_title("Cell Cycle Dist.", size=12, weight='bold')
 
     title = f"{title_str} {cell_line}"
     fig.suptitle(title, size=14, weight='bold', x=0.01, horizontalalignment='left')
     fig._suptitle.set_weight('bold')
     # Adjust the spacing between the title and the plot
-    plt.subplots_adjust(top=0.85)  # Increase the value to leave more space
-    plt.tight_layout()
+    fig.subplots_adjust(top=0.85)  # Increase the value to leave more space
+    fig.tight_layout()
     if save:
         save_fig(fig, path, f"{cell_line} CombPlot {title_str}", fig_extension="png")
 
@@ -1,63 +1,96 @@
 from pathlib import Path
-from typing import List
+from typing import List, Sequence, Union
 
-import matplotlib.pyplot as plt
-import seaborn as sns
+import numpy as np
+import pandas as pd
 
-from ifanalysis._helper_functions import save_fig
-from ifanalysis.normalisation import *
+from ifanalysis._helper_functions import colors_getattr, lazy_module, new_figure, plot_style, save_fig, style_colors
+from ifanalysis.normalisation import group_codes
+from ifanalysis.profiling import profiled
 
-# Matplotlib Style and Colors
-module_dir = Path(__file__).parent
-style_path = module_dir / 'styles/Style_01.mplstyle'
-plt.style.use(str(style_path))
-prop_cycle = plt.rcParams["axes.prop_cycle"]
-colors = prop_cycle.by_key()["color"]
+plt = lazy_module('matplotlib.pyplot')
+sns = lazy_module('seaborn')
+
+
+__getattr__ = colors_getattr(__name__)
 
-# Get the path to the styles directory within the package
 path = Path.cwd()
 
 
-def count_per_cond(df: pd.DataFrame, ctr_cond: str) -> pd.DataFrame:
+# Well keys of the count tables
+COUNT_KEYS = ["cell_line", "condition", "well", "plate_id"]
+
+
+@profiled()
+def count_per_cond(df: pd.DataFrame, ctr_cond: Union[str, Sequence[str]],
+                   by: Sequence[str] = ("cell_line",), pooled: bool = True) -> pd.DataFrame:
     """
     Function to generate counts per condition and cell line data using groupby
     of the single cell dataframe from omero-screen. Data are grouped by
     cell line and condition. The function also normalises
     the data using normalise count function with the supplied ctr_cond as a reference.
-    :param df: dataframe from omero-screen
-    :param ctr_cond: control condition
+    :param df: dataframe from omero-screen, or a PlateSummary or Campaign whose well counts are reused
+    :param ctr_cond: control condition, or a list of control conditions
+    :param by: reference groups of the normalisation, see normalise_count, default per cell line
+    :param pooled: with several controls, see normalise_count
     :return: dataframe with counts per condition and cell line
     """
-    df_count = (
-        df.groupby(["cell_line", "condition", "well", "plate_id"])["experiment"]
-        .count()
-        .reset_index()
-        .rename(columns={"experiment": "abs cell count"})
-    )
-    df_count["norm_count"] = normalise_count(df_count, ctr_cond)
+    if not isinstance(df, pd.DataFrame):
+        counts = df.well_counts().reorder_levels(COUNT_KEYS).sort_index()
+    else:
+        counts = df.groupby(COUNT_KEYS, observed=True)["experiment"].count()
+    df_count = counts.reset_index().rename(columns={"experiment": "abs cell count"})
+    df_count["norm_count"] = normalise_count(df_count, ctr_cond, by=by, pooled=pooled)
     return df_count
 
 
-def normalise_count(df: pd.DataFrame, ctr_cond: str) -> pd.Series:
+@profiled()
+def normalise_count(df: pd.DataFrame, ctr_cond: Union[str, Sequence[str]], by: Sequence[str] = ("cell_line",),
+                    pooled: bool = True, control_col: str = "condition", value: str = "abs cell count"
+                    ) -> pd.Series:
     """
-    Function to normalise counts per condition and cell line data using groupby
-    :param df: grouped by dataframe provided by norm_count function
-    :param ctr_cond: control condition
-    :return: pandas series with normalised counts
+    Counts relative to the mean count of the control wells in the same reference group,
+    computed for all groups at once from one grouping of the well table
+    :param df: dataframe with one row per well, e.g. from count_per_cond
+    :param ctr_cond: control condition, or a list of control conditions
+    :param by: columns of the reference groups: ('cell_line',) (default), ('plate_id', 'cell_line') per plate and
+    cell line, ('plate_id',) per plate, or () for one reference for all wells
+    :param pooled: with several controls, True (default) averages all control wells,
+    False averages the means of the controls so that each control has the same weight
+    :param control_col: column of the control, default 'condition'
+    :param value: count column, default 'abs cell count'
+    :return: normalised counts aligned with the rows of df, NaN in groups without control wells
     """
-    norm_count = pd.DataFrame()
-    for cell_line in df["cell_line"].unique():
-        norm_value = df.loc[
-            (df["cell_line"] == cell_line) & (df["condition"] == ctr_cond),
-            "abs cell count",
-        ].mean()
-        rel_cellcount = (
-            df.loc[df["cell_line"] == cell_line, "abs cell count"] / norm_value
-        )
-        norm_count = pd.concat([norm_count, rel_cellcount])
-    return norm_count
-
-
+    controls = list(ctr_cond) if isinstance(ctr_cond, (list, tuple, set, pd.Index, np.ndarray)) else [ctr_cond]
+    by = list(by)
+    counts = df[value].to_numpy(dtype=float)
+    # dense group numbers, -1 for rows with a missing key
+    codes = group_codes(df, by)
+    group = np.full(len(df), -1, dtype=np.int64)
+    group[codes >= 0] = pd.factorize(codes[codes >= 0])[0]
+    n_groups = int(group.max()) + 1 if len(group) else 0
+    is_ctr = df[control_col].isin(controls).to_numpy() & (group >= 0)
+    ctr_group, ctr_counts = group[is_ctr], counts[is_ctr]
+    if pooled or len(controls) == 1:
+        totals = np.bincount(ctr_group, weights=ctr_counts, minlength=n_groups)
+        n_wells = np.bincount(ctr_group, minlength=n_groups)
+    else:
+        # mean per (group, control), then the unweighted mean of these per group
+        control = pd.Index(controls).get_indexer(df[control_col].to_numpy()[is_ctr])
+        pair = ctr_group * len(controls) + control
+        pair_totals = np.bincount(pair, weights=ctr_counts, minlength=n_groups * len(controls))
+        pair_wells = np.bincount(pair, minlength=n_groups * len(controls))
+        present = pair_wells > 0
+        pair_means = np.divide(pair_totals, pair_wells, out=np.zeros_like(pair_totals), where=present)
+        totals = pair_means.reshape(n_groups, len(controls)).sum(axis=1)
+        n_wells = present.reshape(n_groups, len(controls)).sum(axis=1)
+    reference = np.full(n_groups + 1, np.nan)
+    np.divide(totals, n_wells, out=reference[:-1], where=n_wells > 0)
+    # rows with a missing group key (-1) get the trailing NaN
+    return pd.Series(counts / reference[group], index=df.index, name="norm_count")
+
+
+@plot_style()
 def cellnumber(
     df_count: pd.DataFrame,
     conditions: List[str],
@@ -93,16 +126,18 @@ def cellnumber(
         y=y_axis,
         errorbar="sd",
         order=conditions,
-        color=colors[0],
+        color=style_colors()[0],
         ax=ax,
     )
     if title:
-        plt.title(f"{title} {cell_line}")
+        ax.set_title(f"{title} {cell_line}")
     if save:
         save_fig(fig, path, f"{title} {cell_line}")
     return plot
 
 
+@profiled()
+@plot_style()
 def count_plots(
     df_count: pd.DataFrame,
     conditions: List[str],
@@ -120,8 +155,8 @@ def count_plots(
     :return: None (plots and saves the figure)
     """
     row_num = len(df_count.cell_line.unique())
-    fig, ax = plt.subplots(nrows=row_num, ncols=2, figsize=(6, 2 * row_num))
-    ax = np.atleast_2d(ax)  # Reshape ax to always have 2 dimensions
+    fig = new_figure(figsize=(6, 2 * row_num))
+    ax = np.atleast_2d(fig.subplots(nrows=row_num, ncols=2))  # Reshape ax to always have 2 dimensions
 
     for i, cell_line in enumerate(df_count.cell_line.unique()):
         cellnumber(df_count, conditions, cell_line, type="relative", ax=ax[i, 0])
@@ -135,11 +170,12 @@ def count_plots(
         ax[i, 1].set_xticklabels(conditions, rotation=30, ha="right")
     fig.suptitle(title, size=12, weight="bold", x=0.05, horizontalalignment="left")
     fig._suptitle.set_weight("bold")
-    plt.tight_layout()
+    fig.tight_layout()
     if save:
         save_fig(fig, path, title)
 
 
+@plot_style()
 def count_cells(
     df: pd.DataFrame,
     conditions: List[str],
@@ -0,0 +1,118 @@
+"""
+Density rendering of large scatter plots.
+All cells are binned into a 2D histogram (log or linear bins per axis) with np.bincount and drawn as a single
+rasterized QuadMesh, coloured by the dominant cell cycle phase of each bin or by cell count. Drawing time
+no longer depends on the number of cells, so no subsampling (cell_number) is needed.
+"""
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+# Bins per axis of the density plots
+DENSITY_BINS = (200, 200)
+
+
+def bin_edges(value_range: Tuple[float, float], bins: int, log: bool = True) -> np.ndarray:
+    """
+    Bin edges over value_range, equally spaced in log space (log=True) or linearly
+    """
+    if log:
+        return np.geomspace(value_range[0], value_range[1], bins + 1)
+    return np.linspace(value_range[0], value_range[1], bins + 1)
+
+
+def bin_index(values, value_range: Tuple[float, float], bins: int, log: bool = True) -> np.ndarray:
+    """
+    Bin of every value for the edges of bin_edges, -1 for values outside the range (or non-positive in log space)
+    """
+    values = np.asarray(values, dtype=float)
+    low, high = value_range
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if log:
+            values, low, high = np.log(values), np.log(low), np.log(high)
+        position = (values - low) * (bins / (high - low))
+    inside = (values >= low) & (values <= high)
+    return np.where(inside, np.minimum(np.where(inside, position, 0), bins - 1).astype(np.int64), -1)
+
+
+def histogram2d(x, y, x_range: Tuple[float, float], y_range: Tuple[float, float],
+                bins: Tuple[int, int] = DENSITY_BINS, log: Tuple[bool, bool] = (True, True),
+                groups=None, n_groups: int = 1) -> np.ndarray:
+    """
+    2D histogram in one np.bincount pass, optionally split by group
+    :param x: x values
+    :param y: y values
+    :param x_range: (min, max) of the x bins
+    :param y_range: (min, max) of the y bins
+    :param bins: number of (x, y) bins, default DENSITY_BINS
+    :param log: log spaced (x, y) bins, default (True, True)
+    :param groups: option, integer group code per value (e.g. phase codes), negative codes are ignored
+    :param n_groups: number of groups
+    :return: counts of shape (n_groups, y bins, x bins), values outside the ranges are dropped
+    """
+    ix = bin_index(x, x_range, bins[0], log[0])
+    iy = bin_index(y, y_range, bins[1], log[1])
+    groups = np.zeros(len(ix), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+    keep = (ix >= 0) & (iy >= 0) & (groups >= 0) & (groups < n_groups)
+    flat = (groups[keep] * bins[1] + iy[keep]) * bins[0] + ix[keep]
+    return np.bincount(flat, minlength=n_groups * bins[0] * bins[1]).reshape(n_groups, bins[1], bins[0])
+
+
+def phase_image(counts: np.ndarray, colors: Sequence) -> np.ndarray:
+    """
+    RGBA image colouring each bin by its most frequent group, with opacity rising with the log of the bin count,
+    empty bins are transparent
+    :param counts: per group counts from histogram2d
+    :param colors: one matplotlib colour per group
+    :return: RGBA array of shape (y bins, x bins, 4)
+    """
+    from matplotlib.colors import to_rgba_array
+
+    total = counts.sum(axis=0)
+    rgba = to_rgba_array(colors)[np.argmax(counts, axis=0)]
+    # single cells stay visible, the densest bins are opaque
+    rgba[..., 3] = np.where(total > 0, 0.3 + 0.7 * np.log1p(total) / np.log1p(max(total.max(), 1)), 0)
+    return rgba
+
+
+def draw_density(ax, x, y, x_range: Tuple[float, float], y_range: Tuple[float, float],
+                 bins: Tuple[int, int] = DENSITY_BINS, log: Tuple[bool, bool] = (True, True),
+                 groups=None, colors: Optional[Sequence] = None, cmap: str = 'magma_r'):
+    """
+    Draws a density plot of all points as one rasterized QuadMesh
+    :param ax: matplotlib axis
+    :param x: x values
+    :param y: y values
+    :param x_range: (min, max) of the x bins
+    :param y_range: (min, max) of the y bins
+    :param bins: number of (x, y) bins, default DENSITY_BINS
+    :param log: log spaced (x, y) bins, default (True, True)
+    :param groups: option, integer group code per point, bins are then coloured by their dominant group
+    :param colors: colours of the groups, required with groups
+    :param cmap: colour map for the counts without groups, default 'magma_r'
+    :return: QuadMesh artist
+    """
+    x_edges = bin_edges(x_range, bins[0], log[0])
+    y_edges = bin_edges(y_range, bins[1], log[1])
+    if groups is not None:
+        counts = histogram2d(x, y, x_range, y_range, bins, log, groups, len(colors))
+        return ax.pcolormesh(x_edges, y_edges, phase_image(counts, colors), rasterized=True)
+    from matplotlib.colors import LogNorm
+
+    counts = histogram2d(x, y, x_range, y_range, bins, log)[0]
+    return ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts, 0), cmap=cmap,
+                         norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)), rasterized=True)
+
+
+def data_range(values, log: bool = True, low: Optional[float] = None,
+               high: Optional[float] = None) -> Tuple[float, float]:
+    """
+    Binning range of values: the given limits, else the finite (positive in log space) data range
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values) & (values > 0)] if log else values[np.isfinite(values)]
+    if len(values) == 0:
+        return (1.0, 2.0) if log else (0.0, 1.0)
+    low = values.min() if low is None or (log and low <= 0) else low
+    high = values.max() if high is None else high
+    return (low, high) if high > low else (low, low * 2 if log else low + 1)
@@ -0,0 +1,221 @@
+"""
+Declarative cell cycle gates.
+A GatingModel is an ordered list of PhaseGates, each gate being a region over any number of
+normalised intensity channels. The model compiles once into a lookup table over the cut points
+of every channel, so (re-)labelling a dataframe is a handful of numpy searchsorted calls
+regardless of the number of gates.
+"""
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DAPI_col = 'integrated_int_DAPI_norm'
+EdU_col = 'intensity_mean_EdU_nucleus_norm'
+H3P_col = 'intensity_mean_H3P_nucleus_norm'
+
+
+@dataclass(frozen=True)
+class PhaseGate:
+    """
+    Region of channel space assigned to one cell cycle phase.
+    :param phase: detailed phase label, e.g. 'Early S'
+    :param bounds: dict of column name -> pd.Interval, infinite endpoints mean unbounded
+    :param summary: coarse phase label for the cell_cycle column, default: same as phase
+    """
+    phase: str
+    bounds: Dict[str, pd.Interval] = field(hash=False)
+    summary: Optional[str] = None
+
+    @property
+    def summary_phase(self) -> str:
+        return self.summary or self.phase
+
+    def contains(self, point: Dict[str, float]) -> bool:
+        return all(point[channel] in interval for channel, interval in self.bounds.items())
+
+
+@dataclass(frozen=True)
+class GatingModel:
+    """
+    Ordered set of phase gates, the first matching gate wins and cells outside
+    all gates get the default label. Missing values fail every bound on their channel.
+    """
+    gates: Tuple[PhaseGate, ...]
+    default: str = "Unassigned"
+
+    @property
+    def channels(self) -> List[str]:
+        return list(dict.fromkeys(channel for gate in self.gates for channel in gate.bounds))
+
+    @property
+    def categories(self) -> List[str]:
+        return list(dict.fromkeys([gate.phase for gate in self.gates] + [self.default]))
+
+    @property
+    def summary_categories(self) -> List[str]:
+        return list(dict.fromkeys([gate.summary_phase for gate in self.gates] + [self.default]))
+
+    def with_thresholds(self, channel: str, mapping: Dict[float, float]) -> "GatingModel":
+        """
+        Returns a copy of the model with the cut points of one channel moved,
+        e.g. with_thresholds(EdU_col, {3: 2.5}) to retune the EdU gate.
+        """
+        def move(interval: pd.Interval) -> pd.Interval:
+            return pd.Interval(mapping.get(interval.left, interval.left),
+                               mapping.get(interval.right, interval.right), closed=interval.closed)
+
+        gates = tuple(
+            replace(gate, bounds={ch: move(iv) if ch == channel else iv for ch, iv in gate.bounds.items()})
+            for gate in self.gates
+        )
+        return replace(self, gates=gates)
+
+    def with_channels(self, mapping: Dict[str, str]) -> "GatingModel":
+        """
+        Returns a copy of the model gating on renamed columns.
+        """
+        gates = tuple(
+            replace(gate, bounds={mapping.get(ch, ch): iv for ch, iv in gate.bounds.items()})
+            for gate in self.gates
+        )
+        return replace(self, gates=gates)
+
+    @cached_property
+    def compiled(self) -> "CompiledGates":
+        return CompiledGates(self)
+
+    def classify(self, data: pd.DataFrame) -> Tuple[pd.Categorical, pd.Categorical]:
+        """
+        Labels every row of data.
+        :param data: dataframe with normalised intensity columns for all gated channels
+        :return: tuple of Categoricals (cell_cycle_detailed, cell_cycle)
+        """
+        return self.compiled(data)
+
+    def apply(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        (Re-)labels an already normalised dataframe in place
+        :param data: dataframe from normalise or cellcycle_analysis
+        :return: the same dataframe with cell_cycle_detailed and cell_cycle columns
+        """
+        data["cell_cycle_detailed"], data["cell_cycle"] = self.classify(data)
+        return data
+
+
+class CompiledGates:
+    """
+    Lookup table evaluator for a GatingModel. Each channel value is mapped to the open interval
+    between two cut points or onto a cut point itself, so that every gate boundary (<, <=) is resolved
+    exactly. The label of each combination of channel regions is precomputed from the gates.
+    """
+
+    def __init__(self, model: GatingModel):
+        self.channels = model.channels
+        self.categories = model.categories
+        self.summary_categories = model.summary_categories
+        self.cuts = []
+        representatives = []
+        for channel in self.channels:
+            endpoints = {
+                endpoint
+                for gate in model.gates if channel in gate.bounds
+                for endpoint in (gate.bounds[channel].left, gate.bounds[channel].right)
+                if np.isfinite(endpoint)
+            }
+            cuts = np.array(sorted(endpoints), dtype=float)
+            self.cuts.append(cuts)
+            representatives.append(self._representatives(cuts))
+        shape = tuple(len(values) for values in representatives)
+        default_code = self.categories.index(model.default)
+        table = np.full(shape, default_code, dtype=np.int8)
+        for region in np.ndindex(*shape):
+            point = {ch: representatives[i][r] for i, (ch, r) in enumerate(zip(self.channels, region))}
+            for gate in model.gates:
+                if gate.contains(point):
+                    table[region] = self.categories.index(gate.phase)
+                    break
+        self.table = table.ravel()
+        self.strides = np.array([int(np.prod(shape[i + 1:])) for i in range(len(shape))], dtype=np.int64)
+        summary = dict((gate.phase, gate.summary_phase) for gate in model.gates)
+        self.summary_lookup = np.array(
+            [self.summary_categories.index(summary.get(phase, phase)) for phase in self.categories], dtype=np.int8
+        )
+
+    @staticmethod
+    def _representatives(cuts: np.ndarray) -> np.ndarray:
+        """
+        One value per region: below the first cut, on each cut, between cuts and above the last cut
+        """
+        values = [cuts[0] - 1 if len(cuts) else 0.0]
+        for i, cut in enumerate(cuts):
+            values.append(cut)
+            values.append((cut + cuts[i + 1]) / 2 if i + 1 < len(cuts) else cut + 1)
+        # missing values get their own region, NaN is outside every interval
+        values.append(np.nan)
+        return np.array(values)
+
+    def codes(self, data: pd.DataFrame) -> np.ndarray:
+        flat = np.zeros(len(data), dtype=np.int64)
+        for channel, cuts, stride in zip(self.channels, self.cuts, self.strides):
+            values = data[channel].to_numpy(dtype=float)
+            position = np.searchsorted(cuts, values, side='left')
+            on_cut = cuts[np.minimum(position, len(cuts) - 1)] == values if len(cuts) else False
+            region = np.where(np.isnan(values), 2 * len(cuts) + 1, 2 * position + on_cut)
+            flat += region * stride
+        return self.table[flat]
+
+    def __call__(self, data: pd.DataFrame) -> Tuple[pd.Categorical, pd.Categorical]:
+        codes = self.codes(data)
+        detailed = pd.Categorical.from_codes(codes, categories=self.categories)
+        summary = pd.Categorical.from_codes(self.summary_lookup[codes], categories=self.summary_categories)
+        return detailed, summary
+
+
+def _below(value: float, closed: str = 'neither') -> pd.Interval:
+    return pd.Interval(-np.inf, value, closed=closed)
+
+
+def _above(value: float, closed: str = 'neither') -> pd.Interval:
+    return pd.Interval(value, np.inf, closed=closed)
+
+
+_sub_g1 = _below(1.5, closed='right')
+_diploid = pd.Interval(1.5, 3, closed='neither')
+_tetraploid = pd.Interval(3, 5.5, closed='left')
+_polyploid = _above(5.5, closed='left')
+_edu_low = _below(3)
+_edu_high = _above(3)
+
+# Gates equivalent to normalisation.thresholding
+STANDARD_GATES = GatingModel(gates=(
+    PhaseGate("Sub-G1", {DAPI_col: _sub_g1}),
+    PhaseGate("G1", {DAPI_col: _diploid, EdU_col: _edu_low}),
+    PhaseGate("Early S", {DAPI_col: _diploid, EdU_col: _edu_high}, summary="S"),
+    PhaseGate("Late S", {DAPI_col: _tetraploid, EdU_col: _edu_high}, summary="S"),
+    PhaseGate("G2/M", {DAPI_col: _tetraploid, EdU_col: _edu_low}),
+    PhaseGate("Polyploid (non-replicating)", {DAPI_col: _polyploid, EdU_col: _edu_low}, summary="Polyploid"),
+    PhaseGate("Polyploid (replicating)", {DAPI_col: _polyploid, EdU_col: _edu_high}, summary="Polyploid"),
+))
+
+# Gates equivalent to normalisation.thresholdingH3
+H3_GATES = GatingModel(gates=(
+    PhaseGate("Sub-G1", {DAPI_col: _sub_g1}),
+    PhaseGate("G1", {DAPI_col: _diploid, EdU_col: _edu_low}),
+    PhaseGate("Early S", {DAPI_col: _diploid, EdU_col: _edu_high}, summary="S"),
+    PhaseGate("Late S", {DAPI_col: _tetraploid, EdU_col: _edu_high}, summary="S"),
+    PhaseGate("G2", {DAPI_col: _tetraploid, EdU_col: _edu_low, H3P_col: _below(5)}),
+    PhaseGate("M", {DAPI_col: _tetraploid, EdU_col: _edu_low, H3P_col: _above(5)}),
+    PhaseGate("Polyploid (non-replicating)", {DAPI_col: _polyploid, EdU_col: _edu_low}, summary="Polyploid"),
+    PhaseGate("Polyploid (replicating)", {DAPI_col: _polyploid, EdU_col: _edu_high}, summary="Polyploid"),
+))
+
+
+def preset_gates(H3: bool = False) -> GatingModel:
+    """
+    :param H3: if True, return the gates splitting G2 and M by H3P intensity
+    :return: preset GatingModel
+    """
+    return H3_GATES if H3 else STANDARD_GATES
@@ -1,46 +1,45 @@
-import matplotlib.pyplot as plt
-from matplotlib import ticker
-from matplotlib.gridspec import GridSpec
-import matplotlib as mpl
-import seaborn as sns
 from pathlib import Path
-from ifanalysis.normalisation import *
-from ifanalysis._helper_functions import save_fig
 from typing import List, Tuple
 
-## Matplotlib Style and Colors
-module_dir = Path(__file__).parent
-style_path = module_dir / 'styles/Style_01.mplstyle'
-plt.style.use(str(style_path))
-prop_cycle = plt.rcParams["axes.prop_cycle"]
-colors = prop_cycle.by_key()["color"]
+import pandas as pd
+
+from ifanalysis._helper_functions import colors_getattr, lazy_module, new_figure, plot_style, save_fig, style_colors
+from ifanalysis.combplot import draw_cells
+from ifanalysis.profiling import profiled
+from ifanalysis.summary import PlateSummary
+
+sns = lazy_module('seaborn')
+ticker = lazy_module('matplotlib.ticker')
+gridspec = lazy_module('matplotlib.gridspec')
+
+
+__getattr__ = colors_getattr(__name__)
 
 
 path = Path.cwd()
 
 
 
-def plot_int_scatter(ax, df, condition, col, cell_number): 
+def plot_int_scatter(ax, df, condition, col, cell_number, kind="scatter", y_range=None):
+    """
+    DNA content against an intensity column for one condition
+    :param kind: 'scatter' (one dot per cell, default), 'density' or 'count', see combplot.draw_cells
+    :param y_range: option, intensity range of the density bins (linear)
+    """
     phases = ["Sub-G1", "G1", "S", "G2/M", "Polyploid"]
     data = df[df['condition'] == condition]
     if cell_number and len(data) >= cell_number:
             data = data.sample(n=cell_number, random_state=42)
-    sns.scatterplot(
-        data=data, 
-        x="integrated_int_DAPI_norm", 
-        y=col, 
-        hue='cell_cycle',
-        hue_order=phases,
-        s=5,
-        alpha=0.8,
-        ax=ax)
+    draw_cells(ax, data, "integrated_int_DAPI_norm", col, phases, kind=kind, x_range=(1, 16), y_range=y_range,
+               log=(True, False))
     ax.set_xscale('log')
     ax.xaxis.set_major_formatter(ticker.FuncFormatter(lambda x, pos: str(int(x))))
     ax.set_xticks([1, 2, 4, 8])
     ax.set_xlim([1, 16])
     ax.set_xlabel("norm. DNA content")
     ax.set_title(condition)
-    ax.legend().remove()
+    if ax.get_legend():
+        ax.get_legend().remove()
 
 def plot_int_violin(ax, i, df: pd.DataFrame, conditions: list, col: str, phase):     
     sns.violinplot(
@@ -52,7 +51,7 @@ def plot_int_violin(ax, i, df: pd.DataFrame, conditions: list, col: str, phase):
         density_norm='width', 
         inner=None, 
         linewidth=0,
-        color=colors[i+1],
+        color=style_colors()[i+1],
         ax=ax)
     for violin in ax.collections:
         violin.set_alpha(1)
@@ -65,42 +64,54 @@ def plot_int_violin(ax, i, df: pd.DataFrame, conditions: list, col: str, phase):
     ax.set_title(phase)   
     ax.set_xlabel('') 
 
-def int_combplot(df, conditions, cell_line, col, label=None, title=None, cellnumber=None, save=True, path=path):
-    
+@profiled(detail='cell_line')
+@plot_style()
+def int_combplot(df, conditions, cell_line, col, label=None, title=None, cellnumber=None, save=True, path=path,
+                 kind="scatter"):
+    """
+    Intensity scatter plots per condition and violin plots per cell cycle phase for one cell line
+    :param df: dataframe from cellcycle_analysis, or its PlateSummary. For a dataframe only the cells of
+    cell_line are summarised.
+    :param kind: 'scatter' (default), or 'density'/'count' to draw all cells as a binned raster
+    """
     col_number = len(conditions)
-    if label not in col:
-        df1 = df[(df.cell_line == cell_line) & (df.label == label)]
+    summary = PlateSummary.of_cell_line(df, cell_line, quantile_columns=())
+    df1 = summary.cell_line_data(cell_line)
+    if label is not None and label not in col:
+        df1 = df1[df1.label == label]
+        quantiles = df1[col].quantile([0.01, 0.99, 0.995]).to_list()
     else:
-        df1 = df[(df.cell_line == cell_line)]
-    condition_list = conditions * 2
-    y_max = df1[col].quantile(0.99) * 1.5
-    y_min = df1[col].quantile(0.01) * 0.8
-    fig = plt.figure(figsize=(3 * len(conditions), 3))
-    gs = GridSpec(1, col_number + 3, width_ratios=[1] * col_number + [0.5] * 3, wspace=0.1)
+        quantiles = [summary.quantile(col, q, cell_line) for q in (0.01, 0.99, 0.995)]
+    y_max = quantiles[1] * 1.5
+    y_min = quantiles[0] * 0.8
+    fig = new_figure(figsize=(3 * len(conditions), 3))
+    gs = gridspec.GridSpec(1, col_number + 3, width_ratios=[1] * col_number + [0.5] * 3, wspace=0.1)
     for i, condition in enumerate(conditions):
         ax_int = fig.add_subplot(gs[0, i])
         ax_int.set_ylim([y_min+1, y_max+1])
-        plot_int_scatter(ax_int, df1, condition, col, cellnumber)
+        # the condition slice of the summary, plot_int_scatter then only filters that slice
+        df_condition = df1 if label is not None and label not in col else summary.condition_data(cell_line, condition)
+        plot_int_scatter(ax_int, df_condition, condition, col, cellnumber, kind=kind, y_range=(y_min + 1, y_max + 1))
         if i == 0:
             ax_int.set_ylabel(col)
             ax_int.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, pos: str(int(x))))
         else:    
             ax_int.set_ylabel('')
             ax_int.set_yticklabels([])
-            ax_int.legend().remove()
-    max_value = df1[col].quantile(0.995)
+    max_value = quantiles[2]
     min_value = 0
     cellcycle_phases = ['G1', 'S', 'G2/M']
+    df_phases = dict(list(df1.groupby('cell_cycle', observed=True)))
     for i, phase in enumerate(cellcycle_phases):
         ax_violin = fig.add_subplot(gs[0, i+col_number])
         ax_violin.set_ylim([y_min, y_max])
         ax_violin.set_yticklabels([])
-        df_phase = df1[df1['cell_cycle'] == phase]
+        df_phase = df_phases.get(phase, df1.iloc[0:0])
         plot_int_violin(ax_violin, i, df_phase, conditions, col, phase)
     if not title:
         title = f"{col}, {cell_line}"
     fig.suptitle(title, size=14, weight='bold', x=0.01, horizontalalignment='left')
     fig._suptitle.set_weight('bold')
-    plt.subplots_adjust(top=0.8)  # Increase the value to leave more space
+    fig.subplots_adjust(top=0.8)  # Increase the value to leave more space
     if save:
         save_fig(fig, path, title, tight_layout=False, fig_extension="png")
\ No newline at end of file
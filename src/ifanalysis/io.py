@@ -0,0 +1,213 @@
+"""
+Loading of omero-screen single cell exports.
+read_screen reads CSV or Parquet files, projects the columns an analysis needs and downcasts on load
+(float32 mean/min/max intensities, smallest integer types, categorical keys). CSV files are converted to Parquet
+on first read and later reads of the same plate come from the Parquet copy.
+Parquet support requires pyarrow (pip install hhlab-ifanalysis[parquet]).
+"""
+import hashlib
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# Columns used by the analysis modules, only those present in a file are read
+KEY_COLUMNS = ['experiment', 'plate_id', 'well', 'image_id', 'cell_line', 'condition', 'Cyto_ID']
+CATEGORICAL_COLUMNS = ['experiment', 'plate_id', 'well', 'cell_line', 'condition']
+# Integrated intensities and the columns summed over multinucleates stay float64: DAPI sums of ~1e6-1e7
+# lose their last digits in float32 and the DAPI mode sets the G1/G2 gates
+PRECISE_COLUMNS = ['integrated_int_DAPI', 'area_nucleus']
+ANALYSIS_COLUMNS = {
+    'counts': ['experiment', 'plate_id', 'well', 'cell_line', 'condition'],
+    'cellcycle': KEY_COLUMNS + ['integrated_int_DAPI', 'area_nucleus',
+                                'intensity_mean_EdU_nucleus', 'intensity_min_EdU_nucleus'],
+    'cellcycle_H3': KEY_COLUMNS + ['integrated_int_DAPI', 'area_nucleus',
+                                   'intensity_mean_EdU_nucleus', 'intensity_min_EdU_nucleus',
+                                   'intensity_mean_H3P_nucleus', 'intensity_min_H3P_nucleus'],
+}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            "Parquet support requires pyarrow, install it with pip install hhlab-ifanalysis[parquet]"
+        ) from None
+
+
+def has_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def analysis_columns(analysis: Union[str, Iterable[str], None] = None,
+                     columns: Optional[Iterable[str]] = None) -> Optional[List[str]]:
+    """
+    Columns to read for one or more analyses plus any extra columns
+    :param analysis: option, key(s) of ANALYSIS_COLUMNS, e.g. 'cellcycle' or ['counts', 'cellcycle_H3']
+    :param columns: option, additional columns, e.g. an intensity column for int_combplot
+    :return: list of column names, None to read all columns
+    """
+    if analysis is None and columns is None:
+        return None
+    analyses = [analysis] if isinstance(analysis, str) else list(analysis or [])
+    selected = []
+    for name in analyses:
+        if name not in ANALYSIS_COLUMNS:
+            raise ValueError(f"analysis must be one of {list(ANALYSIS_COLUMNS)}")
+        selected += ANALYSIS_COLUMNS[name]
+    selected += list(columns or [])
+    return list(dict.fromkeys(selected))
+
+
+def downcast(df: pd.DataFrame, categorical: Iterable[str] = CATEGORICAL_COLUMNS,
+             precise: Iterable[str] = PRECISE_COLUMNS) -> pd.DataFrame:
+    """
+    Reduces the memory footprint of an omero-screen dataframe in place: float columns to float32, except
+    integrated intensities and the precise columns, integer columns to the smallest integer type
+    and key columns to categoricals
+    :param df: single cell data from omero-screen
+    :param categorical: columns to convert to categoricals, default CATEGORICAL_COLUMNS
+    :param precise: float columns kept as float64 in addition to integrated_* columns, default PRECISE_COLUMNS
+    :return: the downcast dataframe
+    """
+    precise = set(precise)
+    for col in df.columns:
+        if col in categorical:
+            df[col] = df[col].astype('category')
+        elif pd.api.types.is_float_dtype(df[col]):
+            if col not in precise and not col.startswith('integrated_'):
+                df[col] = df[col].astype(np.float32)
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+
+def _present(columns: Optional[List[str]], available: Iterable[str]) -> Optional[List[str]]:
+    if columns is None:
+        return None
+    available = set(available)
+    return [col for col in columns if col in available]
+
+
+def _read_csv(path: Path, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    header = pd.read_csv(path, nrows=0).columns
+    # drop the unnamed index column of exports written with DataFrame.to_csv
+    usecols = [col for col in (_present(columns, header) or header) if not col.startswith('Unnamed:')]
+    engine = 'pyarrow' if has_pyarrow() else None
+    return pd.read_csv(path, usecols=usecols, engine=engine)
+
+
+def cache_path(path: Union[str, Path], cache_dir: Optional[Union[str, Path]] = None,
+               downcast_types: bool = True) -> Path:
+    """
+    Location of the Parquet copy of a CSV export
+    :param path: CSV file
+    :param cache_dir: option, directory for the Parquet copies, default: next to the CSV file. In a shared
+    directory the file name includes a hash of the CSV's location, so exports of the same name do not collide.
+    :param downcast_types: whether the copy holds downcast columns, both variants are cached separately
+    :return: path of the Parquet file
+    """
+    path = Path(path)
+    suffix = "cache" if downcast_types else "full.cache"
+    if cache_dir is None:
+        return path.parent / f"{path.stem}.{suffix}.parquet"
+    location = hashlib.blake2b(str(path.resolve()).encode(), digest_size=4).hexdigest()
+    return Path(cache_dir) / f"{path.stem}.{location}.{suffix}.parquet"
+
+
+def convert_to_parquet(path: Union[str, Path], destination: Optional[Union[str, Path]] = None,
+                       downcast_types: bool = True) -> Path:
+    """
+    Converts an omero-screen CSV export to Parquet
+    :param path: CSV file
+    :param destination: option, Parquet file, default: cache_path(path)
+    :param downcast_types: downcast the columns before writing, default True
+    :return: path of the Parquet file
+    """
+    _require_pyarrow()
+    destination = Path(destination or cache_path(path, downcast_types=downcast_types))
+    df = _read_csv(Path(path))
+    if downcast_types:
+        downcast(df)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(destination, index=False)
+    return destination
+
+
+def read_screen(path: Union[str, Path], analysis: Union[str, Iterable[str], None] = None,
+                columns: Optional[Iterable[str]] = None, downcast_types: bool = True,
+                cache: bool = True, cache_dir: Optional[Union[str, Path]] = None) -> pd.DataFrame:
+    """
+    Reads an omero-screen export (.csv or .parquet)
+    :param path: file to read
+    :param analysis: option, read only the columns needed for this analysis, see ANALYSIS_COLUMNS
+    :param columns: option, additional columns to read
+    :param downcast_types: downcast floats to float32, ints to the smallest type and keys to categoricals,
+    default True
+    :param cache: convert CSV files to Parquet on first read and read the Parquet copy afterwards,
+    default True, needs pyarrow (without pyarrow the CSV file is read directly)
+    :param cache_dir: option, directory for the Parquet copies, default: next to the CSV file
+    :return: dataframe with single cell data
+    """
+    path = Path(path)
+    selected = analysis_columns(analysis, columns)
+    if path.suffix == '.csv' and cache and has_pyarrow():
+        parquet_path = cache_path(path, cache_dir, downcast_types)
+        if not parquet_path.exists() or parquet_path.stat().st_mtime < path.stat().st_mtime:
+            convert_to_parquet(path, parquet_path, downcast_types=downcast_types)
+        path = parquet_path
+    if path.suffix == '.parquet':
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+        df = pd.read_parquet(path, columns=_present(selected, pq.read_schema(path).names))
+    else:
+        df = _read_csv(path, selected)
+    return downcast(df) if downcast_types else df
+
+
+def iter_screen_chunks(path: Union[str, Path], chunksize: int = 1_000_000,
+                       analysis: Union[str, Iterable[str], None] = None, columns: Optional[Iterable[str]] = None,
+                       whole: Optional[str] = 'image_id') -> Iterator[pd.DataFrame]:
+    """
+    Reads an omero-screen export (.csv or .parquet) in chunks of about chunksize rows.
+    Rows of the same image are kept together: the rows of the last image of a chunk are carried over
+    to the next one, which assumes that the rows of an image are contiguous, as in omero-screen exports.
+    :param path: file to read
+    :param chunksize: rows per chunk, default 1000000
+    :param analysis: option, read only the columns needed for this analysis, see ANALYSIS_COLUMNS
+    :param columns: option, additional columns to read
+    :param whole: column whose groups must not be split across chunks, default 'image_id', None to disable
+    :return: iterator of dataframes
+    """
+    path = Path(path)
+    selected = analysis_columns(analysis, columns)
+    if path.suffix == '.parquet':
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        batches = (
+            batch.to_pandas()
+            for batch in parquet_file.iter_batches(batch_size=chunksize,
+                                                   columns=_present(selected, parquet_file.schema_arrow.names))
+        )
+    else:
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = [col for col in (_present(selected, header) or header) if not col.startswith('Unnamed:')]
+        batches = pd.read_csv(path, usecols=usecols, chunksize=chunksize)
+    carry = None
+    for chunk in batches:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if whole and whole in chunk.columns and len(chunk):
+            tail = (chunk[whole] == chunk[whole].iloc[-1]).to_numpy()
+            carry, chunk = chunk[tail], chunk[~tail]
+        if len(chunk):
+            yield chunk.reset_index(drop=True)
+    if carry is not None and len(carry):
+        yield carry.reset_index(drop=True)
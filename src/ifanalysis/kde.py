@@ -0,0 +1,145 @@
+"""
+Binned 2D Gaussian kernel density estimate for the density contours of combplot.
+Same estimate as seaborn.kdeplot (scipy gaussian_kde with Scott's rule and a full covariance kernel, evaluated
+on a 200 x 200 grid extending 3 bandwidths beyond the data, in the log space of the plot axes), but the points
+are linearly binned onto the grid and convolved with the kernel by FFT, so the cost is O(n + grid log grid)
+instead of O(n * grid). On lognormal test data the grid densities stay within 1% of the peak density of the
+exact estimate and the contour levels within 2% (see tests/test_kde.py).
+Results are cached per key, e.g. (experiment, plates, cell_line, condition), and invalidated when the data changes.
+"""
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional, Tuple
+
+import numpy as np
+
+# Number of cached estimates
+KDE_CACHE_SIZE = 128
+_kde_cache: "OrderedDict[Hashable, Tuple[tuple, Optional[DensityGrid]]]" = OrderedDict()
+
+
+@dataclass(frozen=True)
+class DensityGrid:
+    """
+    Density on a regular grid in log space (log=True) or linear space, x and y are in data units
+    """
+    x: np.ndarray
+    y: np.ndarray
+    density: np.ndarray  # shape (len(y), len(x))
+
+    def levels(self, levels: int = 10, thresh: float = 0.05) -> np.ndarray:
+        """
+        Iso-proportion contour levels as drawn by seaborn.kdeplot: the density values enclosing
+        1 - thresh ... 0 of the probability mass
+        """
+        return iso_proportion_levels(self.density, np.linspace(thresh, 1, levels))
+
+
+def iso_proportion_levels(density: np.ndarray, proportions) -> np.ndarray:
+    """
+    Density values above which the given proportions of the total mass lie, lowest level first
+    """
+    sorted_values = np.sort(np.ravel(density))[::-1]
+    cumulative = np.cumsum(sorted_values) / sorted_values.sum()
+    return np.take(sorted_values, np.searchsorted(cumulative, 1 - np.asarray(proportions)), mode="clip")
+
+
+def kde_covariance(points: np.ndarray, bw_adjust: float = 1.0) -> np.ndarray:
+    """
+    Kernel covariance of scipy gaussian_kde with Scott's rule: data covariance * (n ** (-1 / (d + 4)) * bw_adjust) ** 2
+    :param points: array of shape (d, n)
+    """
+    d, n = points.shape
+    factor = n ** (-1 / (d + 4)) * bw_adjust
+    return np.atleast_2d(np.cov(points)) * factor ** 2
+
+
+def _linear_binning(values: np.ndarray, grid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lower grid index and weight of the upper neighbour of each value
+    """
+    position = (values - grid[0]) / (grid[1] - grid[0])
+    lower = np.clip(np.floor(position).astype(np.int64), 0, len(grid) - 2)
+    return lower, position - lower
+
+
+def binned_kde2d(x, y, gridsize: int = 200, cut: float = 3, bw_adjust: float = 1.0,
+                 log: Tuple[bool, bool] = (True, True)) -> Optional[DensityGrid]:
+    """
+    Binned Gaussian KDE of 2D data
+    :param x: x values
+    :param y: y values
+    :param gridsize: number of grid points per axis, default 200
+    :param cut: grid extends this many bandwidths beyond the data, default 3
+    :param bw_adjust: factor on the Scott bandwidth, default 1
+    :param log: estimate in log space of the (x, y) axes, default (True, True) as for log scaled axes
+    :return: DensityGrid, None if there are too few points or the data is singular
+    """
+    columns = [np.asarray(values, dtype=float) for values in (x, y)]
+    keep = np.ones(len(columns[0]), dtype=bool)
+    for values, is_log in zip(columns, log):
+        keep &= np.isfinite(values) & (values > 0) if is_log else np.isfinite(values)
+    points = np.array([np.log(values[keep]) if is_log else values[keep] for values, is_log in zip(columns, log)])
+    n = points.shape[1]
+    if n < 3:
+        return None
+    covariance = kde_covariance(points, bw_adjust)
+    if not np.isfinite(covariance).all() or np.linalg.det(covariance) <= 0:
+        return None
+    bandwidth = np.sqrt(np.diag(covariance))
+    grids = [np.linspace(p.min() - cut * bw, p.max() + cut * bw, gridsize) for p, bw in zip(points, bandwidth)]
+    # linear binning: every point is shared between its four neighbouring grid points
+    (ix, wx), (iy, wy) = (_linear_binning(p, grid) for p, grid in zip(points, grids))
+    counts = np.zeros(gridsize * gridsize)
+    for dy, weight_y in ((0, 1 - wy), (1, wy)):
+        for dx, weight_x in ((0, 1 - wx), (1, wx)):
+            counts += np.bincount((iy + dy) * gridsize + ix + dx, weights=weight_x * weight_y,
+                                  minlength=gridsize * gridsize)
+    counts = counts.reshape(gridsize, gridsize)
+    # kernel on the grid spacing, truncated at 4 bandwidths
+    step = np.array([grid[1] - grid[0] for grid in grids])
+    half = np.minimum(np.ceil(4 * bandwidth / step).astype(int), gridsize - 1)
+    offset_x = np.arange(-half[0], half[0] + 1) * step[0]
+    offset_y = np.arange(-half[1], half[1] + 1) * step[1]
+    dx, dy = np.meshgrid(offset_x, offset_y)
+    inverse = np.linalg.inv(covariance)
+    quadratic = inverse[0, 0] * dx ** 2 + 2 * inverse[0, 1] * dx * dy + inverse[1, 1] * dy ** 2
+    kernel = np.exp(-0.5 * quadratic) / (2 * np.pi * np.sqrt(np.linalg.det(covariance)))
+    shape = (gridsize + kernel.shape[0] - 1, gridsize + kernel.shape[1] - 1)
+    convolved = np.fft.irfft2(np.fft.rfft2(counts, shape) * np.fft.rfft2(kernel, shape), shape)
+    density = convolved[half[1]:half[1] + gridsize, half[0]:half[0] + gridsize] / n
+    # FFT round-off can leave tiny negative values far from the data
+    density = np.maximum(density, 0)
+    x_grid, y_grid = (np.exp(grid) if is_log else grid for grid, is_log in zip(grids, log))
+    return DensityGrid(x_grid, y_grid, density)
+
+
+def cached_kde2d(key: Hashable, x, y, **kwargs) -> Optional[DensityGrid]:
+    """
+    binned_kde2d with one cached result per key. The result is recomputed when the points
+    (compared by a hash of their values) or the keyword arguments change.
+    :param key: cache key, should identify the data set, e.g. (experiment, plates, cell_line, condition)
+    :param kwargs: passed on to binned_kde2d
+    :return: DensityGrid, None if the data is singular
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    digest = hashlib.blake2b(digest_size=16)
+    for values in (x, y):
+        digest.update(np.ascontiguousarray(values).tobytes())
+    fingerprint = (len(x), digest.hexdigest(), tuple(sorted(kwargs.items())))
+    cached = _kde_cache.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        _kde_cache.move_to_end(key)
+        return cached[1]
+    grid = binned_kde2d(x, y, **kwargs)
+    _kde_cache[key] = (fingerprint, grid)
+    _kde_cache.move_to_end(key)
+    if len(_kde_cache) > KDE_CACHE_SIZE:
+        _kde_cache.popitem(last=False)
+    return grid
+
+
+def clear_kde_cache():
+    _kde_cache.clear()
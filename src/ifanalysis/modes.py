@@ -0,0 +1,160 @@
+"""
+Mode (peak) estimators used to find the G1 peak in normalise.
+All estimators take the intensity values of one group, drop missing values, optionally
+subsample them to max_samples with a seeded generator and return a single float.
+Choose one by name through get_mode_estimator, or pass any callable with the same signature.
+"""
+from typing import Callable, Optional, Tuple, Union
+
+import numpy as np
+
+
+def _prepare(values, max_samples: Optional[int], seed: int, positive: bool = False) -> np.ndarray:
+    """
+    Finite values as a float array, reproducibly subsampled to max_samples if given
+    """
+    values = np.asarray(values, dtype=float)
+    keep = np.isfinite(values)
+    if positive:
+        keep &= values > 0
+    values = values[keep]
+    if max_samples and len(values) > max_samples:
+        # sampling positions with replacement is O(max_samples), unlike a permutation of all values
+        values = values[np.random.default_rng(seed).integers(0, len(values), size=max_samples)]
+    if len(values) == 0:
+        raise ValueError("no valid values to estimate the mode from")
+    return values
+
+
+def _smooth(counts: np.ndarray, smooth: float) -> np.ndarray:
+    """
+    Gaussian smoothing of histogram counts, smooth is the kernel sd in bins
+    """
+    if not smooth:
+        return counts
+    half_width = int(np.ceil(4 * smooth))
+    x = np.arange(-half_width, half_width + 1)
+    kernel = np.exp(-0.5 * (x / smooth) ** 2)
+    return np.convolve(counts, kernel / kernel.sum())[half_width:half_width + len(counts)]
+
+
+def histogram_counts(values, bins: int, value_range: Tuple[float, float]) -> np.ndarray:
+    """
+    Histogram counts over fixed, equal width bins. Counts of the same bins and range can be
+    summed across chunks of data, see mode_from_counts.
+    """
+    counts, _ = np.histogram(values, bins=bins, range=value_range)
+    return counts
+
+
+def mode_from_counts(counts: np.ndarray, value_range: Tuple[float, float], smooth: float = 0.0) -> float:
+    """
+    Left edge of the first maximal (optionally smoothed) bin, as np.histogram edges would give it
+    """
+    edges = np.linspace(value_range[0], value_range[1], len(counts) + 1)
+    return edges[np.argmax(_smooth(counts, smooth))]
+
+
+def histogram_mode(values, bins: int = 10000, smooth: float = 0.0,
+                   max_samples: Optional[int] = None, seed: int = 0) -> float:
+    """
+    Fixed-bin histogram mode. With the defaults this reproduces the original normalise
+    behaviour (left edge of the first maximal bin of a 10000 bin histogram).
+    :param values: intensity values
+    :param bins: number of bins over the data range, default 10000
+    :param smooth: sd of the Gaussian smoothing kernel in bins, default 0 (no smoothing)
+    :param max_samples: option, subsample to this many values
+    :param seed: random seed for subsampling, default 0
+    :return: mode
+    """
+    values = _prepare(values, max_samples, seed)
+    value_range = (values.min(), values.max())
+    return mode_from_counts(histogram_counts(values, bins, value_range), value_range, smooth)
+
+
+def log_histogram_mode(values, bins: int = 1000, smooth: float = 2.0,
+                       max_samples: Optional[int] = None, seed: int = 0) -> float:
+    """
+    Histogram mode on log-spaced bins, less sensitive to the long right tail of intensity data.
+    Non-positive values are ignored.
+    :param values: intensity values
+    :param bins: number of bins over the log data range, default 1000
+    :param smooth: sd of the Gaussian smoothing kernel in bins, default 2
+    :param max_samples: option, subsample to this many values
+    :param seed: random seed for subsampling, default 0
+    :return: mode, geometric centre of the maximal bin
+    """
+    log_values = np.log(_prepare(values, max_samples, seed, positive=True))
+    counts, edges = np.histogram(log_values, bins=bins)
+    i = np.argmax(_smooth(counts, smooth))
+    return float(np.exp((edges[i] + edges[i + 1]) / 2))
+
+
+def kde_mode(values, grid_size: int = 2048, bw_adjust: float = 1.0, log: bool = True,
+             max_samples: Optional[int] = 200000, seed: int = 0) -> float:
+    """
+    Gaussian kernel density mode on a subsample (Scott's rule bandwidth). The density is evaluated
+    as a binned KDE: the values are binned onto a regular grid, which is then convolved with the kernel.
+    :param values: intensity values
+    :param grid_size: number of grid points, default 2048
+    :param bw_adjust: factor applied to the bandwidth, default 1
+    :param log: estimate the density of log intensities, default True
+    :param max_samples: subsample to this many values, default 200000
+    :param seed: random seed for subsampling, default 0
+    :return: mode
+    """
+    values = _prepare(values, max_samples, seed, positive=log)
+    if log:
+        values = np.log(values)
+    low, high = values.min(), values.max()
+    bandwidth = bw_adjust * values.std() * len(values) ** (-1 / 5)
+    if bandwidth == 0 or high == low:
+        peak = low
+    else:
+        counts, edges = np.histogram(values, bins=grid_size, range=(low, high))
+        density = _smooth(counts.astype(float), bandwidth / (edges[1] - edges[0]))
+        i = np.argmax(density)
+        peak = (edges[i] + edges[i + 1]) / 2
+    return float(np.exp(peak) if log else peak)
+
+
+def bincount_mode(values, bin_width: Optional[float] = None, bins: int = 10000, smooth: float = 0.0,
+                  max_samples: Optional[int] = None, seed: int = 0) -> float:
+    """
+    Integer binning with np.bincount. With bin_width=1 this is the exact mode of integer data
+    such as integrated intensities.
+    :param values: intensity values
+    :param bin_width: option, width of the bins, default: data range / bins
+    :param bins: number of bins if no bin_width is given, default 10000
+    :param smooth: sd of the Gaussian smoothing kernel in bins, default 0 (no smoothing)
+    :param max_samples: option, subsample to this many values
+    :param seed: random seed for subsampling, default 0
+    :return: mode, left edge of the maximal bin
+    """
+    values = _prepare(values, max_samples, seed)
+    low = values.min()
+    bin_width = bin_width or (values.max() - low) / bins or 1.0
+    # truncation of the non-negative offsets is the floor division into bins
+    counts = np.bincount(((values - low) * (1 / bin_width)).astype(np.int64))
+    return float(low + np.argmax(_smooth(counts, smooth)) * bin_width)
+
+
+MODE_ESTIMATORS = {
+    'histogram': histogram_mode,
+    'log_histogram': log_histogram_mode,
+    'kde': kde_mode,
+    'bincount': bincount_mode,
+}
+
+
+def get_mode_estimator(method: Union[str, Callable]) -> Callable:
+    """
+    :param method: name in MODE_ESTIMATORS or a callable taking the values of one group
+    :return: mode estimator function
+    """
+    if callable(method):
+        return method
+    try:
+        return MODE_ESTIMATORS[method]
+    except KeyError:
+        raise ValueError(f"mode method must be one of {list(MODE_ESTIMATORS)} or a callable") from None
@@ -1,116 +1,300 @@
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple, Union
+
 import numpy as np
 import pandas as pd
 
+from ifanalysis import gating
+from ifanalysis.gating import GatingModel, preset_gates
+from ifanalysis.modes import get_mode_estimator
+from ifanalysis.profiling import profiled
+
 
 
 
 norm_colums = ('integrated_int_DAPI', "intensity_mean_EdU_nucleus") # Default columns for cell cycle normalisation
-def cellcycle_analysis(df: pd.DataFrame, H3: bool =False, cyto: bool = True) -> pd.DataFrame:
+@profiled()
+def cellcycle_analysis(df: pd.DataFrame, H3: bool =False, cyto: bool = True,
+                       gates: Optional[GatingModel] = None, mode: Union[str, Callable] = "histogram",
+                       mode_kwargs: Optional[dict] = None, cache=None) -> pd.DataFrame:
     """
     Function to normalise cell cycle data using normalise and assign_ccphase functions for each cell line
     :param df: single cell data from omeroscreen
     :param cyto: True if cytoplasmic data is present
+    :param gates: option, GatingModel to use instead of the H3/non-H3 preset
+    :param mode: mode estimator used by normalise, default 'histogram'
+    :param mode_kwargs: option, keyword arguments for the mode estimator
+    :param cache: option, cache the result on disk: True for the default cache directory, a directory or
+    a cache.AnalysisCache, see cache.cached_cellcycle_analysis (needs pyarrow)
     :return: dataframe with cell cycle and cell cycle detailed columns
     """
+    if cache is not None and cache is not False:
+        from ifanalysis.cache import cached_cellcycle_analysis
+        return cached_cellcycle_analysis(df, H3=H3, cyto=cyto, gates=gates, mode=mode, mode_kwargs=mode_kwargs,
+                                         cache=None if cache is True else cache)
+    df_agg_corr = prepare_cellcycle(df, H3=H3, cyto=cyto)
+    df_norm = normalise(df_agg_corr, cellcycle_values(H3), inplace=True, mode=mode, mode_kwargs=mode_kwargs)
+    df_norm['integrated_int_DAPI_norm'] = df_norm['integrated_int_DAPI_norm'] * 2
+    return assign_ccphase(data=df_norm, H3=H3, gates=gates)
+
+
+def cellcycle_values(H3: bool = False) -> list[str]:
+    """
+    Intensity columns normalised by cellcycle_analysis
+    :param H3: True if H3P staining is present
+    :return: list of column names
+    """
+    if H3:
+        return ['integrated_int_DAPI', "intensity_mean_EdU_nucleus", "intensity_mean_H3P_nucleus"]
+    return ['integrated_int_DAPI', "intensity_mean_EdU_nucleus"]
+
+
+def prepare_cellcycle(df: pd.DataFrame, H3: bool = False, cyto: bool = True) -> pd.DataFrame:
+    """
+    Steps of cellcycle_analysis before normalisation: background correction of EdU (and H3P) intensities,
+    aggregation of multinucleates and deletion of duplicates. Works on any set of whole images.
+    :param df: single cell data from omeroscreen
+    :param H3: True if H3P staining is present
+    :param cyto: True if cytoplasmic data is present
+    :return: corrected copy of df
+    """
     df1 = df.copy()
     if H3:
-        values = ['integrated_int_DAPI', "intensity_mean_EdU_nucleus", "intensity_mean_H3P_nucleus"]
         df1['intensity_mean_H3P_nucleus'] = df1['intensity_mean_H3P_nucleus'] - df1['intensity_min_H3P_nucleus'] + 1
-    else:
-        values = ['integrated_int_DAPI', "intensity_mean_EdU_nucleus"]
     df1['intensity_mean_EdU_nucleus'] = df1['intensity_mean_EdU_nucleus'] - df1['intensity_min_EdU_nucleus'] + 1
     if cyto:
         df_agg = agg_multinucleates(df1)
-        df_agg_corr = delete_duplicates(df_agg)
-    else:
-        df_agg_corr = df1.copy()
-    tempfile = pd.DataFrame()
-    for cell_line in df_agg_corr["cell_line"].unique():
-        df1 = df_agg_corr.loc[df_agg_corr["cell_line"] == cell_line]
-        df_norm = normalise(df1, values)
-        df_norm['integrated_int_DAPI_norm'] = df_norm['integrated_int_DAPI_norm'] * 2
-        tempfile = pd.concat([tempfile, df_norm])
-    return assign_ccphase(data=tempfile, H3=H3)
+        return delete_duplicates(df_agg)
+    return df1
 
 # Helper Functions for cell cycle normalisation
-def agg_multinucleates(df: pd.DataFrame) -> pd.DataFrame:
+@profiled()
+def agg_multinucleates(df: pd.DataFrame, agg_rules: Optional[Dict[str, str]] = None) -> pd.DataFrame:
     """
-    Function to aggregate multinucleates by summing up the nucleus area and DAPI intensity
+    Function to aggregate multinucleates by summing up the nucleus area and DAPI intensity.
+    Cells are identified by the string keys plus image_id and Cyto_ID, which are combined into a single
+    integer group key. Rows are sorted once by that key and sum/mean/max/min are computed with
+    numpy reduceat, other aggregations fall back to a pandas groupby.
     :param df: single cell data from omeroscreen
+    :param agg_rules: option, dict of column -> aggregation ('sum', 'mean', 'max', ...)
+    overriding the default rules of aggregation_plan
     :return: corrected df with aggregated multinucleates
     """
-    num_cols = list(df.select_dtypes(include=['float64', 'int64']).columns)
-    str_cols = list(df.select_dtypes(include=['object']).columns)
-    # define the aggregation functions for each column
-    agg_functions = {}
+    keys = key_columns(df)
+    num_cols = list(df.select_dtypes(include='number').columns)
+    # numeric keys (image_id, Cyto_ID) are constant within a group
+    rules = {col: 'first' for col in keys if col in num_cols}
+    rules.update(agg_rules or {})
+    plan = aggregation_plan(tuple(num_cols), tuple(sorted(rules.items())))
+    codes = group_codes(df, keys)
+    valid = codes >= 0  # rows with missing keys are dropped, as by groupby
+    if not valid.all():
+        df, codes = df.loc[valid], codes[valid]
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    first_rows = order[starts]
+    aggregated = {}
+    fallback = {}
+    for col, how in plan:
+        if how == 'first' and col in keys:
+            aggregated[col] = df[col].to_numpy()[first_rows]
+        elif how in _reduceat_aggregations:
+            aggregated[col] = _reduce_sorted(df[col].to_numpy()[order], starts, how)
+        else:
+            fallback[col] = how
+    if fallback:
+        df_fallback = df[list(fallback)].groupby(codes, sort=True).agg(fallback)
+        aggregated.update({col: df_fallback[col].to_numpy() for col in fallback})
+    str_cols = [col for col in keys if col not in num_cols]
+    df_agg = df[str_cols].iloc[first_rows].reset_index(drop=True)
+    # the keys come first, as with groupby(keys, as_index=False); adding the columns one by one
+    # avoids consolidating them into a second copy
+    for col in [col for col in keys if col in num_cols] + [col for col in num_cols if col not in keys]:
+        df_agg[col] = aggregated.pop(col)
+    return df_agg
+
+
+_reduceat_aggregations = ('sum', 'mean', 'max', 'min')
+
+
+def _reduce_sorted(values: np.ndarray, starts: np.ndarray, how: str) -> np.ndarray:
+    """
+    Aggregates runs of values sorted by group, starting at the positions in starts.
+    Missing values are skipped like in pandas groupby aggregations.
+    """
+    if how == 'max':
+        return np.fmax.reduceat(values, starts)
+    if how == 'min':
+        return np.fmin.reduceat(values, starts)
+    missing = np.isnan(values) if values.dtype.kind == 'f' else None
+    if missing is not None and missing.any():
+        total = np.add.reduceat(np.where(missing, 0, values), starts)
+        count = np.add.reduceat(~missing, starts)
+    else:
+        total = np.add.reduceat(values, starts)
+        count = np.diff(np.append(starts, len(values)))
+    if how == 'sum':
+        return total
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count
+
+
+@lru_cache(maxsize=32)
+def aggregation_plan(num_cols: Tuple[str, ...], agg_rules: Tuple[Tuple[str, str], ...] = ()) -> Tuple[Tuple[str, str], ...]:
+    """
+    Aggregation function per column for agg_multinucleates, cached per schema:
+    sum for DAPI intensity and nucleus area, max/min for nuclear max/min intensities, mean otherwise
+    :param num_cols: numeric columns to aggregate
+    :param agg_rules: (column, aggregation) pairs overriding the defaults
+    :return: tuple of (column, aggregation) pairs
+    """
+    overrides = dict(agg_rules)
+    plan = []
     for col in num_cols:
-        if col in ['integrated_int_DAPI', 'area_nucleus']:
-            agg_functions[col] = 'sum'
+        if col in overrides:
+            plan.append((col, overrides[col]))
+        elif col in ['integrated_int_DAPI', 'area_nucleus']:
+            plan.append((col, 'sum'))
         elif 'max' in col and 'nucleus' in col:
-            agg_functions[col] = 'max'
+            plan.append((col, 'max'))
         elif 'min' in col and 'nucleus' in col:
-            agg_functions[col] = 'min'
+            plan.append((col, 'min'))
         else:
-            agg_functions[col] = 'mean'
-    return df.groupby(str_cols + ['image_id', 'Cyto_ID'], as_index=False).agg(
-        agg_functions
-    )
+            plan.append((col, 'mean'))
+    return tuple(plan)
 
 
-def delete_duplicates(df: pd.DataFrame) -> pd.DataFrame:
+def group_codes(df: pd.DataFrame, keys: list[str]) -> np.ndarray:
+    """
+    Single int64 group key for the combination of key columns. The codes sort in the same
+    order as the key tuples, so grouping by them gives the row order of df.groupby(keys).
+    :param df: dataframe
+    :param keys: key columns
+    :return: array of group codes, -1 for rows with a missing key
     """
-    Function to delete duplicates from the agg_multinucleate dataframe
+    codes = np.zeros(len(df), dtype=np.int64)
+    missing = np.zeros(len(df), dtype=bool)
+    n_groups = 1
+    for key in keys:
+        key_codes, uniques = pd.factorize(df[key], sort=True)
+        missing |= key_codes < 0
+        if n_groups * (len(uniques) + 1) >= 2 ** 62:
+            # compress the combined key before it can overflow
+            codes, compressed = pd.factorize(codes, sort=True)
+            n_groups = len(compressed)
+        codes = codes * len(uniques) + key_codes
+        n_groups *= len(uniques)
+    codes[missing] = -1
+    return codes
+
+
+@profiled()
+def delete_duplicates(df: pd.DataFrame, keys_only: bool = False) -> pd.DataFrame:
+    """
+    Function to delete duplicates from the agg_multinucleate dataframe.
+    Each row carries its image_id, so a single drop_duplicates over the whole frame
+    gives the same rows as deduplicating image by image.
     :param df: dataframe from agg_multinucleates function
+    :param keys_only: if True, compare only the identifying columns (string keys, image_id, Cyto_ID)
+    instead of hashing every measurement column
     :return: df with deleted duplicates
     """
-    temp_data = pd.DataFrame()
-    for image in df["image_id"].unique():
-        image_data = df.loc[df.image_id == image].drop_duplicates()
-        temp_data = pd.concat([temp_data, image_data])
-    return temp_data
+    subset = key_columns(df) if keys_only else None
+    return df.drop_duplicates(subset=subset)
 
 
-def normalise(df: pd.DataFrame, values: list[str]) -> pd.DataFrame:
+def key_columns(df: pd.DataFrame) -> list[str]:
+    """
+    Identifying columns of a single cell dataframe: string/categorical keys plus image_id and Cyto_ID
+    :param df: single cell data from omeroscreen
+    :return: list of column names
+    """
+    str_cols = list(df.select_dtypes(include=['object', 'string', 'category']).columns)
+    return str_cols + [col for col in ['image_id', 'Cyto_ID'] if col in df.columns and col not in str_cols]
+
+
+@profiled()
+def normalise(df: pd.DataFrame, values: list[str], inplace: bool = False,
+              mode: Union[str, Callable] = "histogram", mode_kwargs: Optional[dict] = None,
+              modes: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     """
     Data normalisation function: Identifies the most frequent intensity value and sets it to
-    1 by division. For DAPI data this is set to two, to reflect diploid (2N) state of chromosomes
+    1 by division. For DAPI data this is set to two, to reflect diploid (2N) state of chromosomes.
+    The mode is computed once per cell line and column in a single groupby pass, the row order of df is kept.
     :param df: dataframe from delete_duplicates function
-    :param values:
-    :return:
+    :param values: columns to normalise, results are added as '<value>_norm' columns
+    :param inplace: if True, add the normalised columns to df instead of returning a new dataframe
+    :param mode: mode estimator, 'histogram' (default), 'log_histogram', 'kde', 'bincount' or a callable
+    :param mode_kwargs: option, keyword arguments for the estimator, e.g. {'max_samples': 100000}
+    :param modes: option, precomputed modes (index: cell lines, columns: values), skips the mode search
+    :return: dataframe with normalised columns
     """
-    norm_df = pd.DataFrame()
-    for cell_line in df["cell_line"].unique():
-        tmp_data = df.copy().loc[(df["cell_line"] == cell_line)]
-        tmp_bins = 10000
-        for value in values:
-
-            y, x = np.histogram(tmp_data[value], bins=tmp_bins)
-            max_value = x[np.where(y == np.max(y))]
-            tmp_data[f"{value}_norm"] = tmp_data[value] / max_value[0]
-        norm_df = pd.concat([norm_df, tmp_data])
-    return norm_df
+    if modes is None:
+        modes = cell_line_modes(df, values, mode, mode_kwargs)
+    norm_cols = {f"{value}_norm": df[value] / modes[value].reindex(df["cell_line"]).to_numpy() for value in values}
+    if not inplace:
+        return df.assign(**norm_cols)
+    for col, norm_values in norm_cols.items():
+        df[col] = norm_values
+    return df
+
+
+@profiled()
+def cell_line_modes(df: pd.DataFrame, values: list[str], mode: Union[str, Callable] = "histogram",
+                    mode_kwargs: Optional[dict] = None) -> pd.DataFrame:
+    """
+    Mode of each value column per cell line
+    :param df: dataframe from delete_duplicates function
+    :param values: columns to estimate the mode of
+    :param mode: mode estimator, see normalise
+    :param mode_kwargs: option, keyword arguments for the estimator
+    :return: dataframe of modes, index: cell lines, columns: values
+    """
+    estimator = get_mode_estimator(mode)
+    mode_kwargs = mode_kwargs or {}
+    return df.groupby("cell_line", sort=False, observed=True)[values].agg(lambda x: estimator(x, **mode_kwargs))
 
 
-def assign_ccphase(data: pd.DataFrame, H3) -> pd.DataFrame:
+@profiled()
+def assign_ccphase(data: pd.DataFrame, H3, gates: Optional[GatingModel] = None) -> pd.DataFrame:
     """
     Assigns a cell cycle phase to each cell based on normalised EdU and DAPI intensities.
+    The phases are computed column-wise for the whole dataframe by classify_ccphase.
     :param data: dataframe from normalise function
+    :param gates: option, GatingModel to use instead of the H3/non-H3 preset
     :return: dataframe with cell cycle assignment
     (col: cellcycle (Sub-G1, G1, S, G2/M Polyploid
     and col: cellcycle_detailed with Early S/Late S and Polyploid (non-replicating)
-    Polyploid (replicating))
+    Polyploid (replicating)), both as pandas Categoricals
     """
-    if H3:
-        data["cell_cycle_detailed"] = data.apply(thresholdingH3, axis=1)
-    else:
-        data["cell_cycle_detailed"] = data.apply(thresholding, axis=1)
-    data['cell_cycle'] = data["cell_cycle_detailed"]
-    data['cell_cycle'] = data['cell_cycle'].replace(['Early S', 'Late S'], 'S')
-    data['cell_cycle'] = data['cell_cycle'].replace(["Polyploid (non-replicating)", "Polyploid (replicating)"],
-                                                    'Polyploid')
+    data["cell_cycle_detailed"], data["cell_cycle"] = classify_ccphase(data, H3=H3, gates=gates)
     return data
 
 
+def classify_ccphase(data: pd.DataFrame, H3: bool = False, DAPI_col: str = 'integrated_int_DAPI_norm',
+                     EdU_col: str = "intensity_mean_EdU_nucleus_norm",
+                     H3P_col: str = "intensity_mean_H3P_nucleus_norm",
+                     gates: Optional[GatingModel] = None) -> Tuple[pd.Categorical, pd.Categorical]:
+    """
+    Vectorised version of thresholding and thresholdingH3, using the preset gates from the gating module.
+    All cells are labelled at once, the first matching gate wins as in the if/elif chains.
+    Cells at exactly EdU == 3 (or H3P == 5) fall through to Unassigned, like in the row-wise functions.
+    :param data: data from normalise function
+    :param H3: if True, split G2/M into G2 and M based on H3P intensity
+    :param DAPI_col: default 'integrated_int_DAPI_norm'
+    :param EdU_col: default 'intensity_mean_EdU_nucleus_norm'
+    :param H3P_col: default 'intensity_mean_H3P_nucleus_norm'
+    :param gates: option, GatingModel to use instead of the H3/non-H3 preset
+    :return: tuple of Categoricals (cell_cycle_detailed, cell_cycle)
+    """
+    gates = gates or preset_gates(H3)
+    columns = {gating.DAPI_col: DAPI_col, gating.EdU_col: EdU_col, gating.H3P_col: H3P_col}
+    if any(old != new for old, new in columns.items()):
+        gates = gates.with_channels(columns)
+    return gates.classify(data)
+
+
 def thresholding(data: pd.DataFrame, DAPI_col: str = 'integrated_int_DAPI_norm',
                  EdU_col="intensity_mean_EdU_nucleus_norm") -> str:
     """
@@ -184,6 +368,7 @@ def thresholdingH3(data: pd.DataFrame, DAPI_col: str = 'integrated_int_DAPI_norm
 
 # 3 Cell Cycle Proportion Analysis
 
+@profiled()
 def cellcycle_prop(df: pd.DataFrame, cell_cycle: str = 'cell_cycle') -> pd.DataFrame:
     """
     Function to calculate the proportion of cells in each cell cycle phase
@@ -192,14 +377,27 @@ def cellcycle_prop(df: pd.DataFrame, cell_cycle: str = 'cell_cycle') -> pd.DataF
     :return: grouped dataframe with cell cycle proportions
     """
     df_ccphase = (
-        df.groupby(["plate_id", "well", "cell_line", "condition", cell_cycle])[
+        df.groupby(["plate_id", "well", "cell_line", "condition", cell_cycle], observed=True)[
             "experiment"
         ].count()
-        / df.groupby(["plate_id", "well", "cell_line", "condition"])["experiment"].count()
+        / df.groupby(["plate_id", "well", "cell_line", "condition"], observed=True)["experiment"].count()
         * 100
     )
     return df_ccphase.reset_index().rename(columns={"experiment": "percent"})
 
+def prop_from_counts(phase_counts: pd.Series) -> pd.DataFrame:
+    """
+    Cell cycle proportions as returned by cellcycle_prop from precomputed cell counts
+    :param phase_counts: number of cells indexed by plate_id, well, cell_line, condition and cell cycle phase,
+    cells without a phase (NaN) count towards the well totals only
+    :return: grouped dataframe with cell cycle proportions
+    """
+    phase_counts = phase_counts.rename("experiment")
+    well_counts = phase_counts.groupby(level=["plate_id", "well", "cell_line", "condition"], observed=True).sum()
+    phase_counts = phase_counts[phase_counts.index.get_level_values(-1).notna()]
+    df_ccphase = phase_counts / well_counts * 100
+    return df_ccphase.reset_index().rename(columns={"experiment": "percent"})
+
 def prop_pivot(df: pd.DataFrame, conditions, H3):
     """
     Function to pivot the cell cycle proportion dataframe and get the mean and std of each cell cycle phase
@@ -209,7 +407,16 @@ def prop_pivot(df: pd.DataFrame, conditions, H3):
     :param H3: boolean, default False, if True the function will use M phase instead of G2/M based on H3 staining
     :return: dataframe to submit to the barplot function
     """
-    df_prop = cellcycle_prop(df)
+    return pivot_props(cellcycle_prop(df), conditions, H3)
+
+def pivot_props(df_prop: pd.DataFrame, conditions, H3):
+    """
+    Mean and std of each cell cycle phase per condition from the cellcycle_prop table, see prop_pivot
+    :param df_prop: dataframe from cellcycle_prop or PlateSummary.proportions
+    :param conditions: list of conditions sort the order of data
+    :param H3: boolean, if True the function will use M phase instead of G2/M based on H3 staining
+    :return: mean and std dataframes
+    """
     if H3:
         cc_phases = ["Sub-G1", "G1", "S", "G2", "M", "Polyploid"]
     else:   
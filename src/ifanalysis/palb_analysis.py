@@ -1,40 +1,32 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from ifanalysis._helper_functions import save_fig
-from pathlib import Path
-
-# Matplotlib Style and Colors
-module_dir = Path(__file__).parent
-style_path = module_dir / 'styles/Style_01.mplstyle'
-plt.style.use(str(style_path))
-prop_cycle = plt.rcParams["axes.prop_cycle"]
-colors = prop_cycle.by_key()["color"]
+from ifanalysis._helper_functions import colors_getattr, hue_boxes, lazy_module, plot_style, save_fig
+from ifanalysis.counts import normalise_count
+
+plt = lazy_module('matplotlib.pyplot')
+sns = lazy_module('seaborn')
+
+
+__getattr__ = colors_getattr(__name__)
+
 
 def count_per_cond(df: pd.DataFrame) -> pd.DataFrame:
-    # Combine groupby, count, and merge operations into a single step
+    """
+    Cell counts per well, normalised (in %) to the mean count of the wells without palbociclib
+    at the same gwli concentration, see counts.normalise_count
+    """
     df_count = (
-        df.groupby(["cell_line", "gwli", "palb", "well", "plate_id"])
+        df.groupby(["cell_line", "gwli", "palb", "well", "plate_id"], observed=True)
         ["experiment"]
         .count()
         .reset_index()
         .rename(columns={"experiment": "abs cell count"})
     )
+    df_count['normalized_cell_count'] = normalise_count(df_count, 0.0, by=['gwli'], control_col='palb') * 100
+    return df_count
 
-    # Calculate the mean cell count for gwli where palb is 0.0 within the same DataFrame
-    mean_cell_count = df_count[df_count['palb'] == 0.0].groupby('gwli')['abs cell count'].mean()
-
-    # Join the mean cell count with the original DataFrame and compute the normalized cell count
-    df_merged = df_count.join(mean_cell_count, on='gwli', rsuffix='_mean')
-    df_merged['normalized_cell_count'] = (df_merged['abs cell count'] / df_merged['abs cell count_mean']) * 100
-
-    # Drop the auxiliary mean column
-    df_merged.drop(columns=['abs cell count_mean'], inplace=True)
-
-    return df_merged
-   
 
+@plot_style()
 def count_plots(df_count, title, count_type, path):
     # Create the grouped bar plot
     fig, ax = plt.subplots(figsize=(12, 8))
@@ -52,12 +44,11 @@ def count_plots(df_count, title, count_type, path):
 
     save_fig(fig, path, title)
 
+@plot_style()
 def intensityplot(df, measurement, title, path):
     # Assuming 'df' is your DataFrame, and you have 'gwli', 'area_cell', and 'palb' columns
     conditions = np.sort(df['gwli'].unique())
     hue_levels = np.sort(df['palb'].unique())
-    hue_count = len(hue_levels)
-    width_per_hue = 0.8 / hue_count  # Default width of violin plots in seaborn
 
     # Create the plot
     fig, ax = plt.subplots(figsize=(5, 5))
@@ -65,18 +56,9 @@ def intensityplot(df, measurement, title, path):
     # Create the violin 
     sns.violinplot(x="gwli", y=measurement, hue="palb", data=df, ax=ax, palette="Blues_d", inner=None, density_norm='width', dodge=True, linewidth=0)
 
-    # Overlay box plots
-    for i, condition in enumerate(conditions):
-        for j, level in enumerate(hue_levels):
-            subset = df[(df["gwli"] == condition) & (df["palb"] == level)]
-            box_center = i - 0.4 + width_per_hue/2 + j*width_per_hue
-            sns.boxplot(y=subset[measurement], ax=ax,
-                        showfliers=False, 
-                        #color='white', 
-                        saturation=0.5, 
-                        width=0.1, 
-                        boxprops={'facecolor': (1, 1, 1, 0.5), 'zorder': 2}, # Adjusted alpha here
-                        positions=[box_center])
+    # Overlay box plots, one Axes.bxp call for all (gwli, palb) pairs
+    hue_boxes(ax, df, "gwli", measurement, "palb", conditions, hue_levels,
+              boxprops={'facecolor': (1, 1, 1, 0.5), 'zorder': 2})
 
     # Set plot properties
     ax.set_title(title, fontsize=16)
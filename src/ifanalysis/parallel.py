@@ -0,0 +1,212 @@
+"""
+Process-parallel cell cycle analysis.
+The raw data is partitioned by cell line (and further string keys) and prepared (background correction,
+multinucleate aggregation, deduplication) in the worker processes. The intensity columns of the prepared data are
+then copied once into a shared memory block, sorted so that every partition
+(cell line, optionally split further by plate) is a contiguous slice. Worker processes read their slice from
+shared memory, estimate the modes per cell line, normalise and classify, and write the normalised values and
+phase codes into a shared output block. Only the raw partitions and their prepared rows are pickled, the
+normalisation and classification tasks pass no DataFrames.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis.gating import GatingModel, preset_gates
+from ifanalysis.modes import get_mode_estimator
+from ifanalysis.normalisation import cellcycle_values, group_codes, key_columns, prepare_cellcycle
+
+# (shared memory name, shape, dtype) of an array shared with the workers
+BlockSpec = Tuple[str, Tuple[int, ...], str]
+
+
+class SharedBlock:
+    """
+    Numpy array in a shared memory block, owned by the creating process
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype):
+        dtype = np.dtype(dtype)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.spec: BlockSpec = (self.shm.name, shape, dtype.str)
+
+    def release(self):
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _attach(spec: BlockSpec) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _mode_task(values_spec: BlockSpec, start: int, stop: int, mode: Union[str, Callable],
+               mode_kwargs: dict) -> List[float]:
+    """
+    Modes of all value columns for the rows start:stop of one cell line
+    """
+    shm, values = _attach(values_spec)
+    try:
+        estimator = get_mode_estimator(mode)
+        return [float(estimator(values[i, start:stop], **mode_kwargs)) for i in range(values.shape[0])]
+    finally:
+        del values
+        shm.close()
+
+
+def _label_task(values_spec: BlockSpec, norm_spec: BlockSpec, codes_spec: BlockSpec, start: int, stop: int,
+                modes: Sequence[float], columns: Sequence[str], gates: GatingModel):
+    """
+    Normalises and classifies the rows start:stop of one partition, results are written to the output blocks
+    """
+    blocks = [_attach(spec) for spec in (values_spec, norm_spec, codes_spec)]
+    (_, values), (_, norm), (_, codes) = blocks
+    frame = None
+    try:
+        for i, (column, mode) in enumerate(zip(columns, modes)):
+            norm[i, start:stop] = values[i, start:stop] / mode
+            if column == 'integrated_int_DAPI':
+                norm[i, start:stop] *= 2
+        frame = pd.DataFrame({f"{column}_norm": norm[i, start:stop] for i, column in enumerate(columns)},
+                             copy=False)
+        codes[start:stop] = gates.compiled.codes(frame)
+    finally:
+        del values, norm, codes, frame
+        for shm, _ in blocks:
+            shm.close()
+
+
+def _slices(sorted_codes: np.ndarray) -> List[Tuple[int, int]]:
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if len(sorted_codes) else []
+    stops = list(starts[1:]) + [len(sorted_codes)]
+    return [(int(start), int(stop)) for start, stop in zip(starts, stops)]
+
+
+def _prepare_task(df: pd.DataFrame, H3: bool) -> pd.DataFrame:
+    return prepare_cellcycle(df, H3=H3, cyto=True)
+
+
+def _parallel_prepare(df: pd.DataFrame, H3: bool, partition_by: List[str], pool: ProcessPoolExecutor
+                      ) -> pd.DataFrame:
+    """
+    prepare_cellcycle (with multinucleate aggregation) of the partitions of the raw data in the workers.
+    Partitions are split by cell line and the string keys among partition_by, which are part of the aggregation key,
+    so every multinucleate cell is aggregated within one partition.
+    :return: the same frame as prepare_cellcycle(df, H3, cyto=True), rows in aggregation key order
+    """
+    agg_keys = key_columns(df)
+    part_keys = ['cell_line'] + [col for col in partition_by if col != 'cell_line' and col in agg_keys]
+    codes = group_codes(df, part_keys)
+    order = np.argsort(codes, kind='stable')
+    # rows with a missing key are dropped by agg_multinucleates
+    order = order[codes[order] >= 0]
+    parts = [df.iloc[order[start:stop]] for start, stop in _slices(codes[order])]
+    prepared = list(pool.map(_prepare_task, parts, [H3] * len(parts)))
+    del parts
+    df_agg = pd.concat(prepared, ignore_index=True) if prepared else prepare_cellcycle(df.iloc[0:0], H3=H3)
+    # the rows of one aggregation key are a single row, sorting by the key gives the serial order
+    key_order = np.argsort(group_codes(df_agg, key_columns(df_agg)), kind='stable')
+    return df_agg.take(key_order).reset_index(drop=True)
+
+
+def parallel_cellcycle_analysis(df: pd.DataFrame, H3: bool = False, cyto: bool = True,
+                                gates: Optional[GatingModel] = None, mode: Union[str, Callable] = "histogram",
+                                mode_kwargs: Optional[dict] = None, n_workers: Optional[int] = None,
+                                partition_by: Union[str, Sequence[str]] = 'cell_line') -> pd.DataFrame:
+    """
+    Parallel version of cellcycle_analysis with the same output. With cyto=True the multinucleate aggregation and
+    deduplication run in one task per partition of the raw data. Modes are then estimated per cell line in one task
+    each, normalisation and classification run in one task per partition.
+    :param df: single cell data from omeroscreen
+    :param H3: True if H3P staining is present
+    :param cyto: True if cytoplasmic data is present
+    :param gates: option, GatingModel to use instead of the H3/non-H3 preset
+    :param mode: mode estimator, see normalise. A callable must be picklable (module level) and gets numpy arrays.
+    :param mode_kwargs: option, keyword arguments for the mode estimator
+    :param n_workers: number of worker processes, default os.cpu_count(). With 1 everything runs in this process.
+    :param partition_by: columns to partition by, default 'cell_line', e.g. ['plate_id', 'cell_line'] for more,
+    smaller tasks. Partitions are always split by cell line. The aggregation is partitioned by the string columns
+    among them (e.g. cell_line, well), the later steps by all of them.
+    :return: dataframe with cell cycle and cell cycle detailed columns
+    """
+    gates = gates or preset_gates(H3)
+    mode_kwargs = mode_kwargs or {}
+    n_workers = n_workers or os.cpu_count() or 1
+    partition_by = [partition_by] if isinstance(partition_by, str) else list(partition_by)
+    columns = cellcycle_values(H3)
+    missing = set(gates.channels) - {f"{column}_norm" for column in columns}
+    if missing:
+        raise ValueError(f"gates use columns that are not normalised: {sorted(missing)}")
+
+    pool = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+    try:
+        if pool is not None and cyto and 'cell_line' in key_columns(df):
+            df_agg_corr = _parallel_prepare(df, H3, partition_by, pool)
+        else:
+            df_agg_corr = prepare_cellcycle(df, H3=H3, cyto=cyto)
+        return _normalise_and_label(df_agg_corr, columns, gates, mode, mode_kwargs, partition_by, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def _normalise_and_label(df_agg_corr: pd.DataFrame, columns: List[str], gates: GatingModel,
+                         mode: Union[str, Callable], mode_kwargs: dict, partition_by: List[str],
+                         pool: Optional[ProcessPoolExecutor]) -> pd.DataFrame:
+    """
+    Modes per cell line, normalisation and classification of the prepared data over shared memory
+    """
+    line_codes = group_codes(df_agg_corr, ['cell_line'])
+    part_codes = group_codes(df_agg_corr, ['cell_line'] + [col for col in partition_by if col != 'cell_line'])
+    order = np.argsort(part_codes, kind='stable')
+    # cells without a cell line have no mode: NaN values, classified in this process as by cellcycle_analysis
+    order = order[line_codes[order] >= 0]
+    line_slices = _slices(line_codes[order])
+    part_slices = _slices(part_codes[order])
+    part_lines = np.searchsorted([stop for _, stop in line_slices], [start for start, _ in part_slices], side='right')
+
+    n = len(order)
+    values = SharedBlock((len(columns), n), np.float64)
+    norm = SharedBlock((len(columns), n), np.float64)
+    codes = SharedBlock((n,), np.int8)
+    try:
+        for i, column in enumerate(columns):
+            values.array[i] = df_agg_corr[column].to_numpy(dtype=np.float64)[order]
+        if pool is None:
+            modes = [_mode_task(values.spec, start, stop, mode, mode_kwargs) for start, stop in line_slices]
+            for (start, stop), line in zip(part_slices, part_lines):
+                _label_task(values.spec, norm.spec, codes.spec, start, stop, modes[line], columns, gates)
+        else:
+            modes = list(pool.map(_mode_task, *zip(*[(values.spec, start, stop, mode, mode_kwargs)
+                                                     for start, stop in line_slices]))) if line_slices else []
+            tasks = [pool.submit(_label_task, values.spec, norm.spec, codes.spec, start, stop, modes[line],
+                                 columns, gates)
+                     for (start, stop), line in zip(part_slices, part_lines)]
+            for task in tasks:
+                task.result()
+        for i, column in enumerate(columns):
+            result = np.full(len(df_agg_corr), np.nan)
+            result[order] = norm.array[i]
+            df_agg_corr[f"{column}_norm"] = result
+        compiled = gates.compiled
+        phase_codes = np.empty(len(df_agg_corr), dtype=np.int8)
+        phase_codes[order] = codes.array
+        if n < len(df_agg_corr):
+            unassigned = np.ones(len(df_agg_corr), dtype=bool)
+            unassigned[order] = False
+            norm_frame = df_agg_corr.loc[unassigned, [f"{column}_norm" for column in columns]]
+            phase_codes[unassigned] = compiled.codes(norm_frame.reset_index(drop=True))
+    finally:
+        for block in (values, norm, codes):
+            block.release()
+    df_agg_corr["cell_cycle_detailed"] = pd.Categorical.from_codes(phase_codes, categories=compiled.categories)
+    df_agg_corr["cell_cycle"] = pd.Categorical.from_codes(compiled.summary_lookup[phase_codes],
+                                                          categories=compiled.summary_categories)
+    return df_agg_corr
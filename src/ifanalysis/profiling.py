@@ -0,0 +1,195 @@
+"""
+Stage level profiling of the analysis pipeline.
+The steps of cellcycle_analysis, the count tables, the plotting functions and save_fig report to the Recorder
+that is active in the current context, with their wall time, rows in and out and peak memory:
+
+    with Recorder() as recorder:
+        df = cellcycle_analysis(data)
+        combplot(df, conditions, 'HELA', 'exp1')
+    recorder.to_frame()  # one row per stage
+    recorder.to_json('profile.json')
+
+Nested stages (normalise within cellcycle_analysis) have a higher depth. Finished stages are passed to the
+callbacks of the Recorder and logged at DEBUG level on the ifanalysis.profiling logger.
+Without an active Recorder an instrumented function only looks up a context variable.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_active: contextvars.ContextVar = contextvars.ContextVar("ifanalysis_recorder", default=None)
+
+
+@dataclass
+class StageRecord:
+    """
+    Measurements of one stage
+    :param peak_mib: peak memory allocated during the stage beyond the memory in use when it started,
+    None without memory tracing
+    :param detail: e.g. the cell line of a plot or the name of a saved figure
+    :param start: seconds from the start of the recorder to the start of the stage
+    """
+    stage: str
+    seconds: float = 0.0
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    peak_mib: Optional[float] = None
+    detail: str = ""
+    depth: int = 0
+    start: float = 0.0
+
+
+class Recorder:
+    """
+    Collects a StageRecord for every instrumented stage run in its context
+    :param callbacks: option, functions called with each finished StageRecord, e.g. to stream them elsewhere
+    :param memory: if True (default), trace the peak memory of each stage with tracemalloc,
+    which slows down code that allocates many small Python objects
+    """
+
+    def __init__(self, callbacks: Iterable[Callable[[StageRecord], None]] = (), memory: bool = True):
+        self.callbacks = list(callbacks)
+        self.memory = memory
+        self.records: List[StageRecord] = []
+        # [memory in use at the start, peak so far] of each open stage
+        self._open: List[Optional[List[int]]] = []
+        self._token = None
+        self._tracing = False
+        self._t0 = time.perf_counter()
+
+    def __enter__(self) -> "Recorder":
+        self._t0 = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._token = _active.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _active.reset(self._token)
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        return False
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None, detail: str = "") -> Iterator[StageRecord]:
+        """
+        Records the enclosed block as a stage, set rows_out on the yielded StageRecord
+        """
+        record = StageRecord(name, rows_in=rows_in, detail=detail, depth=len(self._open),
+                             start=time.perf_counter() - self._t0)
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak is reset for the new stage, keep the enclosing stage's peak so far
+            self._update_peak(peak)
+            tracemalloc.reset_peak()
+            self._open.append([current, current])
+        else:
+            self._open.append(None)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            frame = self._open.pop()
+            if frame is not None and tracemalloc.is_tracing():
+                peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+                record.peak_mib = (peak - frame[0]) / 2 ** 20
+                self._update_peak(peak)
+            self.add(record)
+
+    def _update_peak(self, peak: int):
+        if self._open and self._open[-1] is not None:
+            self._open[-1][1] = max(self._open[-1][1], peak)
+
+    def add(self, record: StageRecord) -> None:
+        """
+        Adds a finished record, e.g. one returned from a worker process
+        """
+        self.records.append(record)
+        logger.debug("%s%s%s: %.3fs, rows %s -> %s, peak %s MiB", "  " * record.depth, record.stage,
+                     f" ({record.detail})" if record.detail else "", record.seconds, record.rows_in, record.rows_out,
+                     None if record.peak_mib is None else round(record.peak_mib, 1), extra={"profile": asdict(record)})
+        for callback in self.callbacks:
+            callback(record)
+
+    def to_frame(self):
+        """
+        Records as a dataframe, one row per stage in the order the stages finished
+        """
+        import pandas as pd
+        return pd.DataFrame([asdict(record) for record in self.records],
+                            columns=[field.name for field in fields(StageRecord)])
+
+    def to_json(self, path: Union[str, Path, None] = None) -> str:
+        """
+        Records as a JSON list, written to path if given
+        """
+        text = json.dumps([asdict(record) for record in self.records], indent=1)
+        if path is not None:
+            Path(path).write_text(text)
+        return text
+
+
+def current_recorder() -> Optional[Recorder]:
+    return _active.get()
+
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None, detail: str = "") -> Iterator[StageRecord]:
+    """
+    Records the enclosed block as a stage of the active Recorder, does nothing without one
+    :return: StageRecord to set rows_out on
+    """
+    recorder = _active.get()
+    if recorder is None:
+        yield StageRecord(name, rows_in=rows_in, detail=detail)
+        return
+    with recorder.stage(name, rows_in, detail) as record:
+        yield record
+
+
+def rows(obj) -> Optional[int]:
+    """
+    Number of rows of a dataframe, series, array or PlateSummary, None for anything else
+    """
+    if not hasattr(obj, "shape"):
+        obj = getattr(obj, "data", None)
+    return len(obj) if hasattr(obj, "shape") and len(getattr(obj, "shape")) else None
+
+
+def profiled(name: Optional[str] = None, detail: Optional[str] = None):
+    """
+    Decorator recording each call of a function as a stage of the active Recorder,
+    with rows_in from the first argument and rows_out from the result
+    :param name: option, stage name, default: the function name
+    :param detail: option, argument reported as the detail of the record, e.g. 'cell_line'
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+        signature = inspect.signature(func)
+        first = next(iter(signature.parameters))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _active.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            with recorder.stage(stage_name, rows(arguments.get(first)), str(arguments.get(detail, ""))) as record:
+                result = func(*args, **kwargs)
+                record.rows_out = rows(result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,155 @@
+"""
+Batch rendering of report figures in a process pool.
+A FigureJob names a plotting function (combplot, int_combplot, count_plots, cellcycle_barplot, ...) with its
+arguments and the data subset it needs. render_figures runs the jobs in worker processes that draw on plain
+matplotlib Figures with the Agg backend instead of pyplot, and save the same files as save_fig.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+from ifanalysis import _helper_functions, profiling
+from ifanalysis.columnstore import ColumnStore, StoreSlice
+from ifanalysis.summary import PlateSummary
+
+# Columns used by combplot and int_combplot, the jobs only carry these
+COMBPLOT_COLUMNS = ['experiment', 'plate_id', 'well', 'cell_line', 'condition', 'cell_cycle',
+                    'integrated_int_DAPI_norm', 'intensity_mean_EdU_nucleus_norm']
+INT_COMBPLOT_COLUMNS = ['cell_line', 'condition', 'cell_cycle', 'integrated_int_DAPI_norm']
+# Keyword arguments shown in FigureJob.name
+_NAME_KEYS = ('cell_line', 'col')
+
+
+@dataclass
+class FigureJob:
+    """
+    One figure: a plotting function with its keyword arguments, e.g.
+    FigureJob(combplot, dict(df=df_line, conditions=conditions, cell_line='HELA', title_str='exp1'))
+    The function has to be picklable (module level) and save the figure itself (save=True).
+    StoreSlice arguments are loaded when the job runs.
+    """
+    func: Callable
+    kwargs: dict = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        # the arguments that tell the figures of one function apart, e.g. int_combplot(HELA, intensity_mean_p21_nucleus)
+        labels = [str(self.kwargs[key]) for key in _NAME_KEYS if key in self.kwargs]
+        return f"{self.func.__name__}({', '.join(labels)})"
+
+    def run(self) -> str:
+        with profiling.stage("render", detail=self.name):
+            kwargs = {key: value.load() if isinstance(value, StoreSlice) else value
+                      for key, value in self.kwargs.items()}
+            self.func(**kwargs)
+        return self.name
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    _helper_functions.set_headless(True)
+
+
+def _run(job: FigureJob) -> str:
+    return job.run()
+
+
+def _run_profiled(job: FigureJob, memory: bool) -> Tuple[str, List[profiling.StageRecord]]:
+    # records of a worker process, returned to the recorder of the calling process
+    with profiling.Recorder(memory=memory) as recorder:
+        name = job.run()
+    return name, recorder.records
+
+
+def render_figures(jobs: Iterable[FigureJob], n_workers: Optional[int] = None) -> List[str]:
+    """
+    Renders figure jobs in parallel, each worker process draws without pyplot on the Agg backend
+    :param jobs: figure jobs, see report_jobs
+    :param n_workers: number of worker processes, default os.cpu_count(). With 1 the jobs run in this process,
+    still without pyplot. The stages profiled in the workers are added to the active profiling.Recorder.
+    :return: names of the rendered jobs
+    """
+    jobs = list(jobs)
+    n_workers = min(n_workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if n_workers == 1:
+        headless = _helper_functions._headless
+        _helper_functions.set_headless(True)
+        try:
+            return [job.run() for job in jobs]
+        finally:
+            _helper_functions.set_headless(headless)
+    recorder = profiling.current_recorder()
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) as pool:
+        if recorder is None:
+            return list(pool.map(_run, jobs))
+        names = []
+        for name, records in pool.map(partial(_run_profiled, memory=recorder.memory), jobs):
+            names.append(name)
+            for record in records:
+                recorder.add(record)
+        return names
+
+
+def report_jobs(df: pd.DataFrame, conditions: List[str], title_str: str, path: Path = None,
+                cell_lines: Optional[Sequence[str]] = None, intensity_cols: Sequence[str] = (),
+                H3: bool = False, cell_number: Optional[int] = None, ctr_cond: Optional[str] = "CTR",
+                count_title: str = "Cell Counts", kind: str = "scatter",
+                store: Union[ColumnStore, str, Path, None] = None) -> List[FigureJob]:
+    """
+    Jobs for the standard report of a cell cycle screen: one combplot per cell line, one int_combplot per
+    intensity column and cell line, count_plots and cellcycle_barplot. Each job gets only the rows and columns
+    of its figure.
+    :param df: dataframe from cellcycle_analysis
+    :param conditions: list of conditions to be plotted
+    :param title_str: title of the combplots and barplot
+    :param path: option, directory to save the figures, default: Path.cwd()
+    :param cell_lines: option, cell lines to plot, default: all
+    :param intensity_cols: option, columns for int_combplot
+    :param H3: True if H3P staining is present
+    :param cell_number: option, number of cells sampled per condition for the scatter plots
+    :param ctr_cond: control condition for count_plots, None to skip the count plots
+    :param count_title: title of the count plots, default 'Cell Counts'
+    :param kind: scatter plot kind of combplot and int_combplot, 'scatter' (default), 'density' or 'count'
+    :param store: option, ColumnStore of df (or its directory) from columnstore.write_store, the combplot and
+    int_combplot jobs then carry a StoreSlice of their cell line that the worker maps instead of a copy of the rows.
+    With the default STORE_KEYS a cell line is one row range, already grouped by condition.
+    :return: list of FigureJobs for render_figures
+    """
+    from ifanalysis.cellcycle import cellcycle_barplot
+    from ifanalysis.combplot import combplot, edu_limits
+    from ifanalysis.counts import count_per_cond, count_plots
+    from ifanalysis.intensity import int_combplot
+
+    path = path or Path.cwd()
+    summary = PlateSummary.from_frame(df)
+    cell_lines = list(cell_lines if cell_lines is not None else df.cell_line.unique())
+    ylim = edu_limits(summary)
+    if store is not None and not isinstance(store, ColumnStore):
+        store = ColumnStore(store)
+
+    def line_data(cell_line, columns):
+        if store is not None:
+            return store.select(columns, cell_line=cell_line)
+        return summary.cell_line_data(cell_line)[columns]
+
+    jobs = []
+    for cell_line in cell_lines:
+        jobs.append(FigureJob(combplot, dict(df=line_data(cell_line, COMBPLOT_COLUMNS), conditions=conditions,
+                                             cell_line=cell_line, title_str=title_str, cell_number=cell_number, H3=H3,
+                                             path=path, ylim=ylim, kind=kind)))
+        for col in intensity_cols:
+            jobs.append(FigureJob(int_combplot, dict(df=line_data(cell_line, INT_COMBPLOT_COLUMNS + [col]),
+                                                     conditions=conditions, cell_line=cell_line, col=col,
+                                                     cellnumber=cell_number, path=path, kind=kind)))
+    if ctr_cond is not None:
+        jobs.append(FigureJob(count_plots, dict(df_count=count_per_cond(summary, ctr_cond), conditions=conditions,
+                                                title=count_title, path=path)))
+    jobs.append(FigureJob(cellcycle_barplot, dict(df=summary.proportions(cell_lines),
+                                                  conditions=conditions, title_str=title_str, H3=H3, path=path)))
+    return jobs
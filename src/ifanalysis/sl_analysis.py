@@ -1,18 +1,17 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.gridspec import GridSpec
-from matplotlib import ticker
-import seaborn as sns
-from ifanalysis._helper_functions import save_fig
+from ifanalysis._helper_functions import category_order, colors_getattr, hue_boxes, lazy_module, plot_style, save_fig
+from ifanalysis.summary import quantile, summary_data
 from pathlib import Path
 from typing import Optional
 path = Path.cwd() 
-# Matplotlib Style and Colors
-module_dir = Path(__file__).parent
-style_path = module_dir / 'styles/Style_01.mplstyle'
-plt.style.use(str(style_path))
-prop_cycle = plt.rcParams["axes.prop_cycle"]
-colors = prop_cycle.by_key()["color"]
+plt = lazy_module('matplotlib.pyplot')
+sns = lazy_module('seaborn')
+ticker = lazy_module('matplotlib.ticker')
+gridspec = lazy_module('matplotlib.gridspec')
+
+
+__getattr__ = colors_getattr(__name__)
+
 
 def plot_histogram(ax, i, data):
     sns.histplot(data=data, x="integrated_int_DAPI_norm", ax=ax)
@@ -27,12 +26,13 @@ def plot_histogram(ax, i, data):
     else:
         ax.yaxis.set_visible(False)
 
+@plot_style()
 def combplot_hist(df, conditions, title_str, cell_number=None, save=True, path=path):
     
     col_number = len(conditions)
 
     fig = plt.figure(figsize=(2 * len(conditions), 3))
-    gs = GridSpec(1, col_number)  # Only one row of subplots
+    gs = gridspec.GridSpec(1, col_number)  # Only one row of subplots
 
     for i, condition in enumerate(conditions):
         data = df[df.condition == condition]
@@ -57,6 +57,7 @@ def plot_int_violin(ax, df: pd.DataFrame, conditions: list, col: str, hue: Optio
     # Determine the number of hue levels
 
     if hue:
+        hue_order = category_order(df[hue])
         sns.violinplot(
             x="condition", 
             y=col, 
@@ -67,27 +68,10 @@ def plot_int_violin(ax, df: pd.DataFrame, conditions: list, col: str, hue: Optio
             inner=None, 
             linewidth=0,
             hue=hue,
+            hue_order=hue_order,
             ax=ax)
-        
-         # Calculate the width of each violin plot portion
-        hue_levels = df[hue].unique()
-        hue_count = len(hue_levels)
-        width_per_hue = 0.8 / hue_count  # 0.8 is the default width of violin plots in seaborn
-
-        for i, condition in enumerate(conditions):
-            for j, level in enumerate(hue_levels):
-                subset = df[(df["condition"] == condition) & (df[hue] == level)]
-                # Calculate the center position for the boxplot
-                box_center = i - 0.4 + width_per_hue/2 + j*width_per_hue
-                sns.boxplot(
-                    y=subset[col], 
-                    showfliers=False, 
-                    color='white', 
-                    saturation=0.5, 
-                    width=0.1, 
-                    boxprops={'zorder': 2},
-                    positions=[box_center], 
-                    ax=ax)
+        # boxes of all (condition, hue level) pairs from one pass over the data, centred on the dodged violins
+        hue_boxes(ax, df, "condition", col, hue, conditions, hue_order)
     else:
         sns.violinplot(
             x="condition", 
@@ -120,7 +104,12 @@ def plot_int_violin(ax, df: pd.DataFrame, conditions: list, col: str, hue: Optio
     ax.set_xlabel('')
 
 
+@plot_style()
 def intensity_plot(df, conditions, columns, hue=None, title=None, save=True, path=path):
+    """
+    Violin plots of intensity columns per condition
+    :param df: single cell dataframe, or its PlateSummary to reuse the precomputed quantiles
+    """
     fig, axarr = plt.subplots(nrows=len(columns), figsize=(len(conditions), len(columns)*3))
     
     # Ensure axarr is always a list
@@ -128,9 +117,9 @@ def intensity_plot(df, conditions, columns, hue=None, title=None, save=True, pat
         axarr = [axarr]
     
     for i, col in enumerate(columns):
-        y_max = df[col].quantile(0.99) * 1.5
-        y_min = df[col].quantile(0.01) * 0.8
-        plot_int_violin(axarr[i], df, conditions, col, hue)
+        y_max = quantile(df, col, 0.99) * 1.5
+        y_min = quantile(df, col, 0.01) * 0.8
+        plot_int_violin(axarr[i], summary_data(df), conditions, col, hue)
         axarr[i].set_ylim([y_min, y_max])
         axarr[i].set_title(col)   
 
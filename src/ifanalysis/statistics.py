@@ -1,6 +1,10 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-from scipy.stats import ttest_ind
-from typing import List
+from typing import List, Optional, Sequence, Tuple
+
+from ifanalysis.normalisation import group_codes
 
 
 
@@ -13,6 +17,8 @@ def t_test_cc(df: pd.DataFrame, cond: str, cc_phase: str, ctr: str) -> float:
     :param ctr: control condition, default 'SCR'
     :return: p-value
     """
+    from scipy.stats import ttest_ind
+
     sample1 = df.loc[(df.cell_cycle == cc_phase) & (df.condition == ctr), 'percent'].to_list()
     sample2 = df.loc[(df.cell_cycle == cc_phase) & (df.condition == cond), 'percent'].to_list()
     t, p = ttest_ind(sample1, sample2)
@@ -32,16 +38,305 @@ def t_test_perphase(df: pd.DataFrame, cond: str, ctr: str) -> List[float]:
 
 def t_test_cc_percond(df, ctr: str ='SCR'):
     """
-    Function to loop through each condition and perform t-test for each cell cycle phase
+    Function to perform a t-test against the control for each condition and cell cycle phase,
+    all tests are computed at once by compare_to_control
     :param df: dataframe from cellcycle_prop function
     :return: dataframe with mean, std and p-value for each cell cycle phase
     """
-    stats_sum = df.groupby(['condition', 'cell_cycle'])['percent'].agg(['mean', 'std']).reset_index()
-    p_value_list = []
-    for cond in stats_sum.condition.unique():
-        p = t_test_perphase(df, cond, ctr)
-        p_value_list.append(p)
-        # flatten list of lists
-    final_pval_list = [item for sublist in p_value_list for item in sublist]
-    stats_sum['p_value'] = final_pval_list
-    return stats_sum
+    stats_sum = compare_to_control(df, ctr, correction=None)
+    return stats_sum[['condition', 'cell_cycle', 'mean', 'std', 'p_value']]
+
+
+# Batched tests: the proportions are pivoted once into a (group x phase x replicate) array and all t-tests
+# against the control are computed in one vectorised pass
+
+CORRECTIONS = ("fdr_bh", "holm", "bonferroni", None)
+
+
+def pivot_replicates(df: pd.DataFrame, groups: Sequence[str], value: str = 'percent',
+                     phase: Optional[str] = 'cell_cycle',
+                     phases: Optional[Sequence[str]] = None) -> Tuple[pd.DataFrame, List[str], np.ndarray]:
+    """
+    Pivots a long table into an array of replicate values, NaN padded
+    :param df: dataframe from cellcycle_prop (or count_per_cond with phase=None)
+    :param groups: columns identifying a group, e.g. ['condition'] or ['cell_line', 'condition']
+    :param value: value column, default 'percent'
+    :param phase: phase column, default 'cell_cycle', None for a single value per replicate
+    :param phases: option, order of the phases, default: sorted phases of df
+    :return: group labels (in groupby order), phases, array of shape (groups, phases, replicates)
+    """
+    groups = list(groups)
+    df = df.loc[df[groups].notna().all(axis=1) & df[value].notna()]
+    codes, first, group_index = np.unique(group_codes(df, groups), return_index=True, return_inverse=True)
+    labels = df[groups].iloc[first].reset_index(drop=True)
+    if phase is None:
+        phases, phase_index = [None], np.zeros(len(df), dtype=np.int64)
+    else:
+        phases = list(phases) if phases is not None else sorted(df[phase].dropna().unique())
+        phase_index = pd.Index(phases).get_indexer(df[phase].to_numpy(dtype=object)).astype(np.int64)
+    keep = phase_index >= 0
+    cell = group_index[keep] * len(phases) + phase_index[keep]
+    replicate = pd.Series(cell).groupby(cell).cumcount().to_numpy()
+    array = np.full((len(labels), len(phases), replicate.max() + 1 if len(replicate) else 0), np.nan)
+    array[cell // len(phases), cell % len(phases), replicate] = df[value].to_numpy(dtype=float)[keep]
+    return labels, phases, array
+
+
+def batched_ttest(sample1: np.ndarray, sample2: np.ndarray, equal_var: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Two-sided independent t-tests along the last axis, NaN values are ignored.
+    Same results as scipy.stats.ttest_ind per test, NaN where the test is undefined (a sample without values,
+    fewer than 3 values in total, or a single value in Welch's t-test).
+    :param sample1: array of replicates, e.g. the control broadcast against sample2
+    :param sample2: array of replicates
+    :param equal_var: True for Student's t-test (pooled variance, default), False for Welch's t-test
+    :return: t statistics, p-values
+    """
+    # scipy is imported here, it is slow to import and most of this module does not need it
+    from scipy.stats import t as t_dist
+
+    n1 = np.sum(~np.isnan(sample1), axis=-1)
+    n2 = np.sum(~np.isnan(sample2), axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean1 = np.nansum(sample1, axis=-1) / n1
+        mean2 = np.nansum(sample2, axis=-1) / n2
+        ss1 = np.nansum((sample1 - mean1[..., None]) ** 2, axis=-1)
+        ss2 = np.nansum((sample2 - mean2[..., None]) ** 2, axis=-1)
+        if equal_var:
+            dof = n1 + n2 - 2.0
+            se = np.sqrt((ss1 + ss2) / dof * (1.0 / n1 + 1.0 / n2))
+            valid = (n1 > 0) & (n2 > 0) & (dof > 0)
+        else:
+            v1, v2 = ss1 / (n1 - 1) / n1, ss2 / (n2 - 1) / n2
+            se = np.sqrt(v1 + v2)
+            dof = (v1 + v2) ** 2 / (v1 ** 2 / (n1 - 1) + v2 ** 2 / (n2 - 1))
+            valid = (n1 > 1) & (n2 > 1)
+        t = (mean1 - mean2) / se
+    t = np.where(valid, t, np.nan)
+    p = np.where(valid, 2 * t_dist.sf(np.abs(t), np.where(valid, dof, 1)), np.nan)
+    return t, p
+
+
+def p_adjust(p_values, method: Optional[str] = 'fdr_bh') -> np.ndarray:
+    """
+    Multiple testing correction, NaN p-values are left out of the family
+    :param p_values: array of p-values
+    :param method: 'fdr_bh' (Benjamini-Hochberg, default), 'holm', 'bonferroni' or None for no correction
+    :return: adjusted p-values, same shape
+    """
+    if method not in CORRECTIONS:
+        raise ValueError(f"method must be one of {CORRECTIONS}")
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = p_values.copy()
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+    m = len(p)
+    if method is None or m == 0:
+        return adjusted
+    if method == 'bonferroni':
+        adjusted[valid] = np.minimum(p * m, 1)
+        return adjusted
+    order = np.argsort(p, kind='stable')
+    ranked = p[order]
+    if method == 'holm':
+        ranked = np.maximum.accumulate(ranked * (m - np.arange(m)))
+    else:
+        ranked = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+    result = np.empty(m)
+    result[order] = np.minimum(ranked, 1)
+    adjusted[valid] = result
+    return adjusted
+
+
+def compare_to_control(df: pd.DataFrame, ctr: str = 'SCR', value: str = 'percent',
+                       phase: Optional[str] = 'cell_cycle', per_cell_line: bool = False,
+                       equal_var: bool = True, correction: Optional[str] = 'fdr_bh') -> pd.DataFrame:
+    """
+    t-tests of every condition against the control for every phase in one vectorised pass
+    :param df: dataframe from cellcycle_prop, or count_per_cond with value='norm_count' and phase=None
+    :param ctr: control condition, default 'SCR'
+    :param value: value column, default 'percent'
+    :param phase: phase column, default 'cell_cycle', None to test the values per condition only
+    :param per_cell_line: compare within each cell line against its own control, default False (pool cell lines)
+    :param equal_var: True for Student's t-test (default, as t_test_cc), False for Welch's t-test
+    :param correction: multiple testing correction over all tests except control vs control,
+    'fdr_bh' (default), 'holm', 'bonferroni' or None
+    :return: dataframe with mean, std, n, t, p_value and p_adj per group and phase
+    """
+    groups = ['cell_line', 'condition'] if per_cell_line else ['condition']
+    labels, phases, array = pivot_replicates(df, groups, value, phase)
+    is_ctr = (labels['condition'] == ctr).to_numpy()
+    # index of the control group of every group, -1 if there is none
+    blocks = labels['cell_line'] if per_cell_line else pd.Series(0, index=labels.index)
+    control = pd.Series(np.flatnonzero(is_ctr), index=blocks[is_ctr].to_numpy())
+    control_index = blocks.map(control).fillna(-1).astype(np.int64).to_numpy()
+    has_control = control_index >= 0
+    t = np.full(array.shape[:2], np.nan)
+    p = np.full(array.shape[:2], np.nan)
+    if has_control.any():
+        t[has_control], p[has_control] = batched_ttest(array[control_index[has_control]], array[has_control],
+                                                      equal_var=equal_var)
+    p_adj = p.copy()
+    tested = np.broadcast_to((has_control & ~is_ctr)[:, None], p.shape)
+    p_adj[tested] = p_adjust(p[tested], correction)
+    p_adj[~tested] = np.nan
+    result = labels.loc[labels.index.repeat(len(phases))].reset_index(drop=True)
+    if phase is not None:
+        result[phase] = np.tile(phases, len(labels))
+    n = np.sum(~np.isnan(array), axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(array, axis=-1) / n
+        std = np.sqrt(np.nansum((array - mean[..., None]) ** 2, axis=-1) / (n - 1))
+    result['mean'] = mean.ravel()
+    result['std'] = std.ravel()
+    result['n'] = n.ravel()
+    result['t'] = t.ravel()
+    result['p_value'] = p.ravel()
+    result['p_adj'] = p_adj.ravel()
+    return result.loc[result['n'] > 0].reset_index(drop=True)
+
+
+# Resampling tests of single cell intensities: bootstrap confidence intervals and permutation p-values of the
+# difference between a condition and the control, resampled in chunks of whole (resamples x cells) arrays
+
+RESAMPLE_STATISTICS = {'mean': np.mean, 'median': np.median}
+# Upper bound on the number of values drawn per chunk of resamples (about 128 MB of float64)
+RESAMPLE_CHUNK = 2 ** 24
+
+
+def _chunk_sizes(n_resamples: int, n_values: int, chunk: int) -> List[int]:
+    per_chunk = max(1, chunk // max(n_values, 1))
+    return [min(per_chunk, n_resamples - start) for start in range(0, n_resamples, per_chunk)]
+
+
+def bootstrap_diff(ctr_values: np.ndarray, values: np.ndarray, statistic: str = 'mean', n_resamples: int = 1000,
+                   seed=None, chunk: int = RESAMPLE_CHUNK) -> np.ndarray:
+    """
+    Bootstrap distribution of statistic(values) - statistic(ctr_values), both samples resampled with replacement
+    :param ctr_values: control values
+    :param values: values of the condition
+    :param statistic: 'mean' (default) or 'median'
+    :param n_resamples: number of bootstrap resamples, default 1000
+    :param seed: seed or np.random.SeedSequence
+    :param chunk: maximal number of values drawn at once, default RESAMPLE_CHUNK
+    :return: array of n_resamples differences
+    """
+    func = RESAMPLE_STATISTICS[statistic]
+    # one stream per sample, so the draws do not depend on the chunk size
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    ctr_rng, rng = (np.random.default_rng(child) for child in seed.spawn(2))
+    diffs = []
+    for size in _chunk_sizes(n_resamples, len(ctr_values) + len(values), chunk):
+        resampled_ctr = ctr_values[ctr_rng.integers(0, len(ctr_values), (size, len(ctr_values)))]
+        resampled = values[rng.integers(0, len(values), (size, len(values)))]
+        diffs.append(func(resampled, axis=1) - func(resampled_ctr, axis=1))
+    return np.concatenate(diffs)
+
+
+def permutation_diff(ctr_values: np.ndarray, values: np.ndarray, statistic: str = 'mean', n_resamples: int = 1000,
+                     seed=None, chunk: int = RESAMPLE_CHUNK) -> np.ndarray:
+    """
+    Null distribution of statistic(values) - statistic(ctr_values) with the condition labels permuted
+    :param ctr_values: control values
+    :param values: values of the condition
+    :param statistic: 'mean' (default) or 'median'
+    :param n_resamples: number of permutations, default 1000
+    :param seed: seed or np.random.SeedSequence
+    :param chunk: maximal number of values permuted at once, default RESAMPLE_CHUNK
+    :return: array of n_resamples differences
+    """
+    func = RESAMPLE_STATISTICS[statistic]
+    rng = np.random.default_rng(seed)
+    pooled = np.concatenate([ctr_values, values])
+    n_ctr = len(ctr_values)
+    diffs = []
+    for size in _chunk_sizes(n_resamples, len(pooled), chunk):
+        permuted = rng.permuted(np.broadcast_to(pooled, (size, len(pooled))), axis=1)
+        diffs.append(func(permuted[:, n_ctr:], axis=1) - func(permuted[:, :n_ctr], axis=1))
+    return np.concatenate(diffs)
+
+
+def _resample_task(ctr_values: np.ndarray, values: np.ndarray, statistic: str, method: str, n_resamples: int,
+                   confidence: float, seed: np.random.SeedSequence,
+                   chunk: int) -> Tuple[float, float, float, float, float]:
+    """
+    Difference, Cohen's d, confidence interval and p-value of one comparison
+    """
+    func = RESAMPLE_STATISTICS[statistic]
+    diff = float(func(values) - func(ctr_values))
+    n1, n2 = len(ctr_values), len(values)
+    pooled_sd = np.sqrt(((n1 - 1) * np.var(ctr_values, ddof=1) + (n2 - 1) * np.var(values, ddof=1)) / (n1 + n2 - 2))
+    cohens_d = float((np.mean(values) - np.mean(ctr_values)) / pooled_sd)
+    bootstrap_seed, permutation_seed = seed.spawn(2)
+    boot = bootstrap_diff(ctr_values, values, statistic, n_resamples, bootstrap_seed, chunk)
+    ci_low, ci_high = np.quantile(boot, [(1 - confidence) / 2, (1 + confidence) / 2])
+    if method == 'permutation':
+        null = permutation_diff(ctr_values, values, statistic, n_resamples, permutation_seed, chunk)
+        p = (1 + np.sum(np.abs(null) >= abs(diff))) / (1 + n_resamples)
+    else:
+        # two-sided: how often the bootstrap difference falls on the other side of zero
+        p = min(1.0, 2 * (1 + min(np.sum(boot <= 0), np.sum(boot >= 0))) / (1 + n_resamples))
+    return diff, cohens_d, float(ci_low), float(ci_high), float(p)
+
+
+def compare_intensity(df: pd.DataFrame, col: str, ctr: str, conditions: Optional[Sequence[str]] = None,
+                      phases: Optional[Sequence[str]] = None, per_cell_line: bool = False,
+                      statistic: str = 'mean', method: str = 'permutation', n_resamples: int = 1000,
+                      confidence: float = 0.95, seed: int = 0, correction: Optional[str] = 'fdr_bh',
+                      n_workers: int = 1, chunk: int = RESAMPLE_CHUNK) -> pd.DataFrame:
+    """
+    Compares the single cell distribution of an intensity column between each condition and the control,
+    with a bootstrap confidence interval of the difference and a permutation (or bootstrap) p-value
+    :param df: single cell dataframe, e.g. from cellcycle_analysis
+    :param col: intensity column, e.g. 'intensity_mean_p21_nucleus'
+    :param ctr: control condition
+    :param conditions: option, conditions to compare, default: all others
+    :param phases: option, compare within these cell cycle phases ('cell_cycle' column), default: all cells
+    :param per_cell_line: compare within each cell line, default False (pool cell lines)
+    :param statistic: 'mean' (default) or 'median'
+    :param method: 'permutation' (default) or 'bootstrap' for the p-value
+    :param n_resamples: number of resamples per comparison, default 1000
+    :param confidence: level of the bootstrap confidence interval, default 0.95
+    :param seed: random seed, every comparison gets its own stream so results do not depend on n_workers
+    (comparisons with fewer than 2 cells in either sample are left out)
+    :param correction: multiple testing correction, see p_adjust, default 'fdr_bh'
+    :param n_workers: number of worker processes, default 1 (run in this process)
+    :param chunk: maximal number of values drawn at once per worker, bounds the memory, default RESAMPLE_CHUNK
+    :return: dataframe with cell numbers, difference, cohens_d, ci_low, ci_high, p_value and p_adj per comparison
+    """
+    if statistic not in RESAMPLE_STATISTICS:
+        raise ValueError(f"statistic must be one of {list(RESAMPLE_STATISTICS)}")
+    if method not in ('permutation', 'bootstrap'):
+        raise ValueError("method must be 'permutation' or 'bootstrap'")
+    blocks = (['cell_line'] if per_cell_line else []) + (['cell_cycle'] if phases is not None else [])
+    data = df.loc[df[col].notna()]
+    if phases is not None:
+        data = data.loc[data['cell_cycle'].isin(list(phases))]
+    values = data[col].to_numpy(dtype=float)
+    # row positions of every (block, condition) group, in one groupby pass
+    indices = data.groupby(blocks + ['condition'], observed=True).indices
+    groups = {key if isinstance(key, tuple) else (key,): rows for key, rows in indices.items()}
+    rows, tasks = [], []
+    for key, cond_rows in groups.items():
+        block, condition = key[:-1], key[-1]
+        ctr_rows = groups.get(block + (ctr,))
+        if condition == ctr or ctr_rows is None or (conditions is not None and condition not in conditions):
+            continue
+        # resampling needs at least 2 cells per sample
+        if len(ctr_rows) < 2 or len(cond_rows) < 2:
+            continue
+        rows.append(dict(zip(blocks, block), condition=condition, n_ctr=len(ctr_rows), n=len(cond_rows)))
+        tasks.append((values[ctr_rows], values[cond_rows]))
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    args = [(ctr_values, cond_values, statistic, method, n_resamples, confidence, task_seed, chunk)
+            for (ctr_values, cond_values), task_seed in zip(tasks, seeds)]
+    if n_workers > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_resample_task, *zip(*args)))
+    else:
+        results = [_resample_task(*task_args) for task_args in args]
+    result = pd.DataFrame(rows, columns=blocks + ['condition', 'n_ctr', 'n'])
+    result[['difference', 'cohens_d', 'ci_low', 'ci_high', 'p_value']] = (
+        pd.DataFrame(results, index=result.index) if results else np.empty((0, 5)))
+    result['p_adj'] = p_adjust(result['p_value'].to_numpy(), correction)
+    return result
@@ -0,0 +1,197 @@
+"""
+Out-of-core version of cellcycle_analysis for screens larger than memory.
+The data is read chunk by chunk, each chunk holding whole images so that multinucleates are aggregated
+and duplicates removed exactly as in memory. The normalisation modes come from per cell line histograms
+with a fixed range, which are summed over the chunks and give the same modes as histogram_mode on the full data.
+The source is read and prepared once: the prepared chunks are spilled to parquet files in a temporary directory
+while the value ranges are collected, and the histogram and labelling passes read them back.
+Only one chunk is held in memory at a time; the labelled cells can be written to a file as they are produced.
+Requires pyarrow (pip install hhlab-ifanalysis[parquet]).
+"""
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis.gating import GatingModel
+from ifanalysis.io import _require_pyarrow, iter_screen_chunks
+from ifanalysis.modes import histogram_counts, mode_from_counts
+from ifanalysis.normalisation import assign_ccphase, cellcycle_values, normalise, prepare_cellcycle
+
+Source = Union[str, Path, Callable[[], Iterable[pd.DataFrame]]]
+
+_well_keys = ["plate_id", "well", "cell_line", "condition"]
+
+
+def _chunks(source: Source, H3: bool, cyto: bool, chunksize: int,
+            columns: Optional[Iterable[str]]) -> Iterator[pd.DataFrame]:
+    """
+    Prepared chunks (see prepare_cellcycle) of a file or of the dataframes returned by a callable
+    """
+    if callable(source):
+        chunks = source()
+    else:
+        chunks = iter_screen_chunks(source, chunksize=chunksize,
+                                    analysis='cellcycle_H3' if H3 else 'cellcycle', columns=columns)
+    for chunk in chunks:
+        yield prepare_cellcycle(chunk, H3=H3, cyto=cyto)
+
+
+class _Spill:
+    """
+    Prepared chunks written to parquet files in a temporary directory, with the value ranges per cell line
+    collected on the way, so that the later passes neither reread the source nor rerun prepare_cellcycle
+    """
+
+    def __init__(self, source: Source, H3: bool, cyto: bool, chunksize: int, columns: Optional[Iterable[str]]):
+        _require_pyarrow()
+        values = cellcycle_values(H3)
+        self.dir = tempfile.TemporaryDirectory(prefix='ifanalysis-stream-')
+        self.paths = []
+        mins, maxs = [], []
+        try:
+            for chunk in _chunks(source, H3, cyto, chunksize, columns):
+                grouped = chunk.groupby("cell_line", sort=False, observed=True)[values]
+                mins.append(grouped.min())
+                maxs.append(grouped.max())
+                path = Path(self.dir.name) / f"chunk_{len(self.paths)}.parquet"
+                chunk.to_parquet(path, index=False)
+                self.paths.append(path)
+            if not mins:
+                raise ValueError("no data to analyse")
+            self.ranges = {'min': pd.concat(mins).groupby(level=0).min(),
+                           'max': pd.concat(maxs).groupby(level=0).max()}
+        except BaseException:
+            self.close()
+            raise
+
+    def chunks(self, columns: Optional[Iterable[str]] = None) -> Iterator[pd.DataFrame]:
+        for path in self.paths:
+            yield pd.read_parquet(path, columns=None if columns is None else list(columns))
+
+    def close(self):
+        self.dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _modes(spill: _Spill, values: list, bins: int, smooth: float) -> pd.DataFrame:
+    """
+    Histogram modes per cell line from the spilled chunks, reading only the cell lines and values
+    """
+    ranges = spill.ranges
+    counts = {(line, value): np.zeros(bins, dtype=np.int64) for line in ranges['min'].index for value in values}
+    for chunk in spill.chunks(["cell_line"] + values):
+        for line, group in chunk.groupby("cell_line", sort=False, observed=True):
+            for value in values:
+                value_range = (ranges['min'].at[line, value], ranges['max'].at[line, value])
+                counts[line, value] += histogram_counts(group[value].to_numpy(dtype=float), bins, value_range)
+    return pd.DataFrame(
+        {value: [mode_from_counts(counts[line, value], (ranges['min'].at[line, value], ranges['max'].at[line, value]),
+                                  smooth)
+                 for line in ranges['min'].index]
+         for value in values},
+        index=ranges['min'].index,
+    )
+
+
+def streamed_modes(source: Source, H3: bool = False, cyto: bool = True, bins: int = 10000, smooth: float = 0.0,
+                   chunksize: int = 1_000_000, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Histogram modes per cell line from one pass over the source, the same values as
+    normalise with mode='histogram' on the full dataset
+    :param source: csv/parquet file or callable returning an iterable of dataframes with whole images
+    :param H3: True if H3P staining is present
+    :param cyto: True if cytoplasmic data is present
+    :param bins: number of histogram bins, default 10000
+    :param smooth: sd of the Gaussian smoothing kernel in bins, default 0
+    :param chunksize: rows per chunk when reading a file, default 1000000
+    :param columns: option, additional columns to read
+    :return: dataframe of modes, index: cell lines, columns: values
+    """
+    with _Spill(source, H3, cyto, chunksize, columns) as spill:
+        return _modes(spill, cellcycle_values(H3), bins, smooth)
+
+
+class _Writer:
+    """
+    Appends labelled chunks to a parquet or csv file
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.parquet = self.path.suffix == '.parquet'
+        if self.parquet:
+            _require_pyarrow()
+        self.writer = None
+        self.header = True
+
+    def write(self, df: pd.DataFrame):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self.writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self.schema = table.schema
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            self.writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False)
+            self.header = False
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def stream_cellcycle_analysis(source: Source, H3: bool = False, cyto: bool = True,
+                              gates: Optional[GatingModel] = None, bins: int = 10000, smooth: float = 0.0,
+                              output: Optional[Union[str, Path]] = None, chunksize: int = 1_000_000,
+                              columns: Optional[Iterable[str]] = None,
+                              cell_cycle: str = 'cell_cycle') -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Streaming version of cellcycle_analysis followed by cellcycle_prop. The source is read and prepared once,
+    the histogram modes per cell line are collected from the spilled chunks (see streamed_modes), which are then
+    normalised and labelled one by one, written to output and added to the per well counts.
+    :param source: csv/parquet file or callable returning an iterable of dataframes with whole images,
+    e.g. lambda: (pd.read_csv(f) for f in plate_files)
+    :param H3: True if H3P staining is present
+    :param cyto: True if cytoplasmic data is present
+    :param gates: option, GatingModel to use instead of the H3/non-H3 preset
+    :param bins: number of histogram bins for the modes, default 10000 as in histogram_mode
+    :param smooth: sd of the Gaussian smoothing kernel in bins, default 0
+    :param output: option, .parquet or .csv file for the labelled single cell data
+    :param chunksize: rows per chunk when reading a file, default 1000000
+    :param columns: option, additional columns to read
+    :param cell_cycle: choose column cell_cycle or cell_cycle_detailed for the proportions, default 'cell_cycle'
+    :return: tuple of (cell cycle proportions as from cellcycle_prop, modes per cell line)
+    """
+    values = cellcycle_values(H3)
+    spill = _Spill(source, H3, cyto, chunksize, columns)
+    writer = _Writer(output) if output else None
+    counts = []
+    try:
+        modes = _modes(spill, values, bins, smooth)
+        for chunk in spill.chunks():
+            chunk = normalise(chunk, values, inplace=True, modes=modes)
+            chunk['integrated_int_DAPI_norm'] = chunk['integrated_int_DAPI_norm'] * 2
+            chunk = assign_ccphase(data=chunk, H3=H3, gates=gates)
+            if writer:
+                writer.write(chunk)
+            counts.append(chunk.groupby(_well_keys + [cell_cycle], observed=True)["experiment"].count())
+    finally:
+        spill.close()
+        if writer:
+            writer.close()
+    phase_counts = pd.concat(counts).groupby(level=list(range(len(_well_keys) + 1)), observed=True).sum()
+    well_counts = phase_counts.groupby(level=list(range(len(_well_keys))), observed=True).sum()
+    df_prop = phase_counts / well_counts * 100
+    return df_prop.reset_index().rename(columns={"experiment": "percent"}), modes
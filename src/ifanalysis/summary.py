@@ -0,0 +1,163 @@
+"""
+Precomputed summary of a normalised single cell dataframe for the plotting functions.
+PlateSummary sorts the cells once by cell line and condition so that every (cell line, condition) group is a
+contiguous slice, and computes in the same pass the DNA content histograms per group, the axis quantiles and the
+cell counts per well and phase (from which cellcycle_prop, prop_pivot and count_per_cond tables are derived).
+Build it once with PlateSummary.from_frame and pass it to combplot, int_combplot, intensity_plot and
+cellcycle_barplot in place of the dataframe. Given a dataframe, combplot and int_combplot only summarise the
+cells of their cell line.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ifanalysis.normalisation import group_codes, prop_from_counts
+
+WELL_KEYS = ["plate_id", "well", "cell_line", "condition"]
+# Quantiles used for the axis limits of the plots
+QUANTILE_LEVELS = (0.01, 0.99, 0.995)
+
+
+@dataclass
+class PlateSummary:
+    """
+    :param data: the single cell data, rows grouped by cell line and condition (original order within groups)
+    :param slices: row slice of data for each (cell_line, condition)
+    :param phase_counts: number of cells per plate, well, cell line, condition and cell cycle phase (NaN included)
+    :param histograms: (counts, edges) of the DNA content per (cell_line, condition), bins as in sns.histplot
+    :param quantiles: precomputed quantiles, key (column, q, cell_line or None for all cells)
+    """
+    data: pd.DataFrame
+    slices: Dict[Tuple[str, str], slice]
+    phase_counts: Optional[pd.Series] = None
+    histograms: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]] = field(default_factory=dict)
+    quantiles: Dict[Tuple[str, float, Optional[str]], float] = field(default_factory=dict)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, quantile_columns: Iterable[str] = ('intensity_mean_EdU_nucleus_norm',),
+                   hist_column: str = 'integrated_int_DAPI_norm', cell_cycle: str = 'cell_cycle') -> "PlateSummary":
+        """
+        Builds the summary in one grouping pass over df
+        :param df: dataframe from cellcycle_analysis
+        :param quantile_columns: columns to precompute QUANTILE_LEVELS for, overall and per cell line,
+        others are computed on first use
+        :param hist_column: column for the histograms, default 'integrated_int_DAPI_norm'
+        :param cell_cycle: phase column for the well counts, default 'cell_cycle'
+        :return: PlateSummary
+        """
+        codes = group_codes(df, ['cell_line', 'condition'])
+        if len(codes) and codes[0] >= 0 and np.all(codes[1:] >= codes[:-1]):
+            # already grouped, e.g. a ColumnStore frame: the rows are used without copying them
+            data, sorted_codes = df, codes
+        else:
+            order = np.argsort(codes, kind='stable')
+            sorted_codes = codes[order]
+            data = df.iloc[order[sorted_codes >= 0]]
+            sorted_codes = sorted_codes[sorted_codes >= 0]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if len(data) else np.array([], int)
+        stops = np.append(starts[1:], len(data))
+        lines = data['cell_line'].to_numpy()
+        conditions = data['condition'].to_numpy()
+        slices = {(lines[start], conditions[start]): slice(int(start), int(stop)) for start, stop in zip(starts, stops)}
+        summary = cls(data=data, slices=slices)
+        if hist_column in data.columns:
+            values = data[hist_column].to_numpy(dtype=float)
+            for key, rows in slices.items():
+                group = values[rows]
+                group = group[~np.isnan(group)]
+                if len(group):
+                    summary.histograms[key] = np.histogram(group, bins='auto')
+        for column in quantile_columns:
+            if column in data.columns:
+                for cell_line in [None] + summary.cell_lines:
+                    for q in QUANTILE_LEVELS:
+                        summary.quantile(column, q, cell_line)
+        if {cell_cycle, "experiment", *WELL_KEYS} <= set(data.columns):
+            # cells without a phase still count towards the well totals, as in cellcycle_prop
+            phase_counts = data.groupby(WELL_KEYS + [cell_cycle], observed=True, dropna=False)["experiment"].count()
+            well_keys = phase_counts.index.to_frame(index=False)[WELL_KEYS]
+            summary.phase_counts = phase_counts[well_keys.notna().all(axis=1).to_numpy()]
+        return summary
+
+    @classmethod
+    def of(cls, df: Union[pd.DataFrame, "PlateSummary"]) -> "PlateSummary":
+        """
+        The summary itself, or a new summary of a dataframe
+        """
+        return df if isinstance(df, cls) else cls.from_frame(df)
+
+    @classmethod
+    def of_cell_line(cls, df: Union[pd.DataFrame, "PlateSummary"], cell_line: str, **kwargs) -> "PlateSummary":
+        """
+        The summary itself, or a new summary of only the cells of one cell line of a dataframe.
+        For the plotting functions that draw one cell line per call: pass a summary built once with from_frame
+        to plot several cell lines of a dataframe without grouping it again for each of them.
+        :param kwargs: passed on to from_frame
+        """
+        if isinstance(df, cls):
+            return df
+        return cls.from_frame(df[df['cell_line'] == cell_line], **kwargs)
+
+    @property
+    def cell_lines(self) -> List[str]:
+        return list(dict.fromkeys(cell_line for cell_line, _ in self.slices))
+
+    def conditions(self, cell_line: str) -> List[str]:
+        return [condition for line, condition in self.slices if line == cell_line]
+
+    def condition_data(self, cell_line: str, condition: str) -> pd.DataFrame:
+        """
+        Cells of one cell line and condition, empty if there are none
+        """
+        return self.data.iloc[self.slices.get((cell_line, condition), slice(0, 0))]
+
+    def cell_line_data(self, cell_line: str) -> pd.DataFrame:
+        """
+        Cells of one cell line, a single slice since the rows are grouped by cell line first
+        """
+        rows = [rows for (line, _), rows in self.slices.items() if line == cell_line]
+        if not rows:
+            return self.data.iloc[0:0]
+        return self.data.iloc[rows[0].start:rows[-1].stop]
+
+    def quantile(self, column: str, q: float, cell_line: Optional[str] = None) -> float:
+        """
+        Quantile of a column over all cells or one cell line, as Series.quantile, cached
+        """
+        key = (column, q, cell_line)
+        if key not in self.quantiles:
+            data = self.data if cell_line is None else self.cell_line_data(cell_line)
+            self.quantiles[key] = data[column].quantile(q)
+        return self.quantiles[key]
+
+    def proportions(self, cell_lines: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Cell cycle proportions per well as returned by cellcycle_prop
+        :param cell_lines: option, restrict to these cell lines
+        """
+        phase_counts = self.phase_counts
+        if cell_lines is not None:
+            phase_counts = phase_counts[phase_counts.index.get_level_values('cell_line').isin(list(cell_lines))]
+        return prop_from_counts(phase_counts)
+
+    def well_counts(self) -> pd.Series:
+        """
+        Number of cells per plate, well, cell line and condition
+        """
+        return self.phase_counts.groupby(level=WELL_KEYS, observed=True).sum()
+
+
+def summary_data(df: Union[pd.DataFrame, PlateSummary]) -> pd.DataFrame:
+    """
+    Single cell dataframe of a dataframe or summary
+    """
+    return df.data if isinstance(df, PlateSummary) else df
+
+
+def quantile(df: Union[pd.DataFrame, PlateSummary], column: str, q: float) -> float:
+    """
+    Quantile of a column from the summary cache, or computed on the dataframe
+    """
+    return df.quantile(column, q) if isinstance(df, PlateSummary) else df[column].quantile(q)
@@ -0,0 +1,221 @@
+"""
+Synthetic omero-screen exports for tests, benchmarks and demos.
+Plates are laid out as one well per cell line, condition and replicate, each well imaged several times.
+Every cell gets a cell cycle phase from phase proportions that depend on cell line and condition,
+and DAPI/EdU/H3P intensities that place it where the preset gates expect that phase:
+2N and 4N DAPI peaks with S phase in between, EdU positive S phase and H3P positive mitoses.
+A fraction of the cells is split into two nuclei sharing a Cyto_ID, which agg_multinucleates merges again.
+Plates are generated one at a time from their own random stream, so make_screen and iter_plates return the
+same cells, and iter_plates can feed stream_cellcycle_analysis with screens that do not fit into memory.
+"""
+import string
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Simulated phases, in this order, with their DNA content relative to G1
+PHASES = ['Sub-G1', 'G1', 'S', 'G2', 'M', 'Polyploid']
+BASE_PROPORTIONS = np.array([0.03, 0.5, 0.3, 0.12, 0.02, 0.03])
+WELLS = [f"{row}{col}" for row in string.ascii_uppercase[:16] for col in range(1, 25)]
+
+
+def screen_layout(n_cell_lines: int = 2, n_conditions: int = 4, n_replicates: int = 3,
+                  ctr: str = 'CTR') -> pd.DataFrame:
+    """
+    Plate layout used by make_screen, one row per well
+    :param n_cell_lines: number of cell lines, named line_0, line_1, ...
+    :param n_conditions: number of conditions including the control, named ctr, cond_1, cond_2, ...
+    :param n_replicates: wells per cell line and condition on every plate
+    :param ctr: name of the control condition, default 'CTR'
+    :return: dataframe with columns well, cell_line and condition
+    """
+    cell_lines = [f"line_{i}" for i in range(n_cell_lines)]
+    conditions = [ctr] + [f"cond_{i}" for i in range(1, n_conditions)]
+    layout = pd.MultiIndex.from_product([cell_lines, conditions, range(n_replicates)],
+                                        names=['cell_line', 'condition', 'replicate']).to_frame(index=False)
+    if len(layout) > len(WELLS):
+        raise ValueError(f"the layout needs {len(layout)} wells, a plate has {len(WELLS)}")
+    layout.insert(0, 'well', WELLS[:len(layout)])
+    return layout.drop(columns='replicate')
+
+
+def _condition_effects(rng: np.random.Generator, n_cell_lines: int, n_conditions: int) -> Dict[str, np.ndarray]:
+    """
+    Phase proportions, relative growth and marker level per cell line (axis 0) and condition (axis 1),
+    the control (condition 0) has the same growth and marker level in every cell line
+    """
+    proportions = rng.dirichlet(BASE_PROPORTIONS * 200, size=(n_cell_lines, n_conditions))
+    growth = rng.lognormal(0, 0.3, (n_cell_lines, n_conditions))
+    marker = rng.lognormal(0, 0.3, (n_cell_lines, n_conditions))
+    growth[:, 0] = marker[:, 0] = 1
+    return dict(proportions=proportions, growth=growth, marker=marker,
+                g1_peak=1e6 * rng.uniform(0.8, 1.6, n_cell_lines), edu_level=rng.uniform(200, 600, n_cell_lines))
+
+
+def _plate_columns(rng: np.random.Generator, n_cells: int, layout: pd.DataFrame, effects: Dict[str, np.ndarray],
+                   images_per_well: int, multinucleate: float, H3: bool, markers: Sequence[str],
+                   dtype) -> Dict[str, np.ndarray]:
+    """
+    Columns of one plate, well, cell line and condition as codes into the layout
+    """
+    line_codes = pd.Categorical(layout.cell_line).codes
+    cond_codes = pd.Categorical(layout.condition, categories=layout.condition.unique()).codes
+    weights = effects['growth'][line_codes, cond_codes] * rng.lognormal(0, 0.1, len(layout))
+    well_counts = rng.multinomial(n_cells, weights / weights.sum())
+    image_counts = np.concatenate([rng.multinomial(count, np.full(images_per_well, 1 / images_per_well))
+                                   for count in well_counts])
+    phase = np.concatenate([np.repeat(np.arange(len(PHASES)), rng.multinomial(count, p))
+                            for count, p in zip(well_counts, effects['proportions'][line_codes, cond_codes])])
+    well = np.repeat(np.arange(len(layout)), well_counts)
+    image = np.repeat(np.arange(len(image_counts)), image_counts)
+    cyto_id = np.arange(n_cells) - np.repeat(np.cumsum(image_counts) - image_counts, image_counts) + 1
+    line, cond = line_codes[well], cond_codes[well]
+
+    # DNA content relative to G1, S phase cells spread between 2N and 4N
+    content = np.array([0.5, 1, 1.5, 2, 2, 4])[phase]
+    content[phase == 0] = rng.uniform(0.25, 0.7, np.sum(phase == 0))
+    content[phase == 2] = rng.uniform(1.05, 1.95, np.sum(phase == 2))
+    dapi = effects['g1_peak'][line] * content * rng.normal(1, 0.06, n_cells)
+    area = rng.normal(150, 20, n_cells) * np.sqrt(content)
+    edu_level = effects['edu_level'][line]
+    edu = edu_level * rng.lognormal(np.where(phase == 2, np.log(12), 0), np.where(phase == 2, 0.5, 0.25))
+    cells = {'integrated_int_DAPI': dapi, 'area_nucleus': area}
+    channels = {'DAPI': dapi / area, 'EdU': edu}
+    if H3:
+        channels['H3P'] = edu_level * rng.lognormal(np.where(phase == 4, np.log(20), 0), 0.3)
+    for marker in markers:
+        channels[marker] = 500 * effects['marker'][line, cond] * rng.lognormal(0, 0.4, n_cells) \
+                           * np.where(np.isin(phase, [3, 4]), 1.3, 1)
+
+    # multinucleates: the DNA content and nuclear area of a cell are split between two nuclei
+    split = rng.random(n_cells) < multinucleate
+    rows = np.repeat(np.arange(n_cells), 1 + split)
+    first = np.r_[True, rows[1:] != rows[:-1]]
+    fraction = rng.uniform(0.3, 0.7, n_cells)[rows]
+    share = np.where(split[rows], np.where(first, fraction, 1 - fraction), 1)
+    columns = {'well': well[rows], 'image_id': image[rows], 'Cyto_ID': cyto_id[rows], 'phase': phase[rows]}
+    for col, values in cells.items():
+        columns[col] = (values[rows] * share).astype(dtype)
+    n_rows = len(rows)
+    for channel, values in channels.items():
+        background = rng.normal(100, 5, n_rows)
+        mean = values[rows] + background
+        columns[f'intensity_mean_{channel}_nucleus'] = mean.astype(dtype)
+        columns[f'intensity_max_{channel}_nucleus'] = (mean * rng.uniform(1.5, 2, n_rows)).astype(dtype)
+        columns[f'intensity_min_{channel}_nucleus'] = background.astype(dtype)
+    columns['intensity_mean_DAPI_cyto'] = rng.normal(2500, 250, n_rows).astype(dtype)
+    columns['area_cell'] = (columns['area_nucleus'] * rng.uniform(3, 6, n_rows)).astype(dtype)
+    return columns
+
+
+def _frame(columns: Dict[str, np.ndarray], layout: pd.DataFrame, plate_ids: np.ndarray,
+           plate_codes: np.ndarray, categorical: bool, phases: bool) -> pd.DataFrame:
+    """
+    Dataframe in the column order of omero-screen exports, the columns dict is emptied on the way
+    """
+    well = columns.pop('well')
+    keys = {
+        'experiment': (np.zeros(len(well), dtype=np.int8), np.array(['synthetic'])),
+        'plate_id': (plate_codes, plate_ids),
+        'well': (well, layout.well.to_numpy()),
+        'cell_line': (pd.Index(layout.cell_line.unique()).get_indexer(layout.cell_line)[well],
+                      layout.cell_line.unique()),
+        'condition': (pd.Index(layout.condition.unique()).get_indexer(layout.condition)[well],
+                      layout.condition.unique()),
+    }
+    if categorical:
+        data = {col: pd.Categorical.from_codes(codes, categories) for col, (codes, categories) in keys.items()}
+    else:
+        data = {col: categories[codes] for col, (codes, categories) in keys.items()}
+    data['image_id'] = columns.pop('image_id')
+    data['Cyto_ID'] = columns.pop('Cyto_ID')
+    phase = columns.pop('phase')
+    data.update(columns)
+    columns.clear()
+    if phases:
+        data['true_phase'] = pd.Categorical.from_codes(phase, PHASES)
+    return pd.DataFrame(data, copy=False)
+
+
+def _plan(n_cells: int, n_plates: int, seed: int, n_cell_lines: int, n_conditions: int
+          ) -> Tuple[List[int], Dict[str, np.ndarray]]:
+    rng = np.random.default_rng([seed, 0])
+    effects = _condition_effects(rng, n_cell_lines, n_conditions)
+    return list(rng.multinomial(n_cells, np.full(n_plates, 1 / n_plates))), effects
+
+
+def iter_plates(n_cells: int, n_plates: int = 1, n_cell_lines: int = 2, n_conditions: int = 4,
+                n_replicates: int = 3, images_per_well: int = 4, multinucleate: float = 0.05, H3: bool = False,
+                markers: Sequence[str] = ('p21',), ctr: str = 'CTR', categorical: bool = False,
+                dtype=np.float64, phases: bool = False, seed: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    Synthetic screen plate by plate, see make_screen for the parameters
+    """
+    layout = screen_layout(n_cell_lines, n_conditions, n_replicates, ctr)
+    plate_cells, effects = _plan(n_cells, n_plates, seed, n_cell_lines, n_conditions)
+    plate_ids = np.arange(1001, 1001 + n_plates)
+    image_offset = 0
+    for i, n_plate in enumerate(plate_cells):
+        rng = np.random.default_rng([seed, i + 1])
+        columns = _plate_columns(rng, n_plate, layout, effects, images_per_well, multinucleate, H3, markers, dtype)
+        columns['image_id'] = columns['image_id'] + image_offset
+        image_offset += len(layout) * images_per_well
+        plate_codes = np.full(len(columns['well']), i, dtype=np.int16)
+        yield _frame(columns, layout, plate_ids, plate_codes, categorical, phases)
+
+
+def make_screen(n_cells: int, n_plates: int = 1, n_cell_lines: int = 2, n_conditions: int = 4,
+                n_replicates: int = 3, images_per_well: int = 4, multinucleate: float = 0.05, H3: bool = False,
+                markers: Sequence[str] = ('p21',), ctr: str = 'CTR', categorical: bool = False,
+                dtype=np.float64, phases: bool = False, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic omero-screen export with the columns used by cellcycle_analysis, int_combplot and the counts
+    :param n_cells: number of cells, a fraction of them (multinucleate) is exported as two nuclei
+    :param n_plates: number of plates, plate ids 1001, 1002, ...
+    :param n_cell_lines: number of cell lines, named line_0, line_1, ...
+    :param n_conditions: number of conditions including the control, named ctr, cond_1, cond_2, ...
+    :param n_replicates: wells per cell line and condition on every plate
+    :param images_per_well: images per well
+    :param multinucleate: fraction of cells with two nuclei sharing a Cyto_ID, default 0.05
+    :param H3: if True, add H3P intensities with H3P positive mitoses
+    :param markers: additional nuclear intensities (intensity_*_<marker>_nucleus) that vary with the condition
+    :param ctr: name of the control condition, default 'CTR'
+    :param categorical: if True, key columns are categoricals as after io.downcast, strings otherwise
+    :param dtype: dtype of the intensity and area columns, e.g. np.float32 for screens of 10s of millions of cells
+    :param phases: if True, add the simulated phase as column true_phase (not an omero-screen column)
+    :param seed: random seed, the same seed gives the same screen
+    :return: dataframe with one row per nucleus
+    """
+    plates = iter_plates(n_cells, n_plates, n_cell_lines, n_conditions, n_replicates, images_per_well,
+                         multinucleate, H3, markers, ctr, True, dtype, phases, seed)
+    frames = list(plates)
+    if len(frames) == 1:
+        df = frames[0]
+    else:
+        # column by column, so only one column exists twice at any time
+        df = pd.DataFrame({col: _concat([frame.pop(col) for frame in frames]) for col in list(frames[0].columns)},
+                          copy=False)
+    if not categorical:
+        for col in ['experiment', 'well', 'cell_line', 'condition']:
+            df[col] = df[col].astype(str)
+        df['plate_id'] = df['plate_id'].astype(np.int64)
+    return df
+
+
+def _concat(columns: List[pd.Series]) -> np.ndarray:
+    if isinstance(columns[0].dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(np.concatenate([col.cat.codes.to_numpy() for col in columns]),
+                                         dtype=columns[0].dtype)
+    return np.concatenate([col.to_numpy() for col in columns])
+
+
+def expected_phases(df: pd.DataFrame, H3: bool = False) -> pd.Series:
+    """
+    Simulated phases of a make_screen(..., phases=True) export mapped onto the cell_cycle labels of assign_ccphase
+    :param df: synthetic screen, before or after cellcycle_analysis
+    :param H3: if True, G2 and M are separate as with the H3 gates
+    """
+    labels = {'Sub-G1': 'Sub-G1', 'G1': 'G1', 'S': 'S', 'G2': 'G2' if H3 else 'G2/M', 'M': 'M' if H3 else 'G2/M',
+              'Polyploid': 'Polyploid'}
+    return df['true_phase'].map(labels)
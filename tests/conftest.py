@@ -0,0 +1,51 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def export(seed: int, n: int, n_images: int, images_per_plate: Optional[int] = None,
+           wells: Sequence[str] = ('C2', 'C3'), cell_lines: Sequence[str] = ('HELA', 'RPE-1'),
+           conditions: Sequence[str] = ('CTR',), images_per_condition: int = 1, sort: bool = False,
+           H3: bool = False, p21: bool = False) -> pd.DataFrame:
+    """
+    Small omero-screen export: keys cycle with the image id, 60% G1 (2N) and 40% G2 (4N) nuclei
+    :param images_per_plate: option, images per plate, plate ids 1001, 1002, ..., default: one plate
+    :param images_per_condition: consecutive images with the same condition
+    :param sort: sort the rows by image, as in omero-screen exports
+    :param H3: add H3P intensities
+    :param p21: add intensity_mean_p21_nucleus
+    """
+    rng = np.random.default_rng(seed)
+    image_id = rng.integers(0, n_images, n)
+    if sort:
+        image_id = np.sort(image_id)
+    ploidy = np.where(rng.random(n) < 0.6, 1, 2)
+    df = pd.DataFrame({
+        'experiment': 'exp1',
+        'plate_id': 1001 + image_id // (images_per_plate or n_images),
+        'well': np.array(wells)[image_id % len(wells)],
+        'image_id': image_id,
+        'cell_line': np.array(cell_lines)[image_id % len(cell_lines)],
+        'condition': np.array(conditions)[(image_id // images_per_condition) % len(conditions)],
+        'Cyto_ID': rng.integers(0, 40, n),
+        'integrated_int_DAPI': rng.normal(1e6 * ploidy, 8e4 * ploidy),
+        'area_nucleus': rng.normal(150, 20, n),
+        'intensity_mean_EdU_nucleus': rng.lognormal(6, 1, n),
+        'intensity_min_EdU_nucleus': rng.normal(100, 5, n),
+    })
+    if H3:
+        df['intensity_mean_H3P_nucleus'] = rng.lognormal(5, 1, n)
+        df['intensity_min_H3P_nucleus'] = rng.normal(50, 5, n)
+    if p21:
+        df['intensity_mean_p21_nucleus'] = rng.lognormal(6, 0.5, n)
+    return df
+
+
+@pytest.fixture
+def make_export():
+    """
+    Factory of small omero-screen exports, see export
+    """
+    return export
@@ -0,0 +1,47 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from matplotlib.cbook import boxplot_stats
+
+from ifanalysis._helper_functions import box_stats, category_order
+from ifanalysis.sl_analysis import plot_int_violin
+
+
+def test_box_stats():
+    rng = np.random.default_rng(1)
+    n = 5000
+    df = pd.DataFrame({'condition': rng.choice(['A', 'B', 'C'], n), 'dose': rng.choice([1.0, 2.0], n),
+                       'value': rng.standard_t(3, n)})
+    df.loc[:5, 'value'] = np.nan
+    df = pd.concat([df, pd.DataFrame({'condition': ['D'], 'dose': [1.0], 'value': [3.0]})], ignore_index=True)
+    stats = box_stats(df, 'value', ['condition', 'dose'])
+    assert len(stats) == 7 and stats.n.sum() == n - 6 + 1
+    for row in stats.itertuples():
+        values = df.loc[(df.condition == row.condition) & (df.dose == row.dose), 'value'].dropna()
+        expected = boxplot_stats(values.to_numpy())[0]
+        np.testing.assert_allclose([row.med, row.q1, row.q3, row.whislo, row.whishi],
+                                   [expected[key] for key in ['med', 'q1', 'q3', 'whislo', 'whishi']])
+
+
+def test_category_order():
+    assert category_order(pd.Series([2.0, 0.5, 2.0])) == [0.5, 2.0]
+    assert category_order(pd.Series(['y', 'x', 'y'])) == ['y', 'x']
+    assert category_order(pd.Series(['y', 'x'], dtype=pd.CategoricalDtype(['x', 'y', 'z']))) == ['x', 'y', 'z']
+
+
+def test_hue_boxes_on_violins():
+    rng = np.random.default_rng(2)
+    n = 3000
+    df = pd.DataFrame({'condition': rng.choice(['A', 'B'], n), 'siRNA': rng.choice(['y', 'x'], n),
+                       'value': rng.lognormal(0, 0.5, n)})
+    fig, ax = plt.subplots()
+    plot_int_violin(ax, df, ['B', 'A'], 'value', 'siRNA')
+    boxes = [patch for patch in ax.patches if patch.get_zorder() == 2]
+    centres = sorted(box.get_path().get_extents().intervalx.mean() for box in boxes)
+    np.testing.assert_allclose(centres, [-0.2, 0.2, 0.8, 1.2])
+    # the box of B and the first hue level is the first box
+    first = df[(df.condition == 'B') & (df.siRNA == category_order(df.siRNA)[0])].value
+    np.testing.assert_allclose(boxes[0].get_path().get_extents().intervaly, first.quantile([0.25, 0.75]))
+    plt.close(fig)
@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from ifanalysis.cache import AnalysisCache, analysis_key, cached_cellcycle_analysis
+from ifanalysis.gating import preset_gates
+from ifanalysis.normalisation import cellcycle_analysis
+
+
+@pytest.fixture
+def screen(make_export):
+    return make_export(4, 3000, 40, images_per_plate=20)
+
+
+def test_analysis_key(screen):
+    key = analysis_key(screen)
+    assert key == analysis_key(screen.copy())
+    assert key != analysis_key(screen, H3=True)
+    assert key != analysis_key(screen, gates=preset_gates().with_thresholds('integrated_int_DAPI_norm', {1.5: 1.4}))
+    assert key != analysis_key(screen, mode='kde')
+    changed = screen.copy()
+    changed.loc[5, 'integrated_int_DAPI'] += 1
+    assert key != analysis_key(changed)
+
+
+def test_cached_cellcycle_analysis(screen, tmp_path, monkeypatch):
+    expected = cellcycle_analysis(screen)
+    result = cellcycle_analysis(screen, cache=tmp_path)
+    pd.testing.assert_frame_equal(result, expected)
+    assert len(list(tmp_path.glob('*.parquet'))) == 1
+    # a hit does not run the analysis
+    monkeypatch.setattr('ifanalysis.normalisation.cellcycle_analysis', None)
+    pd.testing.assert_frame_equal(cached_cellcycle_analysis(screen, cache=tmp_path), expected)
+
+
+def test_per_plate(screen, tmp_path):
+    cache = AnalysisCache(tmp_path)
+    result = cached_cellcycle_analysis(screen, cache=cache, per_plate=True)
+    assert len(list(tmp_path.glob('*.parquet'))) == 2
+    plate = screen[screen.plate_id == 1001]
+    pd.testing.assert_frame_equal(result[result.plate_id == 1001], cellcycle_analysis(plate))
+    changed = screen.copy()
+    changed.loc[changed.plate_id == 1002, 'intensity_mean_EdU_nucleus'] *= 2
+    cached_cellcycle_analysis(changed, cache=cache, per_plate=True)
+    assert len(list(tmp_path.glob('*.parquet'))) == 3
+
+
+def test_eviction(screen, tmp_path):
+    cache = AnalysisCache(tmp_path)
+    first = cache.put('first', screen)
+    cache.max_bytes = int(first.stat().st_size * 1.5)
+    cache.put('second', screen)
+    assert not first.exists()
+    assert cache.get('first') is None
+    pd.testing.assert_frame_equal(cache.get('second'), screen)
+
+
+def test_corrupt_entry_is_a_miss(screen, tmp_path):
+    cache = AnalysisCache(tmp_path)
+    path = cache.put('entry', screen)
+    path.write_bytes(path.read_bytes()[:100])
+    assert cache.get('entry') is None
+    assert not path.exists()
+    pd.testing.assert_frame_equal(cached_cellcycle_analysis(screen, cache=cache), cellcycle_analysis(screen))
+
+
+def test_version_from_metadata():
+    from importlib.metadata import version
+    import ifanalysis
+    assert ifanalysis.__version__ == version("hhlab-ifanalysis")
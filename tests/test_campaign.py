@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from ifanalysis.campaign import Campaign
+from ifanalysis.counts import count_per_cond
+from ifanalysis.normalisation import cellcycle_analysis, cellcycle_prop
+from ifanalysis.statistics import compare_to_control
+
+
+@pytest.fixture
+def screen(make_export):
+    return make_export(6, 4000, 60, images_per_plate=20, wells=['C2', 'C3', 'C4', 'C5'],
+                       conditions=['CTR', 'CTR', 'DRUG', 'DRUG'], p21=True)
+
+
+def per_plate_analysis(df):
+    return pd.concat([cellcycle_analysis(plate) for _, plate in df.groupby('plate_id')])
+
+
+def test_incremental(screen, tmp_path):
+    campaign = Campaign(tmp_path, intensity_cols=['intensity_mean_p21_nucleus'])
+    assert campaign.add_plates(screen[screen.plate_id < 1003]) == ['1001', '1002']
+    assert Campaign(tmp_path).add_plates(screen) == ['1003']
+    # nothing changed
+    assert campaign.add_plates(screen[screen.plate_id == 1001]) == []
+    campaign = Campaign(tmp_path)
+    assert campaign.plates == ['1001', '1002', '1003']
+    expected = per_plate_analysis(screen)
+    pd.testing.assert_frame_equal(campaign.cells(), expected)
+    pd.testing.assert_frame_equal(campaign.proportions(), cellcycle_prop(expected))
+    pd.testing.assert_frame_equal(count_per_cond(campaign, 'CTR'), count_per_cond(expected, 'CTR'))
+    pd.testing.assert_frame_equal(compare_to_control(campaign.proportions(), 'CTR'),
+                                  compare_to_control(cellcycle_prop(expected), 'CTR'))
+    intensities = campaign.intensities()
+    well = expected[(expected.plate_id == 1002) & (expected.well == 'C3')]
+    row = intensities[(intensities.plate_id == 1002) & (intensities.well == 'C3')].iloc[0]
+    assert row['intensity_mean_p21_nucleus_median'] == pytest.approx(well['intensity_mean_p21_nucleus'].median())
+    assert row['integrated_int_DAPI_norm_mean'] == pytest.approx(well['integrated_int_DAPI_norm'].mean())
+
+
+def test_changed_and_removed_plate(screen, tmp_path):
+    campaign = Campaign(tmp_path)
+    campaign.add_plates(screen)
+    changed = screen[screen.plate_id == 1002].copy()
+    changed['intensity_mean_EdU_nucleus'] *= 3
+    assert campaign.add_plates(changed) == ['1002']
+    campaign.remove_plate(1003)
+    assert campaign.plates == ['1001', '1002']
+    expected = per_plate_analysis(pd.concat([screen[screen.plate_id == 1001], changed]))
+    pd.testing.assert_frame_equal(campaign.proportions(), cellcycle_prop(expected))
+
+
+def test_empty_campaign(tmp_path):
+    campaign = Campaign(tmp_path)
+    assert campaign.proportions().empty and 'percent' in campaign.proportions()
+    assert campaign.well_counts().empty
+    assert list(campaign.intensities().columns) == ['plate_id', 'well', 'cell_line', 'condition']
+    assert list(campaign.cells(columns=['cell_cycle']).columns) == ['cell_cycle']
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.normalisation import (
+    assign_ccphase,
+    classify_ccphase,
+    thresholding,
+    thresholdingH3,
+)
+
+
+@pytest.fixture
+def norm_df():
+    rng = np.random.default_rng(0)
+    n = 5000
+    df = pd.DataFrame({
+        'integrated_int_DAPI_norm': rng.lognormal(np.log(2.5), 0.5, n),
+        'intensity_mean_EdU_nucleus_norm': rng.lognormal(np.log(2), 0.8, n),
+        'intensity_mean_H3P_nucleus_norm': rng.lognormal(np.log(2), 1, n),
+    })
+    # cells sitting exactly on the gate boundaries
+    edges = pd.DataFrame({
+        'integrated_int_DAPI_norm': [1.5, 1.5, 2, 3, 3, 4, 5.5, 5.5, 6, 2, 4, 4, np.nan],
+        'intensity_mean_EdU_nucleus_norm': [1, 4, 3, 3, 1, 3, 1, 4, 3, 3, 1, 1, 1],
+        'intensity_mean_H3P_nucleus_norm': [1, 1, 1, 1, 5, 1, 1, 1, 1, 1, 6, 4, 1],
+    })
+    return pd.concat([df, edges], ignore_index=True)
+
+
+@pytest.mark.parametrize("H3, row_func", [(False, thresholding), (True, thresholdingH3)])
+def test_classify_ccphase_parity(norm_df, H3, row_func):
+    detailed, _ = classify_ccphase(norm_df, H3=H3)
+    expected = norm_df.apply(row_func, axis=1)
+    assert detailed.astype(str).tolist() == expected.tolist()
+
+
+def test_classify_ccphase_unassigned_at_edu_3(norm_df):
+    detailed, _ = classify_ccphase(norm_df)
+    edu_3 = norm_df['intensity_mean_EdU_nucleus_norm'] == 3
+    dapi_above_subg1 = norm_df['integrated_int_DAPI_norm'] > 1.5
+    assert (detailed[(edu_3 & dapi_above_subg1).to_numpy()] == "Unassigned").all()
+
+
+@pytest.mark.parametrize("H3", [False, True])
+def test_assign_ccphase_categoricals(norm_df, H3):
+    data = assign_ccphase(norm_df.copy(), H3=H3)
+    assert isinstance(data['cell_cycle_detailed'].dtype, pd.CategoricalDtype)
+    assert isinstance(data['cell_cycle'].dtype, pd.CategoricalDtype)
+    expected = (
+        norm_df.apply(thresholdingH3 if H3 else thresholding, axis=1)
+        .replace(['Early S', 'Late S'], 'S')
+        .replace(["Polyploid (non-replicating)", "Polyploid (replicating)"], 'Polyploid')
+    )
+    assert data['cell_cycle'].astype(str).tolist() == expected.tolist()
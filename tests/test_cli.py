@@ -0,0 +1,85 @@
+import subprocess
+import sys
+
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+import pytest
+
+from ifanalysis import parallel
+from ifanalysis.cli import build_parser, main
+
+
+@pytest.fixture
+def screen_csv(make_export, tmp_path):
+    df = make_export(8, 3000, 40, wells=['C2', 'C3', 'C4', 'C5'], conditions=['CTR', 'CTR', 'DRUG', 'DRUG'],
+                     images_per_condition=2, p21=True)
+    path = tmp_path / 'plate.csv'
+    df.to_csv(path)
+    return path
+
+
+def test_parser():
+    args = build_parser().parse_args(['a.csv', 'b.parquet', '-c', 'CTR', 'DRUG', '--ctr', 'CTR', '-j', '2'])
+    assert [path.name for path in args.inputs] == ['a.csv', 'b.parquet']
+    assert args.conditions == ['CTR', 'DRUG'] and args.workers == 2 and args.plots and args.cyto
+
+
+def test_tables_only(screen_csv, tmp_path, capsys):
+    out = tmp_path / 'out'
+    assert main([str(screen_csv), '-c', 'CTR', 'DRUG', '--ctr', 'CTR', '-o', str(out), '--no-plots']) == 0
+    assert sorted(path.name for path in out.iterdir() if path.is_file()) == ['cellcycle_proportions.csv',
+                                                                             'counts.csv']
+    # the Parquet copy of the input is written below the output directory, not next to the input
+    assert not list(screen_csv.parent.glob('*.parquet'))
+    counts = pd.read_csv(out / 'counts.csv')
+    assert set(counts.condition) == {'CTR', 'DRUG'}
+    stderr = capsys.readouterr().err
+    assert 'cell cycle analysis done' in stderr and 'total' in stderr
+
+
+def test_profile(screen_csv, tmp_path):
+    profile = tmp_path / 'profile.json'
+    main([str(screen_csv), '-c', 'CTR', 'DRUG', '--ctr', 'CTR', '-o', str(tmp_path), '--no-plots', '-q',
+          '--profile', str(profile)])
+    records = pd.read_json(profile)
+    assert records.loc[records.depth == 0, 'stage'].tolist() == ['read', 'cell cycle analysis', 'tables']
+    assert {'agg_multinucleates', 'normalise', 'count_per_cond'} <= set(records.stage)
+
+
+def test_figures(screen_csv, tmp_path):
+    out = tmp_path / 'out'
+    main([str(screen_csv), '-c', 'CTR', 'DRUG', '--ctr', 'CTR', '-o', str(out), '-i', 'intensity_mean_p21_nucleus',
+          '-l', 'HELA', '--kind', 'density', '-q'])
+    names = {path.name for path in out.iterdir()}
+    assert {'HELA CombPlot Cell Cycle Analysis.png', 'intensity_mean_p21_nucleus, HELA.png',
+            'barplot_Cell Cycle Analysis.pdf', 'Cell Counts.pdf'} <= names
+
+
+def test_workers_with_cache(screen_csv, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    cache = tmp_path / 'cache'
+    args = [str(screen_csv), '-c', 'CTR', 'DRUG', '--ctr', 'CTR', '--no-plots', '-q', '--cache', str(cache)]
+    main(args + ['-o', str(tmp_path / 'serial')])
+    serial = pd.read_csv(tmp_path / 'serial' / 'cellcycle_proportions.csv')
+    assert len(list(cache.glob('*.parquet'))) == 1 and list((cache / 'parquet').glob('plate.*.cache.parquet'))
+    # a miss with -j runs the parallel analysis and stores the same result
+    for path in cache.glob('*.parquet'):
+        path.unlink()
+    calls = []
+    analysis = parallel.parallel_cellcycle_analysis
+
+    def counted(*args, **kwargs):
+        calls.append(kwargs)
+        return analysis(*args, **kwargs)
+
+    monkeypatch.setattr(parallel, 'parallel_cellcycle_analysis', counted)
+    main(args + ['-o', str(tmp_path / 'parallel'), '-j', '2'])
+    assert calls and calls[0]['n_workers'] == 2
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'parallel' / 'cellcycle_proportions.csv'), serial)
+    assert len(list(cache.glob('*.parquet'))) == 1
+
+
+def test_no_plotting_imports():
+    code = "import sys, ifanalysis.cli; print('matplotlib' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', code], capture_output=True, text=True).stdout.strip() == 'False'
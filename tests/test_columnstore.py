@@ -0,0 +1,123 @@
+import pickle
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.columnstore import STORE_KEYS, ColumnStore, StoreSlice, write_store
+from ifanalysis.normalisation import cellcycle_analysis
+from ifanalysis.render import COMBPLOT_COLUMNS, render_figures, report_jobs
+from ifanalysis.summary import PlateSummary
+from ifanalysis.synthetic import make_screen
+
+
+@pytest.fixture(scope='module')
+def cells():
+    return cellcycle_analysis(make_screen(20_000, n_plates=2, seed=5))
+
+
+@pytest.fixture
+def store(cells, tmp_path):
+    return write_store(cells, tmp_path / 'store')
+
+
+def test_round_trip(cells, store):
+    assert len(store) == len(cells) and store.columns == list(cells.columns)
+    df = store.frame()
+    expected = cells.sort_values(STORE_KEYS, kind='stable').reset_index(drop=True)
+    assert df.cell_cycle.dtype == cells.cell_cycle.dtype
+    pd.testing.assert_frame_equal(df.astype({col: str for col in ['experiment', 'well', 'cell_line', 'condition']}),
+                                  expected, check_dtype=False)
+
+
+def test_views(cells, store):
+    df = store.frame(['integrated_int_DAPI_norm', 'cell_cycle'], cell_line='line_1', condition='CTR')
+    assert np.shares_memory(df.integrated_int_DAPI_norm.to_numpy(), store.array('integrated_int_DAPI_norm'))
+    expected = cells.loc[(cells.condition == 'CTR') & (cells.cell_line == 'line_1'), 'integrated_int_DAPI_norm']
+    assert sorted(df.integrated_int_DAPI_norm) == sorted(expected)
+
+
+def test_slices(cells, store):
+    well = store.index.iloc[5]
+    assert store.slices(**well[STORE_KEYS].to_dict()) == [slice(well.start, well.stop)]
+    assert store.slices(plate_id=1001, cell_line='line_0', condition='CTR', well='Z99') == []
+    # CTR and cond_1 are adjacent within each cell line
+    assert len(store.slices(condition=['CTR', 'cond_1'])) == 2
+    assert len(store.slices(plate_id=1001)) > 1
+    assert len(store.frame(condition=['CTR', 'cond_1'])) == cells.condition.isin(['CTR', 'cond_1']).sum()
+    with pytest.raises(KeyError):
+        store.slices(image_id=1)
+
+
+def test_groups(cells, store):
+    groups = dict(store.groups(['cell_line', 'condition'], columns=['well']))
+    expected = cells.groupby(['cell_line', 'condition']).size()
+    assert {key: len(df) for key, df in groups.items()} == expected.to_dict()
+
+
+def test_pickle(store):
+    selection = store.select(['cell_cycle'], plate_id=1002)
+    assert isinstance(selection, StoreSlice)
+    pd.testing.assert_frame_equal(pickle.loads(pickle.dumps(selection)).load(),
+                                  store.frame(['cell_cycle'], plate_id=1002))
+    assert len(pickle.loads(pickle.dumps(store)).frame(plate_id=1002)) == len(store.frame(plate_id=1002))
+
+
+def test_report_jobs(cells, store, tmp_path):
+    jobs = report_jobs(cells, ['CTR', 'cond_1'], 'exp1', path=tmp_path, cell_lines=['line_0'], store=store.directory)
+    assert isinstance(jobs[0].kwargs['df'], StoreSlice)
+    render_figures(jobs[:1], n_workers=1)
+    assert (tmp_path / 'line_0 CombPlot exp1.png').exists()
+    assert isinstance(ColumnStore(store.directory).index, pd.DataFrame)
+
+
+def test_cell_line_is_one_range(store):
+    # the combplot jobs of report_jobs select a cell line over all plates
+    assert len(store.slices(cell_line='line_0')) == 1
+    df = store.select(COMBPLOT_COLUMNS, cell_line='line_0').load()
+    assert PlateSummary.from_frame(df, quantile_columns=()).data is df
+
+
+def test_rewrite(cells, store):
+    write_store(cells, store.directory, columns=['cell_cycle'])
+    generations = [path for path in store.directory.iterdir() if path.is_dir()]
+    assert len(generations) == 1
+    assert [path.name for path in store.directory.iterdir() if path.is_file()] == ['store.json']
+    columns = [f'col_{i}.npy' for i in range(len(STORE_KEYS) + 1)]
+    assert sorted(path.name for path in generations[0].iterdir()) == columns
+    assert ColumnStore(store.directory).columns == STORE_KEYS + ['cell_cycle']
+
+
+def test_reader_across_rewrite(cells, store):
+    before = store.frame(['integrated_int_DAPI_norm'], cell_line='line_0')
+    values = before.integrated_int_DAPI_norm.to_numpy().copy()
+    selection = store.select(['integrated_int_DAPI_norm'], cell_line='line_0')
+    # a smaller store with other values, the open reader keeps its generation
+    write_store(cells[cells.plate_id == 1002].assign(integrated_int_DAPI_norm=0.0), store.directory)
+    np.testing.assert_array_equal(before.integrated_int_DAPI_norm, values)
+    np.testing.assert_array_equal(store.frame(['integrated_int_DAPI_norm'], cell_line='line_0')
+                                  .integrated_int_DAPI_norm, values)
+    # new readers see the new store
+    assert (selection.load().integrated_int_DAPI_norm == 0).all()
+    assert len(ColumnStore(store.directory)) == (cells.plate_id == 1002).sum()
+
+
+def test_failed_rewrite_keeps_store(cells, store, monkeypatch):
+    expected = store.frame(['cell_cycle'])
+    save = np.save
+    saved = []
+
+    def failing_save(path, array):
+        if saved:
+            raise OSError("disk full")
+        saved.append(path)
+        save(path, array)
+
+    monkeypatch.setattr(np, 'save', failing_save)
+    with pytest.raises(OSError):
+        write_store(cells, store.directory)
+    monkeypatch.undo()
+    assert len([path for path in store.directory.iterdir() if path.is_dir()]) == 1
+    pd.testing.assert_frame_equal(ColumnStore(store.directory).frame(['cell_cycle']), expected)
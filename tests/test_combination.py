@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis import palb_analysis
+from ifanalysis.combination import combination_analysis, dose_matrices, fit_hill, hill, hill_inverse
+
+doses_a = np.r_[0, np.logspace(-1, 1, 6)]
+doses_b = np.r_[0, np.logspace(-2, 0, 5)]
+
+
+def screen(response, n_cell_lines=3, n_wells=2):
+    rows = [(f"line_{i}", a, b, f"W{w}", 1, 1000 * response(a, b))
+            for i in range(n_cell_lines) for a in doses_a for b in doses_b for w in range(n_wells)]
+    return pd.DataFrame(rows, columns=['cell_line', 'gwli', 'palb', 'well', 'plate_id', 'abs cell count'])
+
+
+def test_fit_hill():
+    params = np.array([[1.0, 0.1, 0.5, 1.5], [0.9, 0.3, 2.0, 0.8], [1.1, 0.0, 0.05, 3.0]])
+    doses = np.r_[0, np.logspace(-2, 1, 10)]
+    y = hill(doses[None], *(params[:, i:i + 1] for i in range(4)))
+    y[1, 3] = np.nan
+    fit = fit_hill(doses, y)
+    np.testing.assert_allclose(np.c_[fit.top, fit.bottom, fit.ic50, fit.hill], params, rtol=1e-4, atol=1e-8)
+    assert fit.converged.all() and list(fit.n_doses) == [11, 10, 11]
+    fixed = fit_hill(doses, y[:1] * 0.5, top=0.5)
+    assert fixed.top[0] == 0.5 and fixed.ic50[0] == pytest.approx(0.5, rel=1e-4)
+    too_few = fit_hill(doses[:4], y[:1, :4] + np.array([[0, 0, np.nan, 0]]))
+    assert np.isnan(too_few.ic50[0]) and not too_few.converged[0]
+    np.testing.assert_allclose(hill_inverse(hill(0.3, *params[0]), *params[0]), 0.3)
+
+
+def test_bliss_independent():
+    result = combination_analysis(screen(lambda a, b: hill(a, 1, 0.1, 1.0, 1.5) * hill(b, 1, 0.2, 0.1, 1.0)))
+    assert len(result.synergy) == 3 * 6 * 5
+    np.testing.assert_allclose(result.synergy.bliss, 0, atol=1e-9)
+    single = result.curves[result.curves.partner_dose == 0].set_index(['cell_line', 'drug'])
+    np.testing.assert_allclose(single.loc['line_0'].ic50, [1.0, 0.1], rtol=1e-3)
+    summary = result.summary()
+    assert list(summary.columns) == ['cell_line', 'ic50 gwli', 'ic50 palb', 'bliss', 'loewe']
+
+
+def test_loewe_additive():
+    # a sham combination: palb is gwli at 10 times the potency
+    result = combination_analysis(screen(lambda a, b: hill(a + 10 * b, 1, 0.1, 1.0, 1.5)), top=1)
+    np.testing.assert_allclose(result.synergy.loewe, 0, atol=1e-4)
+    assert (result.synergy.bliss < 0).mean() > 0.5
+
+
+def test_workers_and_groups():
+    df = screen(lambda a, b: hill(a, 1, 0.1, 1.0, 1.5) * hill(b, 1, 0.2, 0.1, 1.0) * 0.9 + 0.05)
+    df.loc[df.cell_line == 'line_2', 'abs cell count'] *= 3
+    result = combination_analysis(df)
+    pd.testing.assert_frame_equal(result.curves, combination_analysis(df, n_workers=2).curves)
+    # responses are relative to the untreated wells of each cell line
+    matrices = dose_matrices(df)
+    np.testing.assert_allclose(matrices.response[2], matrices.response[0])
+    assert matrices.n_wells.sum() == len(df)
+    with pytest.raises(ValueError):
+        dose_matrices(df[df.gwli > 0])
+
+
+def test_palb_counts():
+    rng = np.random.default_rng(0)
+    n = 20_000
+    cells = pd.DataFrame({'experiment': 'exp1', 'cell_line': 'RPE-1', 'gwli': rng.choice(doses_a[:4], n),
+                          'palb': rng.choice(doses_b[:4], n), 'plate_id': 1})
+    cells['well'] = cells.gwli.astype(str) + cells.palb.astype(str)
+    result = combination_analysis(palb_analysis.count_per_cond(cells))
+    assert len(result.curves) == 8 and len(result.synergy) == 9
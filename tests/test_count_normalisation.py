@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis import palb_analysis
+from ifanalysis.counts import count_per_cond, normalise_count
+
+
+@pytest.fixture
+def wells():
+    df = pd.DataFrame({
+        'plate_id': [1] * 6 + [2] * 6,
+        'cell_line': ['X', 'X', 'X', 'Y', 'Y', 'Y'] * 2,
+        'condition': ['NT', 'SCR', 'siA'] * 4,
+        'well': [f"W{i}" for i in range(12)],
+        'abs cell count': [100, 200, 50, 40, 60, 20, 300, 300, 150, 80, 80, 40],
+    })
+    # the result must follow the index, not the row order
+    return df.sample(frac=1, random_state=0).set_axis(np.arange(100, 112))
+
+
+def test_per_cell_line(wells):
+    result = normalise_count(wells, 'NT')
+    assert result.index.equals(wells.index)
+    x_ctr = np.mean([100, 300])
+    assert result[wells.index[(wells.cell_line == 'X') & (wells.well == 'W2')]].item() == pytest.approx(50 / x_ctr)
+
+
+def test_per_plate(wells):
+    result = normalise_count(wells, 'NT', by=['plate_id', 'cell_line'])
+    ctr = wells['abs cell count'].where(wells.condition == 'NT')
+    expected = wells['abs cell count'] / ctr.groupby([wells.plate_id, wells.cell_line]).transform('mean')
+    np.testing.assert_allclose(result, expected)
+    one_reference = normalise_count(wells, 'NT', by=())
+    np.testing.assert_allclose(one_reference, wells['abs cell count'] / np.mean([100, 40, 300, 80]))
+
+
+def test_several_controls(wells):
+    pooled = normalise_count(wells, ['NT', 'SCR'], by=['cell_line'])
+    x = wells.cell_line == 'X'
+    np.testing.assert_allclose(pooled[x], wells.loc[x, 'abs cell count'] / np.mean([100, 200, 300, 300]))
+    unweighted = normalise_count(wells.drop(wells.index[wells.well == 'W7']), ['NT', 'SCR'], pooled=False)
+    # X: NT mean 200, SCR only well W1 = 200; Y: NT mean 60, SCR mean 70
+    assert unweighted[wells.index[wells.well == 'W2']].item() == pytest.approx(50 / 200)
+    assert unweighted[wells.index[wells.well == 'W5']].item() == pytest.approx(20 / 65)
+
+
+def test_missing_control(wells):
+    wells = wells.drop(wells.index[(wells.plate_id == 2) & (wells.condition == 'NT')])
+    result = normalise_count(wells, 'NT', by=['plate_id', 'cell_line'])
+    assert result[wells.plate_id == 2].isna().all() and result[wells.plate_id == 1].notna().all()
+
+
+def test_count_per_cond():
+    rng = np.random.default_rng(2)
+    df = pd.DataFrame({'experiment': 'exp1', 'plate_id': rng.choice([1, 2], 2000),
+                       'cell_line': rng.choice(['X', 'Y'], 2000), 'condition': rng.choice(['NT', 'siA'], 2000)})
+    df['well'] = df.condition + df.cell_line
+    result = count_per_cond(df, 'NT', by=['plate_id', 'cell_line'])
+    assert list(result.columns) == ['cell_line', 'condition', 'well', 'plate_id', 'abs cell count', 'norm_count']
+    assert result.loc[result.condition == 'NT', 'norm_count'].eq(1).all()
+
+
+def test_palb_count_per_cond():
+    rng = np.random.default_rng(3)
+    n = 3000
+    df = pd.DataFrame({'experiment': 'exp1', 'cell_line': 'RPE-1', 'gwli': rng.choice([0.0, 1.0], n),
+                       'palb': rng.choice([0.0, 0.5], n), 'well': rng.choice(['C2', 'C3', 'C4'], n), 'plate_id': 1})
+    result = palb_analysis.count_per_cond(df)
+    ctr_mean = result[result.palb == 0.0].groupby('gwli')['abs cell count'].mean()
+    np.testing.assert_allclose(result.normalized_cell_count,
+                               result['abs cell count'] / result.gwli.map(ctr_mean) * 100)
+
+
+def test_missing_key(wells):
+    wells['cell_line'] = wells['cell_line'].astype(object)
+    missing = wells.index[wells.well == 'W3']
+    wells.loc[missing, 'cell_line'] = None
+    result = normalise_count(wells, 'NT')
+    assert np.isnan(result[missing].item())
+    # the other wells of cell line Y keep their control, well W9
+    assert result[wells.index[wells.well == 'W11']].item() == pytest.approx(40 / 80)
+    assert normalise_count(wells.iloc[:0], 'NT').empty
@@ -0,0 +1,56 @@
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pytest
+from matplotlib.figure import Figure
+
+from ifanalysis.density import bin_edges, data_range, draw_density, histogram2d, phase_image
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(4)
+    n = 20000
+    return rng.lognormal(1, 0.5, n), rng.lognormal(0.5, 0.8, n), rng.integers(0, 3, n)
+
+
+@pytest.mark.parametrize("log", [(True, True), (True, False)])
+def test_histogram2d_matches_numpy(points, log):
+    x, y, _ = points
+    x_range, y_range = (1, 16), (0.5, 8)
+    counts = histogram2d(x, y, x_range, y_range, bins=(50, 40), log=log)
+    expected, _, _ = np.histogram2d(x, y, bins=[bin_edges(x_range, 50, log[0]), bin_edges(y_range, 40, log[1])])
+    # np.histogram2d edges computed in linear space can differ by one bin for values on a log edge
+    assert abs(counts[0].sum() - expected.sum()) <= 2
+    assert np.abs(counts[0] - expected.T).sum() <= 4
+
+
+def test_histogram2d_groups(points):
+    x, y, groups = points
+    by_group = histogram2d(x, y, (1, 16), (0.5, 8), groups=groups, n_groups=3)
+    assert by_group.shape == (3,) + histogram2d(x, y, (1, 16), (0.5, 8)).shape[1:]
+    np.testing.assert_array_equal(by_group.sum(axis=0), histogram2d(x, y, (1, 16), (0.5, 8))[0])
+    np.testing.assert_array_equal(by_group[1], histogram2d(x[groups == 1], y[groups == 1], (1, 16), (0.5, 8))[0])
+
+
+def test_out_of_range_and_invalid_values_are_dropped():
+    counts = histogram2d([0.5, -1, np.nan, 2, 16], [1, 1, 1, np.inf, 1], (1, 16), (0.5, 8), bins=(4, 4))
+    assert counts.sum() == 1
+    assert counts[0, 1, 3] == 1  # the upper edge falls in the last bin
+
+
+def test_phase_image_colours_dominant_group():
+    counts = np.zeros((2, 1, 3), dtype=int)
+    counts[0, 0, 0], counts[1, 0, 0], counts[1, 0, 1] = 5, 1, 10
+    rgba = phase_image(counts, ['red', 'blue'])
+    np.testing.assert_array_equal(rgba[0, 0, :3], [1, 0, 0])
+    np.testing.assert_array_equal(rgba[0, 1, :3], [0, 0, 1])
+    assert rgba[0, 2, 3] == 0 and rgba[0, 1, 3] == 1
+
+
+def test_draw_density_single_artist(points):
+    x, y, groups = points
+    ax = Figure().add_subplot()
+    draw_density(ax, x, y, data_range(x), data_range(y), groups=groups, colors=['C0', 'C1', 'C2'])
+    draw_density(ax, x, y, data_range(x), data_range(y, log=False), log=(True, False))
+    assert len(ax.collections) == 2 and not ax.lines
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.gating import (
+    DAPI_col,
+    EdU_col,
+    H3_GATES,
+    STANDARD_GATES,
+    GatingModel,
+    PhaseGate,
+)
+from ifanalysis.normalisation import thresholding
+
+
+@pytest.fixture
+def norm_df():
+    rng = np.random.default_rng(1)
+    n = 2000
+    return pd.DataFrame({
+        DAPI_col: np.append(rng.lognormal(np.log(2.5), 0.5, n), [1.5, 3, 5.5, 2]),
+        EdU_col: np.append(rng.lognormal(np.log(2), 0.8, n), [1, 2.5, 2.5, 2.5]),
+        'intensity_mean_H3P_nucleus_norm': np.append(rng.lognormal(np.log(2), 1, n), [1, 1, 1, 1]),
+    })
+
+
+def test_preset_categories():
+    assert STANDARD_GATES.categories[-1] == "Unassigned"
+    assert STANDARD_GATES.summary_categories == ["Sub-G1", "G1", "S", "G2/M", "Polyploid", "Unassigned"]
+    assert H3_GATES.channels == [DAPI_col, EdU_col, 'intensity_mean_H3P_nucleus_norm']
+
+
+def test_with_thresholds(norm_df):
+    gates = STANDARD_GATES.with_thresholds(EdU_col, {3: 2.5})
+    detailed, _ = gates.classify(norm_df)
+    shifted = norm_df.assign(**{EdU_col: norm_df[EdU_col] + 0.5})
+    expected = shifted.apply(thresholding, axis=1)
+    assert detailed.astype(str).tolist() == expected.tolist()
+    # the preset is left untouched
+    assert STANDARD_GATES.gates[1].bounds[EdU_col].right == 3
+
+
+def test_custom_model_first_match_and_missing():
+    gates = GatingModel(gates=(
+        PhaseGate("low", {"a": pd.Interval(-np.inf, 1, closed='right')}),
+        PhaseGate("low-b", {"b": pd.Interval(-np.inf, 1, closed='right')}, summary="low"),
+    ), default="other")
+    data = pd.DataFrame({"a": [0.5, 1, 2, 2, np.nan], "b": [0.5, 2, 1, 2, 0.5]})
+    detailed, summary = gates.classify(data)
+    assert detailed.tolist() == ["low", "low", "low-b", "other", "low-b"]
+    assert summary.tolist() == ["low", "low", "low", "other", "low"]
+
+
+def test_apply_relabels_in_place(norm_df):
+    data = STANDARD_GATES.apply(norm_df)
+    assert data is norm_df
+    assert set(data["cell_cycle"].cat.categories) == set(STANDARD_GATES.summary_categories)
@@ -0,0 +1,50 @@
+import importlib
+import subprocess
+import sys
+
+import pytest
+
+from ifanalysis._helper_functions import style_colors
+
+NUMERIC_MODULES = ['normalisation', 'statistics', 'io', 'summary', 'cache', 'campaign', 'parallel', 'streaming',
+                   'kde', 'density', 'gating', 'modes', 'cli', 'render']
+PLOTTING_MODULES = ['counts', 'cellcycle', 'combplot', 'intensity', 'sl_analysis', 'palb_analysis']
+
+
+def import_times(statement: str) -> dict:
+    """
+    Cumulative import time in microseconds of every module imported by statement, from python -X importtime
+    """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True,
+                            check=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_without_plotting_libraries():
+    modules = [f"ifanalysis.{module}" for module in NUMERIC_MODULES + PLOTTING_MODULES]
+    times = import_times(f"import {', '.join(modules)}")
+    assert set(modules) <= set(times)
+    assert not {'matplotlib', 'seaborn'} & set(times)
+
+
+def test_numeric_import_without_scipy():
+    assert 'scipy' not in import_times("import ifanalysis.normalisation, ifanalysis.statistics, ifanalysis.summary")
+
+
+def test_plotting_libraries_load_on_use():
+    times = import_times("import ifanalysis.combplot as c; c.colors")
+    assert 'matplotlib.pyplot' in times
+
+
+def test_colors_of_plotting_modules():
+    for module in PLOTTING_MODULES:
+        module = importlib.import_module(f"ifanalysis.{module}")
+        assert module.colors == style_colors()
+        with pytest.raises(AttributeError, match=module.__name__):
+            module.missing
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.io import analysis_columns, cache_path, downcast, read_screen
+from ifanalysis.normalisation import cellcycle_analysis
+from ifanalysis.synthetic import make_screen
+
+
+@pytest.fixture
+def screen_csv(make_export, tmp_path):
+    df = make_export(0, 500, 10, p21=True)
+    path = tmp_path / 'plate.csv'
+    df.to_csv(path)
+    return path, df
+
+
+def test_analysis_columns():
+    assert analysis_columns() is None
+    assert analysis_columns('counts', ['area_cell'])[-1] == 'area_cell'
+    with pytest.raises(ValueError):
+        analysis_columns('violins')
+
+
+def test_downcast():
+    df = downcast(pd.DataFrame({'cell_line': ['A', 'B'], 'x': [1.0, 2.0], 'image_id': [1, 2],
+                                'integrated_int_DAPI': [1.0, 2.0], 'integrated_int_p21': [1.0, 2.0]}))
+    assert df['cell_line'].dtype == 'category'
+    assert df['x'].dtype == np.float32
+    assert (df['integrated_int_DAPI'].dtype, df['integrated_int_p21'].dtype) == (np.float64, np.float64)
+    assert df['image_id'].dtype == np.int8
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_read_screen_csv(screen_csv, cache):
+    if cache:
+        pytest.importorskip('pyarrow')
+    path, expected = screen_csv
+    df = read_screen(path, analysis='cellcycle', cache=cache)
+    assert 'intensity_mean_p21_nucleus' not in df
+    assert 'Unnamed: 0' not in df
+    assert df['condition'].dtype == 'category'
+    assert df['intensity_mean_EdU_nucleus'].dtype == np.float32
+    np.testing.assert_array_equal(df['integrated_int_DAPI'], expected['integrated_int_DAPI'])
+    assert cache_path(path).exists() == cache
+
+
+@pytest.mark.parametrize("H3", [False, True])
+def test_downcast_cellcycle_parity(H3):
+    df = make_screen(20000, H3=H3, seed=1)
+    expected = cellcycle_analysis(df, H3=H3)
+    result = cellcycle_analysis(downcast(df.copy()), H3=H3)
+    assert result['cell_cycle'].astype(str).tolist() == expected['cell_cycle'].astype(str).tolist()
+    np.testing.assert_array_equal(result['integrated_int_DAPI_norm'], expected['integrated_int_DAPI_norm'])
+    np.testing.assert_allclose(result['intensity_mean_EdU_nucleus_norm'],
+                               expected['intensity_mean_EdU_nucleus_norm'], rtol=1e-6)
+
+
+def test_read_screen_from_cache(screen_csv):
+    pytest.importorskip('pyarrow')
+    path, expected = screen_csv
+    read_screen(path)
+    df = read_screen(path, analysis='counts', columns=['intensity_mean_p21_nucleus'])
+    assert df.columns.tolist() == ['experiment', 'plate_id', 'well', 'cell_line', 'condition',
+                                   'intensity_mean_p21_nucleus']
+    assert df['well'].astype(str).tolist() == expected['well'].tolist()
+    full = read_screen(path, downcast_types=False)
+    assert full['integrated_int_DAPI'].dtype == np.float64
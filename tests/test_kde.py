@@ -0,0 +1,67 @@
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+import pytest
+from matplotlib.figure import Figure
+
+from ifanalysis import kde
+from ifanalysis.combplot import kde_key
+from ifanalysis.kde import binned_kde2d, cached_kde2d, iso_proportion_levels
+
+
+@pytest.fixture
+def cells():
+    rng = np.random.default_rng(5)
+    n = 1500
+    dna = np.concatenate([rng.lognormal(np.log(2), 0.15, n), rng.lognormal(np.log(4), 0.1, n // 3)])
+    edu = np.concatenate([rng.lognormal(0, 0.6, n), rng.lognormal(1.5, 0.3, n // 3)]) * dna ** 0.3
+    return dna, edu
+
+
+def test_binned_kde_matches_gaussian_kde(cells):
+    stats = pytest.importorskip("scipy.stats")
+    dna, edu = cells
+    grid = binned_kde2d(dna, edu)
+    xx, yy = np.meshgrid(np.log(grid.x), np.log(grid.y))
+    exact = stats.gaussian_kde(np.log([dna, edu]))([xx.ravel(), yy.ravel()]).reshape(xx.shape)
+    assert np.abs(grid.density - exact).max() < 0.01 * exact.max()
+    exact_levels = iso_proportion_levels(exact, np.linspace(0.05, 1, 10))
+    np.testing.assert_allclose(grid.levels(), exact_levels, rtol=0.02)
+
+
+def test_levels_match_seaborn_kdeplot(cells):
+    sns = pytest.importorskip("seaborn")
+    dna, edu = cells
+    ax = Figure().add_subplot()
+    ax.set_xscale('log')
+    ax.set_yscale('log', base=2)
+    contours = sns.kdeplot(x=dna, y=edu, fill=True, ax=ax).collections[-1]
+    grid = binned_kde2d(dna, edu)
+    # seaborn's density is per log10/log2 unit, compare levels relative to the peak
+    np.testing.assert_allclose(grid.levels() / grid.density.max(), contours.levels / contours.zmax, rtol=0.02)
+
+
+def test_singular_data_returns_none():
+    assert binned_kde2d([1, 2], [1, 2]) is None
+    assert binned_kde2d(np.ones(10), np.arange(1, 11)) is None
+
+
+def test_cache_per_key(cells):
+    dna, edu = cells
+    kde.clear_kde_cache()
+    first = cached_kde2d(('HELA', 'CTR'), dna, edu)
+    assert cached_kde2d(('HELA', 'CTR'), dna, edu) is first
+    changed = cached_kde2d(('HELA', 'CTR'), dna[:-1], edu[:-1])
+    assert changed is not first
+    assert len(kde._kde_cache) == 1
+    # same number of points and same sums, different data
+    swapped = cached_kde2d(('HELA', 'CTR'), dna, edu[::-1])
+    assert swapped is not changed
+
+
+def test_kde_key_scopes_plates():
+    plate = pd.DataFrame({'experiment': 'exp1', 'plate_id': [1001, 1001]})
+    assert kde_key(plate, 'HELA', 'CTR') == kde_key(plate.copy(), 'HELA', 'CTR')
+    assert kde_key(plate, 'HELA', 'CTR') != kde_key(plate.assign(plate_id=1002), 'HELA', 'CTR')
+    assert kde_key(plate, 'HELA', 'CTR') != kde_key(plate.assign(experiment='exp2'), 'HELA', 'CTR')
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.modes import (
+    MODE_ESTIMATORS,
+    bincount_mode,
+    get_mode_estimator,
+    histogram_mode,
+)
+from ifanalysis.normalisation import normalise
+
+
+@pytest.fixture
+def dapi():
+    # 2N peak at 1e6 with 60 % of cells, 4N peak at 2e6
+    rng = np.random.default_rng(0)
+    return np.concatenate([rng.normal(1e6, 5e4, 60000), rng.normal(2e6, 1e5, 40000)])
+
+
+def test_histogram_mode_matches_legacy(dapi):
+    y, x = np.histogram(dapi, bins=10000)
+    assert histogram_mode(dapi) == x[np.where(y == np.max(y))][0]
+
+
+@pytest.mark.parametrize("method", list(MODE_ESTIMATORS))
+def test_estimators_find_g1_peak(dapi, method):
+    kwargs = {} if method == 'bincount' else {'max_samples': 50000}
+    mode = get_mode_estimator(method)(dapi, **kwargs)
+    assert abs(mode - 1e6) < 5e4
+
+
+@pytest.mark.parametrize("method", list(MODE_ESTIMATORS))
+def test_estimators_reproducible_with_seed(dapi, method):
+    estimator = get_mode_estimator(method)
+    assert estimator(dapi, max_samples=1000, seed=3) == estimator(dapi, max_samples=1000, seed=3)
+
+
+def test_bincount_mode_integer_data():
+    values = np.array([3, 5, 5, 7, 7, 7, 9, np.nan])
+    assert bincount_mode(values, bin_width=1) == 7
+
+
+def test_unknown_mode_method():
+    with pytest.raises(ValueError):
+        get_mode_estimator('median')
+
+
+def test_normalise_with_mode_method(dapi):
+    df = pd.DataFrame({'cell_line': 'A', 'integrated_int_DAPI': dapi})
+    df_norm = normalise(df, ['integrated_int_DAPI'], mode='kde', mode_kwargs={'max_samples': 5000})
+    assert df_norm['integrated_int_DAPI_norm'].median() == pytest.approx(1.0, abs=0.1)
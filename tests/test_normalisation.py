@@ -1,7 +1,10 @@
 import ifanalysis
+import ifanalysis.normalisation
+import numpy as np
 import pandas as pd
 import pytest
 import pandas
+from ifanalysis.normalisation import normalise
 @pytest.fixture()
 def data():
     return pd.read_csv('../data/Test_Data.csv', index_col =0)
@@ -27,3 +30,130 @@ def test_agg_multinucleates_mean(data, column, result):
     assert df[column].mean() == result
 
 
+
+
+@pytest.fixture()
+def intensity_data():
+    rng = np.random.default_rng(0)
+    n = 3000
+    return pd.DataFrame({
+        'cell_line': rng.choice(['A', 'B', 'C'], n),
+        'integrated_int_DAPI': rng.normal(1e6, 1e5, n),
+        'intensity_mean_EdU_nucleus': rng.lognormal(6, 0.8, n),
+    })
+
+
+def test_normalise_matches_per_cell_line_histogram(intensity_data):
+    values = ['integrated_int_DAPI', 'intensity_mean_EdU_nucleus']
+    df = normalise(intensity_data, values)
+    for cell_line, group in intensity_data.groupby('cell_line'):
+        for value in values:
+            y, x = np.histogram(group[value], bins=10000)
+            expected = group[value] / x[np.where(y == np.max(y))][0]
+            pd.testing.assert_series_equal(df.loc[group.index, f"{value}_norm"], expected, check_names=False)
+    assert df.index.equals(intensity_data.index)
+    assert 'integrated_int_DAPI_norm' not in intensity_data
+
+
+def test_normalise_inplace(intensity_data):
+    df = normalise(intensity_data, ['integrated_int_DAPI'], inplace=True)
+    assert df is intensity_data
+    assert 'integrated_int_DAPI_norm' in intensity_data
+
+
+@pytest.fixture()
+def agg_data():
+    rng = np.random.default_rng(0)
+    n = 2000
+    df = pd.DataFrame({
+        'experiment': 'exp1',
+        'well': rng.choice(['C2', 'C3'], n),
+        'cell_line': rng.choice(['A', 'B'], n),
+        'condition': rng.choice(['CTR', 'DRUG'], n),
+        'image_id': rng.integers(0, 50, n),
+        'Cyto_ID': np.arange(n),
+        'integrated_int_DAPI': rng.normal(1e6, 1e5, n),
+    })
+    # duplicated rows spread over the images
+    return pd.concat([df, df.sample(300, random_state=0)]).sample(frac=1, random_state=1)
+
+
+def legacy_delete_duplicates(df):
+    temp_data = pd.DataFrame()
+    for image in df["image_id"].unique():
+        image_data = df.loc[df.image_id == image].drop_duplicates()
+        temp_data = pd.concat([temp_data, image_data])
+    return temp_data
+
+
+@pytest.mark.parametrize("keys_only", [False, True])
+def test_delete_duplicates_matches_per_image_loop(agg_data, keys_only):
+    expected = legacy_delete_duplicates(agg_data)
+    df = ifanalysis.normalisation.delete_duplicates(agg_data, keys_only=keys_only)
+    pd.testing.assert_frame_equal(df.sort_index(), expected.sort_index())
+    assert len(df) == 2000
+
+
+@pytest.fixture()
+def multinucleate_data():
+    rng = np.random.default_rng(0)
+    n = 3000
+    image = rng.integers(0, 40, n)
+    return pd.DataFrame({
+        'experiment': 'exp1',
+        'well': np.array(['C2', 'C3', 'D2', 'D3'])[image % 4],
+        'cell_line': np.array(['A', 'B'])[image % 2],
+        'condition': np.array(['CTR', 'DRUG'])[(image // 4) % 2],
+        'plate_id': 1,
+        'image_id': image,
+        'Cyto_ID': rng.integers(0, 40, n),
+        'integrated_int_DAPI': rng.normal(1e6, 1e5, n),
+        'intensity_max_DAPI_nucleus': rng.normal(3e4, 1e3, n),
+        'intensity_min_DAPI_nucleus': rng.normal(1e3, 1e2, n),
+        'intensity_mean_DAPI_nucleus': rng.normal(1e4, 1e3, n),
+        'area_nucleus': rng.normal(150, 20, n),
+    })
+
+
+def legacy_agg_multinucleates(df):
+    str_cols = ['experiment', 'well', 'cell_line', 'condition']
+    agg_functions = {'plate_id': 'mean', 'integrated_int_DAPI': 'sum', 'intensity_max_DAPI_nucleus': 'max',
+                     'intensity_min_DAPI_nucleus': 'min', 'intensity_mean_DAPI_nucleus': 'mean',
+                     'area_nucleus': 'sum'}
+    return df.groupby(str_cols + ['image_id', 'Cyto_ID'], as_index=False).agg(agg_functions)
+
+
+def test_agg_multinucleates_matches_groupby(multinucleate_data):
+    df = ifanalysis.normalisation.agg_multinucleates(multinucleate_data)
+    expected = legacy_agg_multinucleates(multinucleate_data)
+    # same columns in the same order: keys first, then the aggregated values
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+
+def test_agg_multinucleates_categorical_keys(multinucleate_data):
+    categorical = multinucleate_data.astype({'well': 'category', 'cell_line': 'category', 'condition': 'category'})
+    df = ifanalysis.normalisation.agg_multinucleates(categorical)
+    expected = ifanalysis.normalisation.agg_multinucleates(multinucleate_data)
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False, check_categorical=False)
+
+
+def test_agg_multinucleates_custom_rules(multinucleate_data):
+    df = ifanalysis.normalisation.agg_multinucleates(multinucleate_data, agg_rules={'area_nucleus': 'max'})
+    expected = multinucleate_data.groupby(['image_id', 'Cyto_ID'])['area_nucleus'].max()
+    assert df.set_index(['image_id', 'Cyto_ID'])['area_nucleus'].sort_index().equals(expected)
+
+
+def test_agg_multinucleates_fallback_rules(multinucleate_data):
+    # median is not reduced with reduceat but by the pandas groupby fallback
+    df = ifanalysis.normalisation.agg_multinucleates(multinucleate_data, agg_rules={'area_nucleus': 'median'})
+    keys = ['experiment', 'well', 'cell_line', 'condition', 'image_id', 'Cyto_ID']
+    expected = multinucleate_data.groupby(keys)['area_nucleus'].median()
+    np.testing.assert_array_equal(df['area_nucleus'], expected.to_numpy())
+
+
+def test_normalise_categorical_cell_line(intensity_data):
+    values = ['integrated_int_DAPI']
+    categorical = intensity_data.astype({'cell_line': pd.CategoricalDtype(['A', 'B', 'C', 'D'])})
+    df = normalise(categorical, values)
+    pd.testing.assert_series_equal(df['integrated_int_DAPI_norm'],
+                                   normalise(intensity_data, values)['integrated_int_DAPI_norm'])
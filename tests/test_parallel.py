@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.gating import EdU_col, H3_GATES, STANDARD_GATES
+from ifanalysis.normalisation import cellcycle_analysis
+from ifanalysis.parallel import parallel_cellcycle_analysis
+
+
+@pytest.fixture
+def screen(make_export):
+    return make_export(2, 4000, 40, images_per_plate=20, cell_lines=['HELA', 'RPE-1', 'U2OS'], H3=True)
+
+
+@pytest.mark.parametrize("H3", [False, True])
+@pytest.mark.parametrize("n_workers,partition_by", [(1, 'cell_line'), (2, 'cell_line'), (2, ['plate_id', 'cell_line'])])
+def test_parallel_matches_serial(screen, H3, n_workers, partition_by):
+    expected = cellcycle_analysis(screen, H3=H3)
+    result = parallel_cellcycle_analysis(screen, H3=H3, n_workers=n_workers, partition_by=partition_by)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_parallel_custom_gates_and_mode(screen):
+    gates = STANDARD_GATES.with_thresholds(EdU_col, {3: 2.5})
+    expected = cellcycle_analysis(screen, gates=gates, mode='log_histogram')
+    result = parallel_cellcycle_analysis(screen, gates=gates, mode='log_histogram', n_workers=2)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_parallel_rejects_unnormalised_gates(screen):
+    with pytest.raises(ValueError):
+        parallel_cellcycle_analysis(screen, H3=False, gates=H3_GATES)
+
+
+@pytest.mark.parametrize("cyto", [True, False])
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_parallel_missing_cell_line(screen, cyto, n_workers):
+    screen.loc[::50, 'cell_line'] = np.nan
+    expected = cellcycle_analysis(screen, cyto=cyto)
+    result = parallel_cellcycle_analysis(screen, cyto=cyto, n_workers=n_workers,
+                                         partition_by=['plate_id', 'well', 'cell_line'])
+    pd.testing.assert_frame_equal(result, expected)
+    if not cyto:
+        assert result.loc[result.cell_line.isna(), 'cell_cycle'].eq('Unassigned').all()
@@ -0,0 +1,76 @@
+import json
+import logging
+
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+import pytest
+
+from ifanalysis.counts import count_per_cond
+from ifanalysis.normalisation import cellcycle_analysis
+from ifanalysis.profiling import Recorder, StageRecord, current_recorder, profiled, stage
+from ifanalysis.render import render_figures, report_jobs
+from ifanalysis.synthetic import make_screen
+
+
+@pytest.fixture(scope='module')
+def screen():
+    return make_screen(20_000, markers=())
+
+
+def test_cellcycle_analysis_stages(screen):
+    records = []
+    with Recorder(callbacks=[records.append]) as recorder:
+        cells = cellcycle_analysis(screen)
+        count_per_cond(cells, 'CTR')
+    assert current_recorder() is None
+    assert records == recorder.records
+    df = recorder.to_frame().set_index('stage')
+    assert list(df.index) == ['agg_multinucleates', 'delete_duplicates', 'cell_line_modes', 'normalise',
+                              'assign_ccphase', 'cellcycle_analysis', 'normalise_count', 'count_per_cond']
+    assert df.loc['agg_multinucleates', 'rows_in'] == len(screen)
+    assert df.loc['agg_multinucleates', 'rows_out'] == df.loc['cellcycle_analysis', 'rows_out'] == len(cells)
+    assert df.loc['cell_line_modes', 'depth'] == 2 and df.loc['count_per_cond', 'depth'] == 0
+    # an enclosing stage covers the time and peak memory of its steps
+    steps = df.loc[df.depth == 1].iloc[:4]
+    assert df.loc['cellcycle_analysis', 'seconds'] >= steps.seconds.sum()
+    assert df.loc['cellcycle_analysis', 'peak_mib'] >= steps.peak_mib.max() > 0
+    assert json.loads(recorder.to_json())[0]['stage'] == 'agg_multinucleates'
+
+
+def test_without_recorder():
+    calls = []
+
+    @profiled(detail='label')
+    def func(df, label):
+        calls.append(label)
+        return df
+
+    df = pd.DataFrame({'a': range(3)})
+    assert func(df, 'x') is df
+    with stage('outside') as record:
+        record.rows_out = 3
+    with Recorder(memory=False) as recorder:
+        func(df, label='y')
+        with stage('block', rows_in=1):
+            pass
+    assert recorder.records == [StageRecord('func', recorder.records[0].seconds, 3, 3, None, 'y', 0,
+                                            recorder.records[0].start),
+                                StageRecord('block', recorder.records[1].seconds, 1, None, None, '', 0,
+                                            recorder.records[1].start)]
+    assert calls == ['x', 'y']
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_render_stages(screen, tmp_path, caplog, n_workers):
+    cells = cellcycle_analysis(screen)
+    jobs = report_jobs(cells, ['CTR', 'cond_1'], 'exp1', path=tmp_path, cell_lines=['line_0'], ctr_cond='CTR')
+    with caplog.at_level(logging.INFO, logger='ifanalysis'), Recorder(memory=False) as recorder:
+        render_figures(jobs, n_workers=n_workers)
+    df = recorder.to_frame()
+    # stages of the worker processes are returned to the recorder
+    assert sorted(df.loc[df.stage == 'render', 'detail']) == sorted(job.name for job in jobs)
+    assert {'combplot', 'count_plots', 'cellcycle_barplot', 'save_fig'} <= set(df.stage)
+    assert df.peak_mib.isna().all()
+    if n_workers == 1:
+        assert "Saving figure line_0 CombPlot exp1" in caplog.messages
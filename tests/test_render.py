@@ -0,0 +1,50 @@
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.render import render_figures, report_jobs
+
+
+@pytest.fixture
+def cellcycle_df():
+    rng = np.random.default_rng(3)
+    n = 1200
+    phases = np.array(['Sub-G1', 'G1', 'S', 'G2/M', 'Polyploid'])
+    return pd.DataFrame({
+        'experiment': 'exp1',
+        'plate_id': 1001,
+        'well': rng.choice(['C2', 'C3', 'C4', 'C5'], n),
+        'cell_line': rng.choice(['HELA', 'RPE-1'], n),
+        'condition': rng.choice(['CTR', 'DRUG'], n),
+        'cell_cycle': phases[np.arange(n) % len(phases)],
+        'integrated_int_DAPI_norm': rng.lognormal(np.log(2.5), 0.4, n),
+        'intensity_mean_EdU_nucleus_norm': rng.lognormal(np.log(2), 0.8, n),
+        'intensity_mean_p21_nucleus': rng.lognormal(6, 0.5, n),
+    })
+
+
+def test_report_jobs_carry_subsets(cellcycle_df, tmp_path):
+    jobs = report_jobs(cellcycle_df, ['CTR', 'DRUG'], 'exp1', path=tmp_path,
+                       intensity_cols=['intensity_mean_p21_nucleus', 'integrated_int_DAPI_norm'])
+    assert [job.name for job in jobs][:3] == ['combplot(HELA)', 'int_combplot(HELA, intensity_mean_p21_nucleus)',
+                                             'int_combplot(HELA, integrated_int_DAPI_norm)']
+    assert len({job.name for job in jobs}) == len(jobs)
+    combplot_df = jobs[0].kwargs['df']
+    assert set(combplot_df.cell_line) == {'HELA'}
+    assert 'intensity_mean_p21_nucleus' not in combplot_df.columns
+
+
+@pytest.mark.parametrize("n_workers,kind", [(1, 'scatter'), (2, 'scatter'), (2, 'density')])
+def test_render_figures(cellcycle_df, tmp_path, n_workers, kind):
+    jobs = report_jobs(cellcycle_df, ['CTR', 'DRUG'], 'exp1', path=tmp_path, ctr_cond='CTR', kind=kind)
+    names = render_figures(jobs, n_workers=n_workers)
+    assert len(names) == len(jobs)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'Cell Counts.pdf', 'HELA CombPlot exp1.png', 'RPE-1 CombPlot exp1.png', 'barplot_exp1.pdf'
+    ]
+    # rendered without pyplot figure managers
+    assert plt.get_fignums() == []
+
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import false_discovery_control, ttest_ind
+
+from ifanalysis.statistics import (compare_intensity, compare_to_control, p_adjust, pivot_replicates, t_test_cc,
+                                   t_test_cc_percond)
+
+
+@pytest.fixture
+def prop_df():
+    rng = np.random.default_rng(7)
+    rows = []
+    for cell_line in ['HELA', 'RPE-1']:
+        for condition, n_wells in [('SCR', 4), ('DRUG', 3), ('DRUG2', 1)]:
+            for well in range(n_wells):
+                for phase in ['G1', 'S', 'G2/M', 'Polyploid', 'Sub-G1']:
+                    rows.append(dict(cell_line=cell_line, condition=condition, well=f"C{well}", plate_id=1001,
+                                     cell_cycle=phase, percent=rng.uniform(0, 50)))
+    # shuffled, so the tests must not rely on the row order
+    return pd.DataFrame(rows).sample(frac=1, random_state=1)
+
+
+def test_pivot_replicates(prop_df):
+    labels, phases, array = pivot_replicates(prop_df, ['condition'])
+    assert labels.condition.to_list() == ['DRUG', 'DRUG2', 'SCR']
+    assert phases == sorted(prop_df.cell_cycle.unique())
+    assert array.shape == (3, 5, 8)
+    assert np.sum(~np.isnan(array[1])) == 10
+    assert np.nansum(array) == pytest.approx(prop_df.percent.sum())
+
+
+@pytest.mark.parametrize("equal_var", [True, False])
+def test_compare_to_control_matches_scipy(prop_df, equal_var):
+    result = compare_to_control(prop_df, 'SCR', per_cell_line=True, equal_var=equal_var)
+    assert len(result) == 30
+    for row in result.itertuples():
+        in_line = (prop_df.cell_line == row.cell_line) & (prop_df.cell_cycle == row.cell_cycle)
+        ctr = prop_df.loc[in_line & (prop_df.condition == 'SCR'), 'percent']
+        cond = prop_df.loc[in_line & (prop_df.condition == row.condition), 'percent']
+        t, p = ttest_ind(ctr, cond, equal_var=equal_var)
+        assert row.t == pytest.approx(t, nan_ok=True)
+        assert row.p_value == pytest.approx(p, nan_ok=True)
+    # single replicate of DRUG2: only Student's t-test is defined
+    assert result.loc[result.condition == 'DRUG2', 'p_value'].isna().all() != equal_var
+    assert result.loc[result.condition == 'SCR', 'p_adj'].isna().all()
+
+
+def test_t_test_cc_percond(prop_df):
+    result = t_test_cc_percond(prop_df, 'SCR')
+    for row in result.itertuples():
+        assert row.p_value == pytest.approx(t_test_cc(prop_df, row.condition, row.cell_cycle, 'SCR'), nan_ok=True)
+
+
+def test_counts():
+    df_count = pd.DataFrame({'cell_line': 'HELA', 'condition': ['SCR'] * 3 + ['DRUG'] * 3,
+                             'well': list('ABCDEF'), 'plate_id': 1, 'norm_count': [1, 1.1, 0.9, 0.5, 0.6, 0.4]})
+    result = compare_to_control(df_count, 'SCR', value='norm_count', phase=None, per_cell_line=True)
+    assert result.condition.to_list() == ['DRUG', 'SCR']
+    assert result.p_value[0] == pytest.approx(ttest_ind([1, 1.1, 0.9], [0.5, 0.6, 0.4]).pvalue)
+
+
+def test_p_adjust():
+    p = np.array([0.01, 0.04, np.nan, 0.03, 0.2])
+    np.testing.assert_allclose(p_adjust(p)[[0, 1, 3, 4]], false_discovery_control(p[[0, 1, 3, 4]]))
+    np.testing.assert_allclose(p_adjust(p, 'bonferroni'), [0.04, 0.16, np.nan, 0.12, 0.8])
+    np.testing.assert_allclose(p_adjust(p, 'holm'), [0.04, 0.09, np.nan, 0.09, 0.2])
+    with pytest.raises(ValueError):
+        p_adjust(p, 'sidak')
+
+
+@pytest.fixture
+def cells_df():
+    rng = np.random.default_rng(11)
+    n = 6000
+    df = pd.DataFrame({'cell_line': rng.choice(['HELA', 'RPE-1'], n), 'condition': rng.choice(['CTR', 'DRUG', 'SAME'], n),
+                       'cell_cycle': rng.choice(['G1', 'S', 'G2/M'], n), 'p21': rng.normal(100, 10, n)})
+    df.loc[df.condition == 'DRUG', 'p21'] += 5
+    return df
+
+
+def test_compare_intensity(cells_df):
+    result = compare_intensity(cells_df, 'p21', 'CTR', n_resamples=200)
+    assert result.condition.to_list() == ['DRUG', 'SAME']
+    drug, same = result.iloc[0], result.iloc[1]
+    assert drug.ci_low < 5 < drug.ci_high
+    assert drug.cohens_d == pytest.approx(0.5, abs=0.1)
+    assert drug.p_value == pytest.approx(1 / 201)
+    assert same.p_value > 0.05
+    assert drug.n_ctr == (cells_df.condition == 'CTR').sum()
+
+
+def test_compare_intensity_groups(cells_df):
+    result = compare_intensity(cells_df, 'p21', 'CTR', phases=['G1', 'S'], per_cell_line=True, statistic='median',
+                               method='bootstrap', n_resamples=100)
+    assert list(result.columns[:3]) == ['cell_line', 'cell_cycle', 'condition']
+    assert len(result) == 8
+    first = cells_df[(cells_df.cell_line == 'HELA') & (cells_df.cell_cycle == 'G1')]
+    assert result.difference[0] == pytest.approx(first.loc[first.condition == 'DRUG', 'p21'].median()
+                                                 - first.loc[first.condition == 'CTR', 'p21'].median())
+
+
+def test_compare_intensity_reproducible(cells_df):
+    result = compare_intensity(cells_df, 'p21', 'CTR', per_cell_line=True, n_resamples=50, seed=3)
+    pd.testing.assert_frame_equal(result, compare_intensity(cells_df, 'p21', 'CTR', per_cell_line=True,
+                                                            n_resamples=50, seed=3, chunk=5000, n_workers=2))
+    assert not result.equals(compare_intensity(cells_df, 'p21', 'CTR', per_cell_line=True, n_resamples=50, seed=4))
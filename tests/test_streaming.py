@@ -0,0 +1,66 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from ifanalysis.io import iter_screen_chunks
+from ifanalysis.normalisation import cellcycle_analysis, cellcycle_prop
+from ifanalysis.streaming import stream_cellcycle_analysis
+
+
+@pytest.fixture
+def screen(make_export):
+    return make_export(1, 6000, 60, images_per_plate=30, wells=['C2', 'C3', 'C4'], conditions=['CTR', 'DRUG'],
+                       images_per_condition=6, sort=True, H3=True)
+
+
+def test_iter_screen_chunks_keeps_images_whole(screen, tmp_path):
+    path = tmp_path / 'plate.csv'
+    screen.to_csv(path, index=False)
+    chunks = list(iter_screen_chunks(path, chunksize=500))
+    assert sum(len(chunk) for chunk in chunks) == len(screen)
+    images = [set(chunk['image_id']) for chunk in chunks]
+    assert all(not a & b for i, a in enumerate(images) for b in images[i + 1:])
+
+
+@pytest.mark.parametrize("H3", [False, True])
+def test_stream_matches_in_memory(screen, tmp_path, H3):
+    path = tmp_path / 'plate.csv'
+    screen.to_csv(path, index=False)
+    output = tmp_path / 'labelled.csv'
+    prop, modes = stream_cellcycle_analysis(path, H3=H3, chunksize=700, output=output)
+    expected = cellcycle_prop(cellcycle_analysis(screen, H3=H3))
+    keys = ["plate_id", "well", "cell_line", "condition", "cell_cycle"]
+    prop = prop.astype({'cell_cycle': str}).sort_values(keys).reset_index(drop=True)
+    expected = expected.astype({'cell_cycle': str}).sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(prop, expected, check_dtype=False)
+    labelled = pd.read_csv(output)
+    assert len(labelled) == len(cellcycle_analysis(screen, H3=H3))
+
+
+def test_stream_from_callable(screen):
+    plates = [plate for _, plate in screen.groupby('plate_id')]
+    prop, _ = stream_cellcycle_analysis(lambda: iter(plates))
+    expected = cellcycle_prop(cellcycle_analysis(screen))
+    assert np.allclose(np.sort(prop['percent']), np.sort(expected['percent']))
+
+
+def test_stream_reads_source_once(screen):
+    plates = [plate for _, plate in screen.groupby('plate_id')]
+    reads = []
+
+    def source():
+        reads.append(1)
+        return iter(plates)
+
+    stream_cellcycle_analysis(source)
+    assert len(reads) == 1
+
+
+def test_stream_needs_pyarrow(screen, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    with pytest.raises(ImportError, match=r"hhlab-ifanalysis\[parquet\]"):
+        stream_cellcycle_analysis(lambda: iter([screen]))
@@ -0,0 +1,85 @@
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.counts import count_per_cond
+from ifanalysis.normalisation import cellcycle_prop
+from ifanalysis.summary import PlateSummary
+
+
+@pytest.fixture
+def cellcycle_df():
+    rng = np.random.default_rng(5)
+    n = 2000
+    phases = np.array(['Sub-G1', 'G1', 'S', 'G2/M', 'Polyploid'])
+    df = pd.DataFrame({
+        'experiment': 'exp1',
+        'plate_id': rng.choice([1001, 1002], n),
+        'well': rng.choice(['C2', 'C3', 'C4'], n),
+        'cell_line': rng.choice(['RPE-1', 'HELA'], n),
+        'condition': rng.choice(['DRUG', 'CTR', 'DRUG2'], n),
+        'cell_cycle': rng.choice(phases, n),
+        'integrated_int_DAPI_norm': rng.lognormal(np.log(2.5), 0.4, n),
+        'intensity_mean_EdU_nucleus_norm': rng.lognormal(np.log(2), 0.8, n),
+    })
+    df.loc[::97, 'cell_cycle'] = np.nan
+    df.loc[::89, 'integrated_int_DAPI_norm'] = np.nan
+    return df
+
+
+def test_slices(cellcycle_df):
+    summary = PlateSummary.from_frame(cellcycle_df)
+    assert len(summary.data) == len(cellcycle_df)
+    for (cell_line, condition), data in cellcycle_df.groupby(['cell_line', 'condition']):
+        pd.testing.assert_frame_equal(summary.condition_data(cell_line, condition), data)
+    pd.testing.assert_frame_equal(summary.cell_line_data('HELA'),
+                                  cellcycle_df[cellcycle_df.cell_line == 'HELA'].sort_values('condition', kind='stable'))
+    assert summary.condition_data('HELA', 'missing').empty
+    assert PlateSummary.of(summary) is summary
+
+
+def test_proportions_and_counts(cellcycle_df):
+    summary = PlateSummary.from_frame(cellcycle_df)
+    pd.testing.assert_frame_equal(summary.proportions(), cellcycle_prop(cellcycle_df))
+    df_prop = cellcycle_prop(cellcycle_df)
+    pd.testing.assert_frame_equal(summary.proportions(['HELA']),
+                                  df_prop[df_prop.cell_line == 'HELA'].reset_index(drop=True))
+    pd.testing.assert_frame_equal(count_per_cond(summary, 'CTR'), count_per_cond(cellcycle_df, 'CTR'))
+
+
+def test_quantiles_and_histograms(cellcycle_df):
+    summary = PlateSummary.from_frame(cellcycle_df)
+    col = 'intensity_mean_EdU_nucleus_norm'
+    assert summary.quantile(col, 0.99) == cellcycle_df[col].quantile(0.99)
+    assert summary.quantile(col, 0.01, 'HELA') == cellcycle_df.loc[cellcycle_df.cell_line == 'HELA', col].quantile(0.01)
+    assert summary.quantile('integrated_int_DAPI_norm', 0.5) == cellcycle_df['integrated_int_DAPI_norm'].median()
+    data = summary.condition_data('RPE-1', 'CTR')['integrated_int_DAPI_norm'].dropna()
+    counts, edges = summary.histograms[('RPE-1', 'CTR')]
+    np.testing.assert_array_equal(edges, np.histogram_bin_edges(data, 'auto'))
+    assert counts.sum() == len(data)
+
+
+def test_plots_summarise_their_cell_line(cellcycle_df, monkeypatch):
+    import matplotlib.pyplot as plt
+    from ifanalysis.combplot import cellcycle_barplot, combplot, edu_limits
+    from ifanalysis.intensity import int_combplot
+
+    summarised = []
+    from_frame = PlateSummary.from_frame.__func__
+    monkeypatch.setattr(PlateSummary, 'from_frame',
+                        classmethod(lambda cls, df, **kwargs: summarised.append(set(df.cell_line))
+                                    or from_frame(cls, df, **kwargs)))
+    combplot(cellcycle_df, ['CTR', 'DRUG'], 'HELA', 'exp1', save=False)
+    int_combplot(cellcycle_df, ['CTR', 'DRUG'], 'HELA', 'intensity_mean_EdU_nucleus_norm', save=False)
+    assert summarised == [{'HELA'}, {'HELA'}]
+    summary = PlateSummary.of_cell_line(cellcycle_df, 'HELA')
+    assert PlateSummary.of_cell_line(summary, 'RPE-1') is summary
+    # the default EdU limits are still those of all cells
+    assert edu_limits(cellcycle_df)[1] == cellcycle_df.intensity_mean_EdU_nucleus_norm.quantile(0.99) * 1.5
+    fig, axes = plt.subplots(ncols=2)
+    cellcycle_barplot(axes[0], cellcycle_df, ['CTR', 'DRUG'], False)
+    cellcycle_barplot(axes[1], cellcycle_prop(cellcycle_df), ['CTR', 'DRUG'], False, proportions=True)
+    assert [p.get_height() for p in axes[0].patches] == [p.get_height() for p in axes[1].patches]
+    plt.close('all')
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ifanalysis.normalisation import agg_multinucleates, cellcycle_analysis
+from ifanalysis.synthetic import expected_phases, iter_plates, make_screen, screen_layout
+
+
+def test_layout():
+    layout = screen_layout(n_cell_lines=3, n_conditions=5, n_replicates=2, ctr='SCR')
+    assert len(layout) == 30 and layout.well.is_unique
+    assert layout.condition.unique().tolist() == ['SCR', 'cond_1', 'cond_2', 'cond_3', 'cond_4']
+    with pytest.raises(ValueError):
+        screen_layout(n_cell_lines=10, n_conditions=20)
+
+
+def test_make_screen():
+    df = make_screen(20_000, n_plates=2, seed=3)
+    assert df.plate_id.unique().tolist() == [1001, 1002]
+    assert df.groupby('plate_id').image_id.nunique().tolist() == [96, 96]
+    pd.testing.assert_frame_equal(df, make_screen(20_000, n_plates=2, seed=3))
+    assert not df.equals(make_screen(20_000, n_plates=2, seed=4))
+    # multinucleates share a Cyto_ID and add up to one cell each
+    agg = agg_multinucleates(df)
+    assert len(df) > len(agg) == 20_000
+    assert agg.integrated_int_DAPI.sum() == pytest.approx(df.integrated_int_DAPI.sum())
+
+
+def test_iter_plates():
+    df = make_screen(10_000, n_plates=3, categorical=True, dtype=np.float32)
+    assert df.well.dtype == 'category' and df.integrated_int_DAPI.dtype == np.float32
+    plates = list(iter_plates(10_000, n_plates=3, categorical=True, dtype=np.float32))
+    pd.testing.assert_frame_equal(pd.concat(plates, ignore_index=True), df)
+
+
+@pytest.mark.parametrize("H3", [False, True])
+def test_phases_recovered(H3):
+    df = cellcycle_analysis(make_screen(30_000, H3=H3, phases=True), H3=H3)
+    assert (df.cell_cycle.astype(str) == expected_phases(df, H3).astype(str)).mean() > 0.99